@@ -42,13 +42,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Removes itself unless FLOWGPT_PROFILING is set
+    "flowgptapp.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "flowgptapp.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "flowgptapp.middleware.QueryMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "flowgpt.urls"
@@ -142,3 +146,120 @@ BOWER_INSTALLED_APPS = (
 ADMIN_CHARTS_NVD3_JS_PATH = 'nvd3/build/nv.d3.min.js'
 ADMIN_CHARTS_NVD3_CSS_PATH = 'nvd3/build/nv.d3.min.css'
 ADMIN_CHARTS_D3_JS_PATH = 'd3/d3.min.js'
+
+# FlowGPT metrics
+# Directory shared by all worker processes for aggregating /metrics.
+# Leave unset to expose only the metrics of the serving process.
+FLOWGPT_METRICS_DIR = os.environ.get('FLOWGPT_METRICS_DIR')
+
+# Outbound email, delivered by "python manage.py dispatch_emails"
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'flowgpt@localhost')
+# Domain used in the Message-ID of queued emails
+FLOWGPT_EMAIL_DOMAIN = os.environ.get('FLOWGPT_EMAIL_DOMAIN', 'flowgpt.local')
+
+# Extra node types, as dicts of NodeType arguments or dotted paths to NodeType
+# instances; node types are also discovered from "flowgpt.node_types" entry points
+FLOWGPT_NODE_TYPES = []
+
+# Extra directories searched for translation dictionaries before the bundled ones
+FLOWGPT_TRANSLATION_DIRS = [d for d in os.environ.get('FLOWGPT_TRANSLATION_DIRS', '').split(os.pathsep) if d]
+
+# Regex node: size of the compiled pattern cache, default engine ("re", or the
+# linear-time "re2" from google-re2) and longest text a pattern may run on
+FLOWGPT_REGEX_CACHE_SIZE = int(os.environ.get('FLOWGPT_REGEX_CACHE_SIZE', 256))
+FLOWGPT_REGEX_ENGINE = os.environ.get('FLOWGPT_REGEX_ENGINE', 're')
+FLOWGPT_REGEX_MAX_INPUT_CHARS = int(os.environ.get('FLOWGPT_REGEX_MAX_INPUT_CHARS', 1_000_000))
+
+# Pool size of map nodes that do not set "workers" (defaults to the CPU count)
+FLOWGPT_MAP_WORKERS = int(os.environ['FLOWGPT_MAP_WORKERS']) if os.environ.get('FLOWGPT_MAP_WORKERS') else None
+
+# Longest a status long poll (?wait=) is held, in seconds
+FLOWGPT_STATUS_MAX_WAIT = float(os.environ.get('FLOWGPT_STATUS_MAX_WAIT', 30))
+
+# Cache of rendered pages. Local memory suits a single process; set
+# FLOWGPT_CACHE_DIR to share it between processes through the file-based
+# backend, so invalidations reach every worker
+if os.environ.get('FLOWGPT_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['FLOWGPT_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('FLOWGPT_CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'flowgpt',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('FLOWGPT_CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
+FLOWGPT_PAGE_CACHE = 'default'
+
+# Seconds the home and pipeline pages are cached; model signals invalidate
+# them earlier, the timeout covers bulk updates that send no signals
+FLOWGPT_PAGE_CACHE_TIMEOUT = int(os.environ.get('FLOWGPT_PAGE_CACHE_TIMEOUT', 600))
+
+# Seconds a submission's Idempotency-Key returns the original execution, and
+# the least seconds between two prunes of expired keys in one process
+FLOWGPT_IDEMPOTENCY_TTL = int(os.environ.get('FLOWGPT_IDEMPOTENCY_TTL', 24 * 3600))
+FLOWGPT_IDEMPOTENCY_PRUNE_INTERVAL = int(os.environ.get('FLOWGPT_IDEMPOTENCY_PRUNE_INTERVAL', 300))
+
+# Completion webhooks, delivered by "python manage.py dispatch_webhooks".
+# The secret signs deliveries of pipelines without a secret of their own
+FLOWGPT_WEBHOOK_SECRET = os.environ.get('FLOWGPT_WEBHOOK_SECRET', '')
+FLOWGPT_WEBHOOK_TIMEOUT = float(os.environ.get('FLOWGPT_WEBHOOK_TIMEOUT', 10))
+
+# Request profiling: with FLOWGPT_PROFILING=1, requests sent with the
+# "X-FlowGPT-Profile: 1" header get a Server-Timing header, and the latest
+# FLOWGPT_PROFILE_HISTORY of them are reported at /admin/profiling/
+FLOWGPT_PROFILING = os.environ.get('FLOWGPT_PROFILING', '') == '1'
+FLOWGPT_PROFILE_HISTORY = int(os.environ.get('FLOWGPT_PROFILE_HISTORY', 100))
+FLOWGPT_PROFILE_SLOW_QUERIES = int(os.environ.get('FLOWGPT_PROFILE_SLOW_QUERIES', 5))
+
+# Structured logging: the flowgptapp loggers write JSON lines to stderr from a
+# listener thread, so logging never blocks an execution. Debug events are
+# sampled to FLOWGPT_LOG_SAMPLE_RATE per second per message, in bursts of up
+# to FLOWGPT_LOG_SAMPLE_BURST
+FLOWGPT_LOG_LEVEL = os.environ.get('FLOWGPT_LOG_LEVEL', 'INFO')
+FLOWGPT_LOG_SAMPLE_RATE = float(os.environ.get('FLOWGPT_LOG_SAMPLE_RATE', 10))
+FLOWGPT_LOG_SAMPLE_BURST = int(os.environ.get('FLOWGPT_LOG_SAMPLE_BURST', 50))
+FLOWGPT_LOG_QUEUE_SIZE = int(os.environ.get('FLOWGPT_LOG_QUEUE_SIZE', 10000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'flowgptapp.logs.JsonFormatter'},
+    },
+    'filters': {
+        'execution_context': {'()': 'flowgptapp.logs.ExecutionContextFilter'},
+        'sampling': {
+            '()': 'flowgptapp.logs.SamplingFilter',
+            'rate': FLOWGPT_LOG_SAMPLE_RATE,
+            'burst': FLOWGPT_LOG_SAMPLE_BURST,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'flowgptapp.logs.QueueStreamHandler',
+            'queue_size': FLOWGPT_LOG_QUEUE_SIZE,
+            'formatter': 'json',
+            'filters': ['execution_context', 'sampling'],
+        },
+    },
+    'loggers': {
+        'flowgptapp': {
+            'handlers': ['queue'],
+            'level': FLOWGPT_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
@@ -17,18 +17,21 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from flowgptapp import views
-from flowgptapp.dashboard import AdminDashboardView
+from flowgptapp.dashboard import AdminDashboardView, ProfilingReportView
 
 urlpatterns = [
     path('admin/dashboard/', AdminDashboardView.as_view(), name='admin_dashboard'),
+    path('admin/profiling/', ProfilingReportView.as_view(), name='admin_profiling'),
     path('admin/', admin.site.urls),
     path('', views.home, name='home'),
     path('pipeline/<int:pipeline_id>/', views.pipeline_detail, name='pipeline_detail'),
     path('executions/', views.execution_history, name='execution_history'),
+    path('api/executions/', views.execution_history_api, name='execution_history_api'),
     path('execution/<int:execution_id>/', views.execution_detail, name='execution_detail'),
     path('contact/', views.contact, name='contact'),
     path('api/execute/', views.execute_pipeline_view, name='execute_pipeline'),
     path('api/execution/<int:execution_id>/status/', views.get_execution_status, name='execution_status'),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # Customize admin site
@@ -2,7 +2,9 @@ from django.contrib import admin
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Node, Pipeline, Edge, PipelineExecution, ExecutionStep, Contact
+from django.db.models import Count
+from django.utils import timezone
+from .models import Node, Pipeline, Edge, PipelineExecution, ExecutionStep, Contact, OutboundEmail, WebhookDelivery
 
 
 class EdgeInline(admin.TabularInline):
@@ -45,9 +47,13 @@ class PipelineAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description')
     inlines = [EdgeInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(edge_total=Count('edges'))
+    
     def edge_count(self, obj):
-        return obj.edge_set.count()
+        return obj.edge_total
     edge_count.short_description = 'Edges'
+    edge_count.admin_order_field = 'edge_total'
     
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
@@ -60,6 +66,7 @@ class EdgeAdmin(admin.ModelAdmin):
     list_display = ('id', 'pipeline', 'source', 'target', 'order')
     list_filter = ('pipeline', 'source', 'target')
     search_fields = ('pipeline__name', 'source__name', 'target__name')
+    list_select_related = ('pipeline', 'source', 'target')
     
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
@@ -71,13 +78,18 @@ class EdgeAdmin(admin.ModelAdmin):
 class PipelineExecutionAdmin(admin.ModelAdmin):
     list_display = ('id', 'pipeline', 'started_at', 'completed_at', 'is_complete', 'step_count')
     list_filter = ('pipeline', 'is_complete', 'started_at')
-    search_fields = ('pipeline__name',)
+    search_fields = ('pipeline__name', '=idempotency_key')
     inlines = [ExecutionStepInline]
-    readonly_fields = ('started_at', 'completed_at', 'formatted_output')
+    readonly_fields = ('started_at', 'completed_at', 'idempotency_key', 'formatted_output')
+    list_select_related = ('pipeline',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(step_total=Count('steps'))
     
     def step_count(self, obj):
-        return obj.executionstep_set.count()
+        return obj.step_total
     step_count.short_description = 'Steps'
+    step_count.admin_order_field = 'step_total'
     
     def formatted_output(self, obj):
         if not obj.output_data:
@@ -103,6 +115,7 @@ class ExecutionStepAdmin(admin.ModelAdmin):
     list_filter = ('is_complete', 'node', 'execution__pipeline')
     search_fields = ('node__name', 'execution__pipeline__name')
     readonly_fields = ('started_at', 'completed_at', 'formatted_input', 'formatted_output')
+    list_select_related = ('execution__pipeline', 'node')
     
     def formatted_input(self, obj):
         if not obj.input_data:
@@ -145,3 +158,49 @@ class ContactAdmin(admin.ModelAdmin):
         extra_context = extra_context or {}
         extra_context['dashboard_url'] = reverse('admin_dashboard')
         return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('recipient', 'subject', 'message_id')
+    readonly_fields = ('message_id', 'execution', 'created_at', 'sent_at', 'claim_token', 'claimed_at')
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=OutboundEmail.STATUS_SENT).update(
+            status=OutboundEmail.STATUS_PENDING, next_attempt_at=timezone.now(), claim_token=None
+        )
+        self.message_user(request, f"{updated} email(s) queued for delivery.")
+    retry_now.short_description = 'Retry selected emails now'
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['dashboard_url'] = reverse('admin_dashboard')
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    # The execution's id only: its row holds the input and output texts
+    list_display = ('id', 'pipeline', 'execution_id', 'url', 'status', 'response_status', 'attempts',
+                    'next_attempt_at', 'delivered_at')
+    list_filter = ('status', 'pipeline', 'created_at')
+    search_fields = ('url', '=event_id')
+    readonly_fields = ('event_id', 'execution', 'payload', 'created_at', 'delivered_at', 'response_status',
+                       'claim_token', 'claimed_at')
+    list_select_related = ('pipeline',)
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=WebhookDelivery.STATUS_DELIVERED).update(
+            status=WebhookDelivery.STATUS_PENDING, next_attempt_at=timezone.now(), claim_token=None
+        )
+        self.message_user(request, f"{updated} webhook(s) queued for delivery.")
+    retry_now.short_description = 'Retry selected webhooks now'
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['dashboard_url'] = reverse('admin_dashboard')
+        return super().changelist_view(request, extra_context=extra_context)
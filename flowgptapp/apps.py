@@ -5,3 +5,6 @@ class FlowgptappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'flowgptapp'
     verbose_name = 'FlowGPT Automation'
+
+    def ready(self):
+        from . import signals  # noqa: F401
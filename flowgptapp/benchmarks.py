@@ -0,0 +1,286 @@
+"""
+Shared helpers for the FlowGPT benchmark commands.
+Provides synthetic input generation, latency statistics, memory readings
+and comparison of benchmark results against a saved baseline.
+"""
+import json
+import math
+import random
+import re
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+_WORDS = (
+    "hello world welcome thank you goodbye pipeline node graph state text "
+    "summary translate clean data flow automation process result input output "
+    "the a of and to in is it that for on with as by this be are from"
+).split()
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a human readable size such as ``1KB`` or ``50MB`` into bytes.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?B)?\s*', value.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2) or 'B'])
+
+
+def format_size(size: int) -> str:
+    """
+    Format a byte count using the largest whole unit.
+    """
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def generate_text(size: int, seed: int = 0) -> str:
+    """
+    Generate deterministic English-like text of exactly ``size`` characters,
+    with sentences, punctuation, URLs and irregular whitespace.
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    # Build a block of up to 64 KB and repeat it for large inputs
+    block_size = min(size, 64 * 1024)
+    while length < block_size:
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 14))]
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), f"https://example.com/{rng.choice(_WORDS)}?id={rng.randint(1, 999)}")
+        sentence = ' '.join(words).capitalize() + rng.choice('..!?') + rng.choice(('  ', ' ', '\n', ' \t'))
+        parts.append(sentence)
+        length += len(sentence)
+    block = ''.join(parts)
+    repeats = size // len(block) + 1
+    return (block * repeats)[:size]
+
+
+def generate_pathological_text(size: int) -> str:
+    """
+    Generate ``size`` characters of adversarial input for the text cleaning
+    patterns: long whitespace-free runs of URL characters, unclosed tags,
+    dotted local parts without "@" and repeated "@" separators.
+    """
+    segment = max(size // 4, 1)
+    pieces = [
+        ('http://' + 'a$-_@.&+' * segment)[:segment],
+        ('<' * segment),
+        ('a.' * segment)[:segment],
+        ('x@' + 'a-' * segment)[:segment],
+    ]
+    return (''.join(pieces) + 'a@' * size)[:size]
+
+
+# Input generators selectable in bench_nodes
+INPUT_GENERATORS = {
+    'prose': generate_text,
+    'pathological': generate_pathological_text,
+}
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    Linear-interpolated percentile of an already sorted sequence.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return sorted_values[int(rank)]
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def latency_summary(samples: Iterable[float]) -> Dict[str, float]:
+    """
+    Summarise latency samples (seconds) as milliseconds.
+    """
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'min': values[0] * 1000,
+        'mean': sum(values) / len(values) * 1000,
+        'p50': percentile(values, 50) * 1000,
+        'p95': percentile(values, 95) * 1000,
+        'p99': percentile(values, 99) * 1000,
+        'max': values[-1] * 1000,
+    }
+
+
+def traced_peak_mb(function: Callable[[], Any]) -> float:
+    """
+    Peak memory allocated by Python while ``function`` runs, in MB above
+    what was allocated before. Tracing slows allocation down, so measure it
+    in a run of its own rather than in a timed one.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        function()
+        return (tracemalloc.get_traced_memory()[1] - before) / 1024 ** 2
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB, where the platform reports
+    it. It never goes down, so it covers everything the process ran so far.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    divisor = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return peak / divisor
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_results(path: str, data: Dict[str, Any]) -> None:
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                        key_fields: Sequence[str], metric: str,
+                        threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare ``metric`` of every result with the matching baseline entry.
+
+    Entries are matched on ``key_fields``; ``metric`` may be a dotted path
+    such as ``latency_ms.p50``. Returns one row per matched entry with the
+    relative change in percent and whether it exceeds ``threshold``.
+    """
+    def key(entry):
+        return tuple(entry.get(field) for field in key_fields)
+
+    def value(entry):
+        for part in metric.split('.'):
+            entry = entry[part]
+        return entry
+
+    baseline_by_key = {key(entry): entry for entry in baseline}
+    rows = []
+    for entry in results:
+        previous = baseline_by_key.get(key(entry))
+        if previous is None:
+            continue
+        old, new = value(previous), value(entry)
+        change = (new - old) / old * 100 if old else 0.0
+        rows.append({
+            'key': dict(zip(key_fields, key(entry))),
+            'baseline': old,
+            'current': new,
+            'change_pct': change,
+            'regressed': change > threshold,
+        })
+    return rows
+
+
+# Config variants exercised for each node type by bench_nodes
+NODE_CONFIG_VARIANTS = {
+    'clean_text': [
+        {},
+        {'remove_special_chars': True},
+        {'remove_urls': True},
+        {'remove_special_chars': True, 'remove_urls': True},
+        {'strip_html': True, 'mask_emails': True},
+        {'normalize_unicode': 'NFKC'},
+        {'remove_special_chars': True, 'remove_urls': True, 'strip_html': True, 'mask_emails': True},
+    ],
+    'uppercase': [{}],
+    'summary': [
+        {'num_sentences': 2},
+        {'num_sentences': 2, 'max_chars': 150},
+        {'num_sentences': 0},
+        {'num_sentences': 3, 'mode': 'extractive'},
+    ],
+    'translate': [
+        {'target_language': 'spanish'},
+        {'target_language': 'french'},
+        {'target_language': 'german'},
+    ],
+    'regex': [
+        {'pattern': r'\d+', 'replacement': '#'},
+        {'pattern': r'\b(the|and)\b', 'flags': 'i', 'replacement': ''},
+        {'pattern': r'\b\w{8,}\b', 'mode': 'extract'},
+    ],
+    'map': [
+        {'nodes': ['clean_text', 'uppercase'], 'workers': 1},
+        {'nodes': ['clean_text', 'uppercase'], 'split': 'chunks', 'pool': 'process'},
+    ],
+    # Reduce only combines the chunks of a map node, it has no text input
+    'reduce': [],
+    'email': [{}],
+}
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    """
+    Stable string identifying a config variant in benchmark results.
+    """
+    return json.dumps(config, sort_keys=True)
+
+
+def time_node_function(node_function, text: str, config: Dict[str, Any],
+                       repeat: int = 3, min_time: float = 0.05) -> float:
+    """
+    Best per-call time in seconds of ``node_function`` over ``text``.
+
+    Each measurement loops until ``min_time`` has elapsed so small inputs are
+    not dominated by timer resolution; the fastest of ``repeat`` measurements
+    is returned. Every call gets a fresh state since node functions mutate it.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            node_function({'text': text, 'config': dict(config), 'metadata': {}})
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+
+def fit_complexity(sizes: Sequence[int], seconds: Sequence[float]) -> Optional[float]:
+    """
+    Fit ``seconds ~ c * size ** k`` by least squares on a log-log scale and
+    return the exponent ``k`` (1.0 is linear, 2.0 is quadratic).
+    """
+    points = [(math.log(n), math.log(t)) for n, t in zip(sizes, seconds) if n > 0 and t > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
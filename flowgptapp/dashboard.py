@@ -1,11 +1,14 @@
 """
 Admin dashboard for FlowGPT with data visualizations.
 """
+from django.conf import settings
+from django.shortcuts import redirect
 from django.views.generic import TemplateView
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 from django.db.models import Count
 from .models import Node, Pipeline, Edge, PipelineExecution, ExecutionStep, Contact
+from .profiling import REPORT
 from .admin_charts import (
     generate_contact_charts,
     generate_node_charts,
@@ -48,4 +51,21 @@ class AdminDashboardView(TemplateView):
         context['execution_charts'] = generate_execution_charts()
         context['execution_step_charts'] = generate_execution_step_charts()
         
-        return context 
\ No newline at end of file
+        return context
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfilingReportView(TemplateView):
+    """Latest profiled requests of this process, per view and one by one."""
+    template_name = 'admin/profiling.html'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiling_enabled'] = getattr(settings, 'FLOWGPT_PROFILING', False)
+        context['views'] = REPORT.by_view()
+        context['entries'] = REPORT.entries()
+        return context
+    
+    def post(self, request, *args, **kwargs):
+        REPORT.clear()
+        return redirect('admin_profiling')
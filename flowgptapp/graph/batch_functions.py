@@ -0,0 +1,151 @@
+"""
+Batch counterparts of the FlowGPT node functions.
+Each function takes the states of many documents passing through the same
+node (and therefore sharing one config) and processes them together, mostly
+by operating on a single joined buffer instead of one call per document.
+Results are identical to calling the per-item node function on each state.
+"""
+from typing import Dict, Any, List
+from .registry import get_node_type
+from .state import layer, timestamp
+from .summarizer import summarize
+from .text_cleaner import BATCH_SEPARATOR, get_cleaner
+from .translation import get_translator
+
+
+def _batch_config(states: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return states[0].get("config", {}) if states else {}
+
+
+def _join(texts: List[str]):
+    """
+    Join texts into one buffer, or return None when a text contains the
+    separator and the batch has to be processed item by item.
+    """
+    if any(BATCH_SEPARATOR in text for text in texts):
+        return None
+    return BATCH_SEPARATOR.join(texts)
+
+
+def _update_metadata(states: List[Dict[str, Any]], metadata: Dict[str, Any]) -> None:
+    # One copy-on-write layer holding the update is shared by every state
+    for state in states:
+        state["metadata"] = layer(state.get("metadata"), metadata)
+
+
+def clean_text_batch(states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Cleans all texts with a single scan of the compiled cleaner.
+    """
+    cleaner = get_cleaner(_batch_config(states))
+    cleaned = cleaner.clean_batch([state.get("text", "") for state in states])
+    for state, text in zip(states, cleaned):
+        state["text"] = text
+
+    _update_metadata(states, {
+        "clean_text_applied": True,
+        "clean_text_timestamp": timestamp()
+    })
+
+    return states
+
+
+def convert_to_uppercase_batch(states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Converts all texts to uppercase with one call on the joined buffer.
+    """
+    texts = [state.get("text", "") for state in states]
+    buffer = _join(texts)
+    if buffer is None:
+        converted = [text.upper() for text in texts]
+    else:
+        converted = buffer.upper().split(BATCH_SEPARATOR)
+    for state, text in zip(states, converted):
+        state["text"] = text
+
+    _update_metadata(states, {
+        "uppercase_applied": True,
+        "uppercase_timestamp": timestamp()
+    })
+
+    return states
+
+
+def basic_summary_batch(states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Summarises all texts with the streaming summariser.
+    """
+    config = _batch_config(states)
+    num_sentences = config.get("num_sentences", 2)
+    max_chars = config.get("max_chars", None)
+    mode = config.get("mode", "lead")
+
+    for state in states:
+        state["summary"] = summarize(state.get("text", ""), num_sentences, max_chars, mode)
+
+    _update_metadata(states, {
+        "summary_applied": True,
+        "summary_timestamp": timestamp(),
+        "summary_config": {
+            "num_sentences": num_sentences,
+            "max_chars": max_chars,
+            "mode": mode
+        }
+    })
+
+    return states
+
+
+def translate_batch(states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Translates all texts in one pass of the phrase translator over the
+    joined buffer. Phrases never extend across the separator.
+    """
+    config = _batch_config(states)
+    target_lang = config.get("target_language", "spanish")
+    source_lang = config.get("source_language", "english")
+
+    texts = [state.get("text", "") for state in states]
+    translator = get_translator(source_lang, target_lang)
+    if translator is None:
+        translated = texts
+    else:
+        buffer = _join(texts)
+        if buffer is None:
+            translated = [translator.translate(text) for text in texts]
+        else:
+            translated = translator.translate(buffer).split(BATCH_SEPARATOR)
+    for state, text in zip(states, translated):
+        state["translated_text"] = text
+
+    _update_metadata(states, {
+        "translation_applied": True,
+        "translation_timestamp": timestamp(),
+        "translation_config": {
+            "source_language": source_lang,
+            "target_language": target_lang
+        }
+    })
+
+    return states
+
+
+def per_item(node_function):
+    """
+    Batch adapter for node functions without a dedicated batch form.
+    """
+    def batch_function(states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [node_function(state) for state in states]
+    batch_function.__name__ = f"{node_function.__name__}_batch"
+    return batch_function
+
+
+def get_batch_function(node_type: str):
+    """
+    Return the batch form of a node type, adapting the per-item function
+    when it declares no dedicated one. Returns None for unknown node types.
+    """
+    declared = get_node_type(node_type)
+    if declared is None:
+        return None
+    return declared.batch_function or per_item(declared.function)
@@ -0,0 +1,273 @@
+"""
+Map-reduce engine used by the map and reduce nodes.
+
+The map node splits the text into paragraphs or chunks of about
+``chunk_size`` characters, groups them into tasks of about ``chunk_size``
+characters and runs a nested sequence of node types over every task on a
+shared thread or process pool. Each task runs the nested nodes with their
+batch functions, so a task of many short paragraphs costs one call per
+node. The results are stored in the ``chunks`` state field together with the
+text that separated each chunk from the next one, and the reduce node
+combines them into a single field.
+
+Pure Python node functions hold the GIL, so only the process pool spreads
+them over several cores; the thread pool suits node types that release it.
+"""
+import atexit
+import os
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from .registry import get_node_type, import_object
+from .state import ExecutionState
+
+
+SPLIT_MODES = ('paragraphs', 'chunks')
+
+POOL_KINDS = ('process', 'thread')
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Fields of a nested run kept as the result of a chunk
+CHUNK_FIELDS = ('text', 'summary', 'translated_text')
+
+# Node types that cannot run inside a map node
+NESTED_EXCLUDED = ('map', 'reduce', 'subpipeline')
+
+# Blank lines and the whitespace after them
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n\s*')
+
+WHITESPACE_RUN = re.compile(r'\s+')
+
+
+def split_text(text: str, split: str = 'paragraphs',
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Yield ``(chunk, separator)`` pairs; concatenating every chunk followed
+    by its separator gives back ``text``. Chunks are cut at the last
+    whitespace before ``chunk_size`` characters, or at ``chunk_size`` when a
+    chunk has no whitespace.
+    """
+    if split not in SPLIT_MODES:
+        raise ValueError(f"Unsupported split mode: {split}")
+    start = 0
+    if split == 'paragraphs':
+        for boundary in PARAGRAPH_BREAK.finditer(text):
+            yield text[start:boundary.start()], boundary.group()
+            start = boundary.end()
+        yield text[start:], ''
+        return
+
+    length = len(text)
+    while length - start > chunk_size:
+        end = start + chunk_size
+        cut = max(text.rfind(' ', start, end), text.rfind('\n', start, end))
+        if cut <= start:
+            yield text[start:end], ''
+            start = end
+            continue
+        while cut > start and text[cut - 1].isspace():
+            cut -= 1
+        separator = WHITESPACE_RUN.match(text, cut).group()
+        yield text[start:cut], separator
+        start = cut + len(separator)
+    yield text[start:], ''
+
+
+def group_chunks(pairs, chunk_size: int) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Group consecutive chunks into tasks of at least ``chunk_size`` characters.
+    """
+    group = []
+    size = 0
+    for pair in pairs:
+        group.append(pair)
+        size += len(pair[0])
+        if size >= chunk_size:
+            yield group
+            group = []
+            size = 0
+    if group:
+        yield group
+
+
+def get_steps(config: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    The ``(node_type, config)`` pairs a map node runs over every chunk.
+    """
+    steps = []
+    for entry in config.get("nodes") or []:
+        if isinstance(entry, str):
+            entry = {"node_type": entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f"Invalid map node entry: {entry!r}")
+        name = entry.get("node_type")
+        node_type = get_node_type(name)
+        if node_type is None:
+            raise ValueError(f"Unknown node type: {name}")
+        if name in NESTED_EXCLUDED or not node_type.pure:
+            raise ValueError(f"Node type {name} cannot run inside a map node")
+        node_config = entry.get("config") or {}
+        node_type.validate(node_config)
+        steps.append((name, node_config))
+    if not steps:
+        raise ValueError("A map node needs a list of \"nodes\" to run over each chunk")
+    return steps
+
+
+def run_steps(texts: List[str], steps: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Run the nested node types over a group of chunks, returning the result
+    fields of every chunk. Runs in the pool workers.
+    """
+    from .batch_functions import get_batch_function
+
+    states = [ExecutionState(text=text, config={}, metadata={}) for text in texts]
+    for name, node_config in steps:
+        for state in states:
+            state["config"] = dict(node_config)
+        states = get_batch_function(name)(states)
+    return [{field: state[field] for field in CHUNK_FIELDS if field in state} for state in states]
+
+
+def _run_group(group: List[Tuple[str, str]], steps) -> List[Dict[str, Any]]:
+    results = run_steps([chunk for chunk, _ in group], steps)
+    for result, (_, separator) in zip(results, group):
+        result["separator"] = separator
+    return results
+
+
+def _init_process_worker() -> None:
+    # Forked workers inherit the configured app registry, spawned ones set it up
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+_pools: Dict[Tuple[str, int], Executor] = {}
+_pools_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return getattr(settings, 'FLOWGPT_MAP_WORKERS', None) or os.cpu_count() or 1
+
+
+def get_pool(kind: str, workers: int) -> Executor:
+    """
+    Return the shared pool of the given kind and size, starting it on first use.
+    """
+    if kind not in POOL_KINDS:
+        raise ValueError(f"Unsupported pool: {kind}")
+    key = (kind, workers)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                if kind == 'process':
+                    pool = ProcessPoolExecutor(workers, initializer=_init_process_worker)
+                else:
+                    pool = ThreadPoolExecutor(workers, thread_name_prefix='flowgpt-map')
+                _pools[key] = pool
+    return pool
+
+
+@atexit.register
+def shutdown_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def map_text(text: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Split ``text`` as configured and run the nested node types over every
+    chunk, on a pool when there is more than one task.
+    """
+    steps = get_steps(config)
+    chunk_size = int(config.get("chunk_size") or DEFAULT_CHUNK_SIZE)
+    groups = list(group_chunks(split_text(text, config.get("split", "paragraphs"), chunk_size), chunk_size))
+    workers = int(config.get("workers") or default_workers())
+    if len(groups) == 1 or workers == 1:
+        return [result for group in groups for result in _run_group(group, steps)]
+
+    kind = config.get("pool", "process")
+    pool = get_pool(kind, workers)
+    try:
+        results = pool.map(_run_group, groups, [steps] * len(groups))
+        return [result for group_results in results for result in group_results]
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool for the next run
+        with _pools_lock:
+            _pools.pop((kind, workers), None)
+        raise
+
+
+def _join(values: List[str], separators: List[str], config: Dict[str, Any]) -> str:
+    separator = config.get("separator")
+    if separator is not None:
+        return separator.join(values)
+    # Put back the text that separated the chunks
+    return ''.join(value + sep for value, sep in zip(values, separators))
+
+
+COMBINERS: Dict[str, Callable] = {
+    'join': _join,
+    'concat': lambda values, separators, config: ''.join(values),
+    'first': lambda values, separators, config: next((value for value in values if value), ''),
+}
+
+
+def get_combiner(name: str) -> Callable:
+    """
+    A combiner by name or by the import path of a callable taking the chunk
+    values, their separators and the reduce config.
+    """
+    combiner = COMBINERS.get(name)
+    if combiner is not None:
+        return combiner
+    try:
+        return import_object(name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Unknown combiner {name!r}: {e}")
+
+
+def reduce_chunks(chunks: Optional[List[Dict[str, Any]]], config: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Combine a field of the chunk results. Returns the target field and its value.
+    """
+    if chunks is None:
+        raise ValueError("A reduce node needs a map node before it")
+    field = config.get("field", "text")
+    target = config.get("target", field)
+    if field not in CHUNK_FIELDS or target not in CHUNK_FIELDS:
+        raise ValueError(f"Reduce fields must be one of: {', '.join(CHUNK_FIELDS)}")
+    combiner = get_combiner(config.get("combiner", "join"))
+    values = [chunk.get(field) or '' for chunk in chunks]
+    separators = [chunk.get("separator", '') for chunk in chunks]
+    return target, combiner(values, separators, config)
+
+
+def validate_map_config(config: Optional[Dict[str, Any]]) -> None:
+    config = config or {}
+    if config.get("split", "paragraphs") not in SPLIT_MODES:
+        raise ValueError(f"Unsupported split mode: {config.get('split')}")
+    if config.get("pool", "process") not in POOL_KINDS:
+        raise ValueError(f"Unsupported pool: {config.get('pool')}")
+    get_steps(config)
+
+
+def validate_reduce_config(config: Optional[Dict[str, Any]]) -> None:
+    config = config or {}
+    for key in ("field", "target"):
+        if config.get(key, "text") not in CHUNK_FIELDS:
+            raise ValueError(f"Reduce {key} must be one of: {', '.join(CHUNK_FIELDS)}")
+    get_combiner(config.get("combiner", "join"))
@@ -3,10 +3,13 @@ Node functions for FlowGPT LangGraph implementation.
 These functions implement various text processing operations.
 They are designed to be used as nodes in a LangGraph workflow.
 """
-import re
-import json
-import datetime
 from typing import Dict, Any, Optional
+from ..outbox import new_message_id
+from . import mapreduce, patterns
+from .state import timestamp
+from .summarizer import summarize
+from .text_cleaner import get_cleaner
+from .translation import get_translator
 
 
 def clean_text(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -15,28 +18,21 @@ def clean_text(state: Dict[str, Any]) -> Dict[str, Any]:
     - Removing extra whitespace
     - Removing special characters if specified in config
     - Removing URLs if specified in config
+    - Stripping HTML tags if specified in config
+    - Masking email addresses if specified in config
+    - Applying unicode normalisation if specified in config
+    The options are compiled once per config into a single scanner.
     """
     text = state.get("text", "")
     config = state.get("config", {})
     
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # Remove special characters if configured
-    if config.get("remove_special_chars", False):
-        text = re.sub(r'[^\w\s]', '', text)
-    
-    # Remove URLs if configured
-    if config.get("remove_urls", False):
-        text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', text)
-    
     # Update state with processed text
-    state["text"] = text
+    state["text"] = get_cleaner(config).clean(text)
     
     # Add processing metadata
     state.setdefault("metadata", {}).update({
         "clean_text_applied": True,
-        "clean_text_timestamp": str(datetime.datetime.now())
+        "clean_text_timestamp": timestamp()
     })
     
     return state
@@ -52,7 +48,7 @@ def convert_to_uppercase(state: Dict[str, Any]) -> Dict[str, Any]:
     # Add processing metadata
     state.setdefault("metadata", {}).update({
         "uppercase_applied": True,
-        "uppercase_timestamp": str(datetime.datetime.now())
+        "uppercase_timestamp": timestamp()
     })
     
     return state
@@ -60,7 +56,8 @@ def convert_to_uppercase(state: Dict[str, Any]) -> Dict[str, Any]:
 
 def basic_summary(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Creates a basic summary by taking the first N sentences or characters.
+    Creates a basic summary by taking the first N sentences or characters,
+    or in extractive mode the N sentences with the most frequent terms.
     This is a rule-based approach, not using any NLP/AI.
     """
     text = state.get("text", "")
@@ -69,18 +66,10 @@ def basic_summary(state: Dict[str, Any]) -> Dict[str, Any]:
     # Default to first 2 sentences if not specified
     num_sentences = config.get("num_sentences", 2)
     max_chars = config.get("max_chars", None)
+    mode = config.get("mode", "lead")
     
-    # Simple sentence splitting (this is a basic implementation)
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    
-    if num_sentences and num_sentences > 0:
-        summary = ' '.join(sentences[:min(num_sentences, len(sentences))])
-    else:
-        summary = text
-    
-    # Truncate to max_chars if specified
-    if max_chars and len(summary) > max_chars:
-        summary = summary[:max_chars] + "..."
+    # Sentences are read lazily, so only the part of the text needed is scanned
+    summary = summarize(text, num_sentences, max_chars, mode)
     
     # Store the summary while preserving original text
     state["summary"] = summary
@@ -88,10 +77,11 @@ def basic_summary(state: Dict[str, Any]) -> Dict[str, Any]:
     # Add processing metadata
     state.setdefault("metadata", {}).update({
         "summary_applied": True,
-        "summary_timestamp": str(datetime.datetime.now()),
+        "summary_timestamp": timestamp(),
         "summary_config": {
             "num_sentences": num_sentences,
-            "max_chars": max_chars
+            "max_chars": max_chars,
+            "mode": mode
         }
     })
     
@@ -100,73 +90,26 @@ def basic_summary(state: Dict[str, Any]) -> Dict[str, Any]:
 
 def translate(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Translates text using a simple dictionary mapping.
-    This is a mock function that only supports a few hardcoded translations.
+    Translates text using the dictionary for the configured language pair.
+    Dictionaries are loaded once and matched phrase by phrase, preferring the
+    longest phrase and preserving the case and punctuation of the original.
     """
     text = state.get("text", "")
     config = state.get("config", {})
     target_lang = config.get("target_language", "spanish")
+    source_lang = config.get("source_language", "english")
     
-    # Mock translations for a few common phrases
-    translations = {
-        "english": {
-            "spanish": {
-                "hello": "hola",
-                "world": "mundo",
-                "welcome": "bienvenido",
-                "thank you": "gracias",
-                "goodbye": "adiós"
-            },
-            "french": {
-                "hello": "bonjour",
-                "world": "monde",
-                "welcome": "bienvenue",
-                "thank you": "merci",
-                "goodbye": "au revoir"
-            },
-            "german": {
-                "hello": "hallo",
-                "world": "welt",
-                "welcome": "willkommen",
-                "thank you": "danke",
-                "goodbye": "auf wiedersehen"
-            }
-        }
-    }
-    
-    source_lang = "english"  # Assume English as source for this demo
-    
-    if target_lang in translations.get(source_lang, {}):
-        words = text.lower().split()
-        translated_words = []
-        
-        for word in words:
-            # Remove punctuation for lookup
-            clean_word = re.sub(r'[^\w\s]', '', word)
-            
-            # Try to translate the word
-            if clean_word in translations[source_lang][target_lang]:
-                translated_word = translations[source_lang][target_lang][clean_word]
-                
-                # Preserve capitalization
-                if word[0].isupper():
-                    translated_word = translated_word.capitalize()
-                
-                translated_words.append(translated_word)
-            else:
-                # Keep original word if no translation available
-                translated_words.append(word)
-        
-        translated_text = ' '.join(translated_words)
-        state["translated_text"] = translated_text
+    translator = get_translator(source_lang, target_lang)
+    if translator is not None:
+        state["translated_text"] = translator.translate(text)
     else:
-        # If target language not supported, keep original
+        # If the language pair is not supported, keep original
         state["translated_text"] = text
     
     # Add processing metadata
     state.setdefault("metadata", {}).update({
         "translation_applied": True,
-        "translation_timestamp": str(datetime.datetime.now()),
+        "translation_timestamp": timestamp(),
         "translation_config": {
             "source_language": source_lang,
             "target_language": target_lang
@@ -176,10 +119,86 @@ def translate(state: Dict[str, Any]) -> Dict[str, Any]:
     return state
 
 
+def regex(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replaces or extracts the matches of the configured patterns.
+    Compiled patterns are cached across executions and checked for
+    catastrophic backtracking when first compiled.
+    """
+    text = state.get("text", "")
+    config = state.get("config", {})
+    mode = config.get("mode", "replace")
+    
+    state["text"], count = patterns.apply(text, config)
+    
+    # Add processing metadata
+    state.setdefault("metadata", {}).update({
+        "regex_applied": True,
+        "regex_timestamp": timestamp(),
+        "regex_mode": mode,
+        "regex_match_count": count
+    })
+    
+    return state
+
+
+def map_chunks(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Splits the text into paragraphs or chunks and runs the configured
+    nested nodes over every chunk in parallel on a thread or process pool.
+    The results are kept in "chunks" for a reduce node to combine.
+    """
+    text = state.get("text", "")
+    config = state.get("config", {})
+    
+    chunks = mapreduce.map_text(text, config)
+    state["chunks"] = chunks
+    
+    # Add processing metadata
+    state.setdefault("metadata", {}).update({
+        "map_applied": True,
+        "map_timestamp": timestamp(),
+        "map_chunk_count": len(chunks)
+    })
+    
+    return state
+
+
+def reduce_chunks(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combines a field of the chunk results of the preceding map node,
+    by default joining the chunk texts with their original separators.
+    """
+    config = state.get("config", {})
+    
+    target, value = mapreduce.reduce_chunks(state.get("chunks"), config)
+    state[target] = value
+    # The chunks are consumed, so they are not carried through later steps
+    state["chunks"] = None
+    
+    # Add processing metadata
+    state.setdefault("metadata", {}).update({
+        "reduce_applied": True,
+        "reduce_timestamp": timestamp(),
+        "reduce_combiner": config.get("combiner", "join")
+    })
+    
+    return state
+
+
+def subpipeline(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Placeholder for sub-pipeline nodes, which are replaced by the nodes of
+    the pipeline they reference when the parent pipeline is compiled.
+    """
+    raise ValueError("Sub-pipeline nodes are inlined when their pipeline is compiled and never run")
+
+
 def send_email(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Mock email sending function.
-    In a real application, this would connect to an email API.
+    Queues the text as an email and returns immediately.
+    The executor stores the message in the outbox and the email dispatcher
+    delivers it in the background, so no SMTP work happens in the pipeline.
     """
     config = state.get("config", {})
     text = state.get("text", "")
@@ -188,13 +207,15 @@ def send_email(state: Dict[str, Any]) -> Dict[str, Any]:
     recipient = config.get("recipient", "user@example.com")
     subject = config.get("subject", "Message from FlowGPT")
     
-    # Mock sending email
     email_result = {
         "success": True,
+        "status": "queued",
+        "message_id": new_message_id(),
+        "from_email": config.get("from_email"),
         "recipient": recipient,
         "subject": subject,
         "body": text,
-        "sent_at": str(datetime.datetime.now())
+        "queued_at": timestamp()
     }
     
     # Add email result to state
@@ -202,18 +223,12 @@ def send_email(state: Dict[str, Any]) -> Dict[str, Any]:
     
     # Add processing metadata
     state.setdefault("metadata", {}).update({
-        "email_sent": True,
-        "email_timestamp": str(datetime.datetime.now()),
+        "email_queued": True,
+        "email_timestamp": timestamp(),
     })
     
     return state
 
 
-# Function mapping for node types
-NODE_FUNCTIONS = {
-    "clean_text": clean_text,
-    "uppercase": convert_to_uppercase,
-    "summary": basic_summary,
-    "translate": translate,
-    "email": send_email,
-} 
\ No newline at end of file
+# Function mapping for node types, resolved through the node type registry
+from .registry import NODE_FUNCTIONS  # noqa: E402
@@ -0,0 +1,496 @@
+"""
+Regular expression engine used by the regex node.
+
+A regex node's config supplies one pattern (or a list of ``rules``), its
+flags and the mode: ``replace`` substitutes matches, ``extract`` replaces
+the text with the matches joined by a separator. Compiled patterns are kept
+in a bounded LRU cache shared by all executions.
+
+Python's ``re`` backtracks, so a pattern such as ``(a+)+$`` can take
+exponential time on a short input and cannot be interrupted. Patterns are
+therefore checked before they are compiled: an unbounded quantifier nested
+in another quantifier, even a bounded one as in ``(.*a){12}``, is rejected
+unless every repetition of the outer one is delimited by a literal the inner
+one cannot match. So are a repeated alternation whose alternatives can start
+with the same character, such as ``(a|aa)*``, and unbounded quantifiers
+following each other that can match the same character, such as ``a*a*b``. Patterns that need such shapes can use the linear-time ``re2`` engine (``pip install google-re2``)
+with ``"engine": "re2"``. Inputs longer than ``FLOWGPT_REGEX_MAX_INPUT_CHARS``
+are refused either way.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from ..metrics import REGEX_CACHE_EVICTIONS, REGEX_CACHE_HITS, REGEX_CACHE_MISSES, REGEX_CACHE_SIZE
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+REGEX_MODES = ('replace', 'extract')
+
+ENGINES = ('re', 're2')
+
+FLAGS = {
+    'i': re.IGNORECASE,
+    'm': re.MULTILINE,
+    's': re.DOTALL,
+    'x': re.VERBOSE,
+    'a': re.ASCII,
+}
+
+# Flags RE2 understands as inline flags
+RE2_FLAGS = 'ims'
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_MAX_INPUT_CHARS = 1_000_000
+MAX_PATTERN_LENGTH = 2000
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+# Only available from Python 3.11
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_NON_BACKTRACKING = tuple(op for op in (_POSSESSIVE_REPEAT, _ATOMIC_GROUP) if op is not None)
+
+
+class PatternCache:
+    """
+    Thread-safe LRU cache of compiled patterns with hit and miss counts.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._patterns: 'OrderedDict[Tuple, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple):
+        with self._lock:
+            pattern = self._patterns.get(key)
+            if pattern is not None:
+                self._patterns.move_to_end(key)
+                self.hits += 1
+        if pattern is not None:
+            REGEX_CACHE_HITS.inc()
+        return pattern
+
+    def put(self, key: Tuple, pattern) -> None:
+        evicted = 0
+        with self._lock:
+            self.misses += 1
+            self._patterns[key] = pattern
+            self._patterns.move_to_end(key)
+            while len(self._patterns) > self.maxsize:
+                self._patterns.popitem(last=False)
+                evicted += 1
+        REGEX_CACHE_MISSES.inc()
+        if evicted:
+            REGEX_CACHE_EVICTIONS.inc(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._patterns.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+
+CACHE = PatternCache(getattr(settings, 'FLOWGPT_REGEX_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+REGEX_CACHE_SIZE.set_function(lambda: len(CACHE))
+
+
+def normalize_flags(flags: Any) -> str:
+    """
+    Flags as a sorted string of letters from ``FLAGS``, e.g. ``"im"``.
+    """
+    if not flags:
+        return ''
+    letters = set(''.join(flags).lower() if isinstance(flags, (list, tuple)) else str(flags).lower())
+    unknown = letters - set(FLAGS)
+    if unknown:
+        raise ValueError(f"Unsupported regex flags: {''.join(sorted(unknown))}")
+    return ''.join(sorted(letters))
+
+
+def _children(op, av) -> list:
+    """
+    The parsed sub-patterns nested in one parsed item.
+    """
+    if op in _REPEATS or op is _POSSESSIVE_REPEAT:
+        return [av[2]]
+    if op is sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op is sre_constants.BRANCH:
+        return list(av[1])
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_constants.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch is not None]
+    if op is _ATOMIC_GROUP:
+        return [av]
+    return []
+
+
+def _unbounded_bodies(items):
+    for op, av in items:
+        if op in _REPEATS and av[1] == sre_constants.MAXREPEAT:
+            yield av[2]
+        for child in _children(op, av):
+            yield from _unbounded_bodies(child)
+
+
+def _mandatory_literals(items):
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            yield chr(av)
+        elif op is sre_constants.SUBPATTERN:
+            yield from _mandatory_literals(av[-1])
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: str.isdigit,
+    sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_constants.CATEGORY_SPACE: str.isspace,
+    sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+    sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+}
+
+
+def _in_set(items, char: str) -> bool:
+    for op, av in items:
+        if op is sre_constants.LITERAL and chr(av) == char:
+            return True
+        if op is sre_constants.RANGE and av[0] <= ord(char) <= av[1]:
+            return True
+        if op is sre_constants.CATEGORY and _CATEGORIES.get(av, lambda c: True)(char):
+            return True
+    return False
+
+
+def _may_match(body, char: str) -> bool:
+    """
+    Whether a repeated body could consume ``char``; anything but a single
+    character class is assumed to.
+    """
+    if len(body) != 1:
+        return True
+    op, av = body[0]
+    # Case changes can yield several characters, as "ß".upper() does
+    variants = {variant for variant in (char, char.lower(), char.upper()) if len(variant) == 1}
+    if op is sre_constants.LITERAL:
+        return chr(av) in variants
+    if op is sre_constants.NOT_LITERAL:
+        return chr(av) != char
+    if op is sre_constants.IN:
+        if av and av[0][0] is sre_constants.NEGATE:
+            return not _in_set(av[1:], char)
+        return any(_in_set(av, variant) for variant in variants)
+    return True
+
+
+def _delimited(body) -> bool:
+    """
+    Whether every repetition of ``body`` must match a literal character
+    that none of its inner quantifiers can consume, as the "-" in
+    ``(?:-[a-z]+)*``, so repetitions cannot be split in more than one way.
+    """
+    inner = list(_unbounded_bodies(body))
+    return any(
+        not any(_may_match(inner_body, char) for inner_body in inner)
+        for char in _mandatory_literals(body)
+    )
+
+
+# Stands for a character nothing is known about
+_ANY_CHAR = (sre_constants.ANY, None)
+
+
+def _first_chars(items, last: bool = False) -> Tuple[list, bool]:
+    """
+    The items one of which matches the first character consumed by a parsed
+    pattern, or its last one with ``last``, and whether it can match the
+    empty string. Unknown shapes are assumed to start with any character.
+    """
+    first = []
+    for op, av in (reversed(items) if last else items):
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.IN, sre_constants.ANY):
+            first.append((op, av))
+            return first, False
+        if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue
+        if op in _REPEATS or op is _POSSESSIVE_REPEAT:
+            chars, nullable = _first_chars(av[2], last)
+            first.extend(chars)
+            if av[0] > 0 and not nullable:
+                return first, False
+        elif op in (sre_constants.SUBPATTERN, sre_constants.BRANCH, sre_constants.GROUPREF_EXISTS) \
+                or op is _ATOMIC_GROUP:
+            children = _children(op, av)
+            results = [_first_chars(child, last) for child in children]
+            for chars, _ in results:
+                first.extend(chars)
+            # A conditional group without a "no" branch can match nothing
+            missing_branch = op is sre_constants.GROUPREF_EXISTS and av[2] is None
+            if results and not missing_branch and not any(nullable for _, nullable in results):
+                return first, False
+        else:
+            first.append(_ANY_CHAR)
+            return first, False
+    return first, True
+
+
+def _ranges(item) -> Optional[List[Tuple[int, int]]]:
+    """
+    The code point ranges a literal, range or plain character set matches,
+    or None for anything else.
+    """
+    op, av = item
+    if op is sre_constants.LITERAL:
+        return [(av, av)]
+    if op is sre_constants.RANGE:
+        return [av]
+    if op is sre_constants.IN:
+        ranges = [_ranges(inner) for inner in av]
+        if all(r is not None for r in ranges):
+            return [bounds for r in ranges for bounds in r]
+    return None
+
+
+# Code points tried when the overlap of two classes cannot be computed
+_SAMPLE_CHARS = 0x250
+
+
+def _set_items(item) -> list:
+    op, av = item
+    return av if op is sre_constants.IN else [item]
+
+
+def _overlap(a, b) -> bool:
+    """
+    Whether two single-character items can match the same character;
+    assumed when it cannot be told.
+    """
+    for literal, other in ((a, b), (b, a)):
+        if literal[0] is sre_constants.LITERAL:
+            if other[0] in (sre_constants.RANGE, sre_constants.CATEGORY):
+                other = (sre_constants.IN, [other])
+            return _may_match([other], chr(literal[1]))
+    ranges_a, ranges_b = _ranges(a), _ranges(b)
+    if ranges_a is not None and ranges_b is not None:
+        return any(lo_a <= hi_b and lo_b <= hi_a for lo_a, hi_a in ranges_a for lo_b, hi_b in ranges_b)
+    # Classes such as \s and \w: try the Latin characters and the bounds of
+    # any range, one of which is shared by two overlapping ranges
+    samples = set(range(_SAMPLE_CHARS))
+    for item in (a, b):
+        for lo, hi in _ranges((sre_constants.IN, [inner for inner in _set_items(item)
+                                                  if _ranges(inner) is not None])) or ():
+            samples.update((lo, hi))
+    return any(_may_match([a], chr(code)) and _may_match([b], chr(code)) for code in samples)
+
+
+def _ambiguous_alternatives(op, av) -> bool:
+    """
+    Whether an alternation, or a character set, offers more than one way to
+    match the same text: an alternative that can match nothing, or two that
+    can start with the same character.
+    """
+    if op is sre_constants.IN:
+        if av and av[0][0] is sre_constants.NEGATE:
+            return False
+        alternatives = [([item], False) for item in av]
+    else:
+        alternatives = [_first_chars(branch) for branch in av[1]]
+    if any(nullable for _, nullable in alternatives):
+        return True
+    for i, (first, _) in enumerate(alternatives):
+        for other, _ in alternatives[i + 1:]:
+            if any(_overlap(a, b) for a in first for b in other):
+                return True
+    return False
+
+
+def _unbounded(item) -> Optional[list]:
+    """
+    The body of an unbounded backtracking quantifier, looking through
+    groups holding nothing else, as in ``(a*)``.
+    """
+    op, av = item
+    while op is sre_constants.SUBPATTERN and len(av[-1]) == 1:
+        op, av = av[-1][0]
+    if op in _REPEATS and av[1] == sre_constants.MAXREPEAT:
+        return av[2]
+    return None
+
+
+def _adjacent_quantifiers(items) -> bool:
+    """
+    Whether two unbounded quantifiers follow each other, with nothing but
+    optional items between them, and can match the same character: every
+    split of a run of it between them is tried, as in ``a*a*a*b``.
+    """
+    previous = None
+    for item in items:
+        body = _unbounded(item)
+        if body is not None:
+            first, _ = _first_chars(body)
+            if previous is not None and any(_overlap(a, b) for a in previous for b in first):
+                return True
+            previous, _ = _first_chars(body, last=True)
+        elif previous is not None and not _first_chars([item])[1]:
+            # Anything that must match a character separates the two
+            previous = None
+    return False
+
+
+def _nested_quantifier(items, repeated: bool = False, looped: bool = False) -> bool:
+    """
+    Whether a parsed pattern has an unbounded quantifier inside another
+    quantifier whose repetitions are not delimited, an ambiguous alternation
+    inside an unbounded quantifier, or adjacent unbounded quantifiers that
+    overlap: the shapes behind catastrophic backtracking such as ``(a+)+``,
+    ``(.*a){12}``, ``(a|aa)*`` or ``a*a*a*b``.
+    """
+    if _adjacent_quantifiers(items):
+        return True
+    for op, av in items:
+        if looped and op in (sre_constants.BRANCH, sre_constants.IN) and _ambiguous_alternatives(op, av):
+            return True
+        if op in _REPEATS and av[1] == sre_constants.MAXREPEAT:
+            if repeated:
+                return True
+            if _nested_quantifier(av[2], not _delimited(av[2]), True):
+                return True
+        elif op in _REPEATS and av[1] > 1:
+            # A bounded repeat tries as many splits of the text between its
+            # repetitions as an unbounded one, only fewer times over
+            if _nested_quantifier(av[2], repeated or not _delimited(av[2]), looped):
+                return True
+        elif op in _NON_BACKTRACKING:
+            # Possessive quantifiers and atomic groups never backtrack into
+            # their body, so only the body itself needs checking
+            if any(_nested_quantifier(child) for child in _children(op, av)):
+                return True
+        elif any(_nested_quantifier(child, repeated, looped) for child in _children(op, av)):
+            return True
+    return False
+
+
+def check_pattern(pattern: str, flags: str = '') -> None:
+    """
+    Reject patterns the backtracking engine could take exponential time on.
+    """
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Regex pattern is longer than {MAX_PATTERN_LENGTH} characters")
+    try:
+        parsed = sre_parse.parse(pattern, sum(FLAGS[flag] for flag in flags))
+    except re.error as e:
+        raise ValueError(f"Invalid regex pattern {pattern!r}: {e}")
+    if _nested_quantifier(parsed):
+        raise ValueError(
+            f"Regex pattern {pattern!r} nests unbounded quantifiers, repeats overlapping "
+            f"alternatives or chains overlapping quantifiers and could backtrack "
+            f"catastrophically; rewrite it or use the re2 engine"
+        )
+
+
+def _compile(pattern: str, flags: str, engine: str):
+    if engine == 're2':
+        if re2 is None:
+            raise ValueError("The re2 engine requires the google-re2 package")
+        unsupported = set(flags) - set(RE2_FLAGS)
+        if unsupported:
+            raise ValueError(f"Flags not supported by re2: {''.join(sorted(unsupported))}")
+        try:
+            return re2.compile(f"(?{flags}){pattern}" if flags else pattern)
+        except Exception as e:
+            raise ValueError(f"Invalid regex pattern {pattern!r}: {e}")
+    check_pattern(pattern, flags)
+    return re.compile(pattern, sum(FLAGS[flag] for flag in flags))
+
+
+def get_pattern(pattern: str, flags: Any = '', engine: str = 're'):
+    """
+    Return the compiled pattern, compiling and checking it on first use.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unsupported regex engine: {engine}")
+    flags = normalize_flags(flags)
+    key = (pattern, flags, engine)
+    compiled = CACHE.get(key)
+    if compiled is None:
+        compiled = _compile(pattern, flags, engine)
+        CACHE.put(key, compiled)
+    return compiled
+
+
+def get_rules(config: Dict[str, Any]) -> List[Tuple[Any, str]]:
+    """
+    The compiled ``(pattern, replacement)`` rules of a regex node config.
+    Rules inherit the flags and engine of the config unless they set their own.
+    """
+    if not isinstance(config.get("pattern"), str) and not config.get("rules"):
+        raise ValueError("A regex node needs a \"pattern\" or a list of \"rules\"")
+    flags = config.get("flags", "")
+    engine = config.get("engine") or getattr(settings, 'FLOWGPT_REGEX_ENGINE', 're')
+    rules = config.get("rules") or [config]
+    return [
+        (get_pattern(rule["pattern"], rule.get("flags", flags), rule.get("engine", engine)),
+         rule.get("replacement", ""))
+        for rule in rules
+    ]
+
+
+def validate_config(config: Optional[Dict[str, Any]]) -> None:
+    """
+    Raise ValueError if a regex node config cannot be used.
+    """
+    config = config or {}
+    if config.get("mode", "replace") not in REGEX_MODES:
+        raise ValueError(f"Unsupported regex mode: {config.get('mode')}")
+    for rule in config.get("rules") or []:
+        if not isinstance(rule, dict) or not isinstance(rule.get("pattern"), str):
+            raise ValueError("Every regex rule needs a \"pattern\"")
+    get_rules(config)
+
+
+def apply(text: str, config: Dict[str, Any]) -> Tuple[str, int]:
+    """
+    Apply a regex node config to ``text``. Returns the new text and the
+    number of matches.
+    """
+    mode = config.get("mode", "replace")
+    if mode not in REGEX_MODES:
+        raise ValueError(f"Unsupported regex mode: {mode}")
+    max_chars = getattr(settings, 'FLOWGPT_REGEX_MAX_INPUT_CHARS', DEFAULT_MAX_INPUT_CHARS)
+    if max_chars and len(text) > max_chars:
+        raise ValueError(f"Text of {len(text)} characters exceeds the regex limit of {max_chars}")
+
+    rules = get_rules(config)
+    count = 0
+    if mode == 'replace':
+        for pattern, replacement in rules:
+            text, replaced = pattern.subn(replacement, text)
+            count += replaced
+        return text, count
+
+    group = config.get("group", 0)
+    matches = []
+    for pattern, _ in rules:
+        matches.extend(match.group(group) or '' for match in pattern.finditer(text))
+    return config.get("separator", "\n").join(matches), len(matches)
@@ -2,268 +2,649 @@
 LangGraph-based pipeline executor for FlowGPT.
 This module creates and executes LangGraph workflows based on the pipeline configurations.
 """
-from typing import Dict, Any, List, Callable, Optional, Union, TypedDict
-import datetime
-import json
+from typing import Dict, Any, List, Callable, FrozenSet, Optional, Tuple, Union, TypedDict, Annotated, get_type_hints
+import functools
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import nullcontext
+from django.db import transaction
+from django.utils import timezone
 from langgraph.graph import StateGraph, END
-from .node_functions import NODE_FUNCTIONS
+from .registry import NodeType, get_node_type
+from .subpipelines import SUBPIPELINE, child_pipeline_id
+from .state import ExecutionState, Metadata, dumps, layer, timestamp, to_dict
+from .batch_functions import get_batch_function
 from ..models import Pipeline, Node, Edge, PipelineExecution, ExecutionStep
+from ..logs import log_context
+from ..notifier import notify
+from ..outbox import enqueue, queued_emails
+from .. import webhooks
+from ..metrics import (
+    EXECUTIONS_STARTED, EXECUTIONS_COMPLETED, EXECUTIONS_FAILED,
+    EXECUTIONS_IN_FLIGHT, NODE_DURATION,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def last_value(current: Any, update: Any) -> Any:
+    """
+    Reducer keeping the most recent value when parallel branches both write a key.
+    """
+    return update
+
+
+def merge_metadata(current: Optional[Mapping[str, Any]], update: Optional[Mapping[str, Any]]) -> Mapping[str, Any]:
+    """
+    Reducer merging the metadata written by parallel branches. The update is
+    stacked on the current metadata as a copy-on-write layer instead of
+    copying every key.
+    """
+    if update is None:
+        return current if current is not None else {}
+    return layer(current, update)
 
 
 # Define state schema type for LangGraph
+# Reducers allow fan-out and diamond shaped pipelines, where several nodes
+# update the state in the same step.
 class FlowGPTState(TypedDict, total=False):
-    text: str
-    config: Dict[str, Any]
-    summary: Optional[str]
-    translated_text: Optional[str]
-    email_result: Optional[Dict[str, Any]]
-    metadata: Dict[str, Any]
-    error: Optional[str]
+    text: Annotated[str, last_value]
+    config: Annotated[Dict[str, Any], last_value]
+    summary: Annotated[Optional[str], last_value]
+    translated_text: Annotated[Optional[str], last_value]
+    email_result: Annotated[Optional[Dict[str, Any]], last_value]
+    chunks: Annotated[Optional[List[Dict[str, Any]]], last_value]
+    metadata: Annotated[Dict[str, Any], merge_metadata]
+    error: Annotated[Optional[str], last_value]
 
 
-def get_node_config(node_id: int) -> Dict[str, Any]:
+@functools.lru_cache(maxsize=32)
+def state_schema(extra_fields: FrozenSet[str] = frozenset()) -> type:
     """
-    Get node configuration from database.
+    State schema extended with the fields written by plugin node types,
+    which LangGraph would otherwise drop from their updates.
     """
-    try:
-        node = Node.objects.get(id=node_id)
-        return node.config or {}
-    except Node.DoesNotExist:
-        return {}
+    if not extra_fields:
+        return FlowGPTState
+    fields = get_type_hints(FlowGPTState, include_extras=True)
+    for field in sorted(extra_fields):
+        fields.setdefault(field, Annotated[Any, last_value])
+    return TypedDict('FlowGPTPluginState', fields, total=False)
 
 
-def create_pipeline_graph(pipeline_id: int) -> StateGraph:
+def tracked_node(node: Node, node_type: NodeType) -> Callable:
+    """
+    Wrap a node function so it runs with the node's configuration and
+    its duration is recorded per node type. When the node type declares
+    the fields it writes, only those are returned as the state update.
+    """
+    node_function = node_type.function
+    writes = node_type.writes
+    name = node_type.name
+    node_id = node.id
+    config = node.config or {}
+
+    @functools.wraps(node_function)
+    def wrapper(state):
+        # Copy so a node mutating its config cannot leak into later runs
+        state["config"] = dict(config)
+        # Give the node its own metadata layer to write into
+        state["metadata"] = Metadata(state.get("metadata"))
+        start = time.perf_counter()
+        # Records logged by the node function carry its id
+        with log_context(node_id=node_id, node_type=name):
+            try:
+                result = node_function(state)
+            except Exception as e:
+                # The executor logs the traceback once the run is aborted
+                logger.warning("Node failed", extra={'error': str(e)})
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                NODE_DURATION.observe(duration, node_type=name)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Node finished", extra={'duration_ms': round(duration * 1000, 3)})
+        return node_update(result, writes)
+    return wrapper
+
+
+def node_update(result: Mapping[str, Any], writes: Optional[Tuple[str, ...]]) -> Mapping[str, Any]:
+    """
+    The state update of a node: the state the node function returned, or
+    only the fields ``writes`` declares.
     """
-    Create a LangGraph StateGraph based on a pipeline configuration.
+    if writes is None:
+        return result
+    return {key: result[key] for key in writes if key in result}
+
+
+def apply_update(state: Mapping[str, Any], update: Mapping[str, Any]) -> ExecutionState:
+    """
+    The state after a node, from the state before it and its update, merged
+    as the graph's reducers merge them. Batches use it to end up with the
+    same states as single executions.
+    """
+    merged = ExecutionState(state)
+    for key, value in update.items():
+        merged[key] = merge_metadata(state.get("metadata"), value) if key == "metadata" else value
+    return merged
+
+
+def load_pipeline(pipeline_id: int) -> Tuple[Pipeline, List[Edge]]:
+    """
+    Load a pipeline and its edges together with their nodes in two queries.
     """
     try:
         pipeline = Pipeline.objects.get(id=pipeline_id)
     except Pipeline.DoesNotExist:
         raise ValueError(f"Pipeline with id {pipeline_id} does not exist")
     
-    # Get all nodes and edges for this pipeline
-    edges = Edge.objects.filter(pipeline=pipeline).order_by('order')
+    # Load all edges with their nodes in a single query
+    edges = list(
+        Edge.objects.filter(pipeline=pipeline)
+        .select_related('source', 'target')
+        .order_by('order')
+    )
     
-    if not edges.exists():
+    if not edges:
         raise ValueError(f"Pipeline {pipeline.name} has no edges defined")
     
-    # Create a new state graph with the defined schema
-    graph = StateGraph(state_schema=FlowGPTState)
-    
-    # Track all nodes we've seen to add them to the graph
-    nodes_in_graph = set()
-    
-    # Add all nodes and edges to the graph
+    return pipeline, edges
+
+
+def load_pipeline_edges(pipeline_id: int) -> List[Edge]:
+    """
+    Load the edges of a pipeline together with their nodes in two queries.
+    """
+    return load_pipeline(pipeline_id)[1]
+
+
+def linear_chain(edges: List[Edge]) -> Optional[List[Node]]:
+    """
+    Return the nodes of a pipeline in execution order when its edges form a
+    single chain, or None for branching, merging or cyclic pipelines.
+    """
+    next_node = {}
+    has_incoming = set()
+    nodes = {}
     for edge in edges:
-        source_node = edge.source
-        target_node = edge.target
-        
-        # Add source node if not already in graph
-        if source_node.id not in nodes_in_graph:
-            node_function = NODE_FUNCTIONS.get(source_node.node_type)
-            if not node_function:
-                raise ValueError(f"Unknown node type: {source_node.node_type}")
-            
-            graph.add_node(str(source_node.id), node_function)
-            nodes_in_graph.add(source_node.id)
-            
-        # Add target node if not already in graph
-        if target_node.id not in nodes_in_graph:
-            node_function = NODE_FUNCTIONS.get(target_node.node_type)
-            if not node_function:
-                raise ValueError(f"Unknown node type: {target_node.node_type}")
-                
-            graph.add_node(str(target_node.id), node_function)
-            nodes_in_graph.add(target_node.id)
-        
-        # Add edge
-        # We use the node IDs as string keys in the graph
-        graph.add_edge(str(source_node.id), str(target_node.id))
+        if edge.source_id in next_node or edge.target_id in has_incoming:
+            return None
+        next_node[edge.source_id] = edge.target
+        has_incoming.add(edge.target_id)
+        nodes[edge.source_id] = edge.source
     
-    # Find the first node (no incoming edges or lowest order)
-    first_node = None
-    all_targets = set(edges.values_list('target_id', flat=True))
+    starts = [node for node_id, node in nodes.items() if node_id not in has_incoming]
+    if len(starts) != 1:
+        return None
     
-    for edge in edges:
-        if edge.source.id not in all_targets:
-            first_node = edge.source
-            break
-    
-    if not first_node:
-        # If no clear first node, use the source of the first edge
-        first_node = edges.first().source
+    chain = [starts[0]]
+    while chain[-1].id in next_node:
+        chain.append(next_node[chain[-1].id])
+    # A chain covers every edge exactly once
+    return chain if len(chain) == len(edges) + 1 else None
+
+
+def expand_chain(chain: List[Node], parents: Tuple[int, ...] = ()) -> Optional[List[Node]]:
+    """
+    Replace the sub-pipeline nodes of a linear chain by the nodes of the
+    pipelines they include, or return None when one of those is not linear.
+    """
+    expanded = []
+    for node in chain:
+        if node.node_type != SUBPIPELINE:
+            expanded.append(node)
+            continue
+        child_id = child_pipeline_id(node.config)
+        if child_id in parents:
+            raise ValueError(f"Pipeline with id {child_id} includes itself")
+        child = linear_chain(load_pipeline_edges(child_id))
+        child = expand_chain(child, parents + (child_id,)) if child is not None else None
+        if child is None:
+            return None
+        expanded.extend(child)
+    return expanded
+
+
+class PipelinePlan:
+    """
+    The nodes and edges of a pipeline with its sub-pipelines inlined, and
+    the ``updated_at`` of every pipeline involved. Nodes are keyed by their
+    id, prefixed by the ids of the sub-pipeline nodes they were inlined
+    through (e.g. ``"7/12"``), so a pipeline can be included more than once.
+    """
     
-    # Find the last node (no outgoing edges)
-    last_node = None
-    all_sources = set(edges.values_list('source_id', flat=True))
+    def __init__(self):
+        self.nodes: Dict[str, Tuple[Node, NodeType]] = {}
+        self.edges: List[Tuple[str, str]] = []
+        self.versions: Dict[int, Any] = {}
+        self.entry: Optional[str] = None
+        self.exit: Optional[str] = None
+        self.webhook_url = ''
     
-    for edge in edges:
-        if edge.target.id not in all_sources:
-            last_node = edge.target
-            break
-            
-    if not last_node:
-        # If no clear last node, use the target of the last edge
-        last_node = edges.last().target
+    def add_pipeline(self, pipeline_id: int, prefix: str = '', parents: Tuple[int, ...] = ()) -> Tuple[str, str]:
+        """
+        Add a pipeline's nodes and edges and return its entry and exit keys.
+        """
+        if pipeline_id in parents:
+            raise ValueError(f"Pipeline with id {pipeline_id} includes itself")
+        pipeline, edges = load_pipeline(pipeline_id)
+        self.versions[pipeline.id] = pipeline.updated_at
+        if not parents:
+            self.webhook_url = pipeline.webhook_url
+        
+        # Graph keys a node is entered and left through; a sub-pipeline
+        # node is entered through its pipeline's first node and left
+        # through its last
+        entries = {}
+        exits = {}
+        for edge in edges:
+            for node in (edge.source, edge.target):
+                if node.id in entries:
+                    continue
+                if node.node_type == SUBPIPELINE:
+                    entries[node.id], exits[node.id] = self.add_pipeline(
+                        child_pipeline_id(node.config), f"{prefix}{node.id}/", parents + (pipeline_id,)
+                    )
+                    continue
+                node_type = get_node_type(node.node_type)
+                if not node_type:
+                    raise ValueError(f"Unknown node type: {node.node_type}")
+                key = f"{prefix}{node.id}"
+                self.nodes[key] = (node, node_type)
+                entries[node.id] = exits[node.id] = key
+        
+        for edge in edges:
+            self.edges.append((exits[edge.source_id], entries[edge.target_id]))
+        
+        all_sources = {edge.source_id for edge in edges}
+        all_targets = {edge.target_id for edge in edges}
+        
+        # Find the first node (no incoming edges), else the source of the first edge
+        first_node_id = next(
+            (edge.source_id for edge in edges if edge.source_id not in all_targets),
+            edges[0].source_id
+        )
+        
+        # Find the last node (no outgoing edges), else the target of the last edge
+        last_node_id = next(
+            (edge.target_id for edge in edges if edge.target_id not in all_sources),
+            edges[-1].target_id
+        )
+        
+        return entries[first_node_id], exits[last_node_id]
+
+
+def plan_pipeline(pipeline_id: int) -> PipelinePlan:
+    plan = PipelinePlan()
+    plan.entry, plan.exit = plan.add_pipeline(pipeline_id)
+    return plan
+
+
+def build_pipeline_graph(plan: PipelinePlan) -> StateGraph:
+    """
+    Create the LangGraph StateGraph of a pipeline plan.
+    """
+    # Create a new state graph with the defined schema
+    written = set()
+    for _, node_type in plan.nodes.values():
+        written.update(node_type.writes or ())
+    graph = StateGraph(state_schema=state_schema(frozenset(written - FlowGPTState.__annotations__.keys())))
     
-    # Set the entry point
-    graph.set_entry_point(str(first_node.id))
+    # Add all nodes and edges to the graph
+    for key, (node, node_type) in plan.nodes.items():
+        graph.add_node(key, tracked_node(node, node_type))
+    for source, target in plan.edges:
+        graph.add_edge(source, target)
     
-    # Connect the last node to END
-    graph.add_edge(str(last_node.id), END)
+    # Set the entry point and connect the last node to END
+    graph.set_entry_point(plan.entry)
+    graph.add_edge(plan.exit, END)
     
     return graph
 
 
-def update_execution_state(execution_id: int, state: Dict[str, Any], node_id: Optional[str] = None,
-                          is_complete: bool = False) -> None:
+def create_pipeline_graph(pipeline_id: int) -> StateGraph:
     """
-    Update the execution state in the database.
+    Create a LangGraph StateGraph based on a pipeline configuration, with
+    the nodes of its sub-pipelines inlined.
     """
-    try:
-        execution = PipelineExecution.objects.get(id=execution_id)
-        
-        # Update current node if provided
-        if node_id and node_id != 'END':
-            try:
-                node = Node.objects.get(id=int(node_id))
-                execution.current_node = node
-            except (Node.DoesNotExist, ValueError):
-                # If node doesn't exist or isn't a valid ID, ignore
-                pass
-        
-        # Update completion status
-        if is_complete:
-            execution.is_complete = True
-            execution.completed_at = datetime.datetime.now()
-            execution.output_data = json.dumps(state)
-            
-        execution.save()
-        
-    except PipelineExecution.DoesNotExist:
-        # Log error but don't crash
-        print(f"Error: PipelineExecution with id {execution_id} not found")
+    return build_pipeline_graph(plan_pipeline(pipeline_id))
+
+
+COMPILED_GRAPH_CACHE_SIZE = 128
 
+# Compiled graphs and webhook URLs by pipeline id, with the updated_at of
+# every pipeline they include
+_compiled_graphs: Dict[int, Tuple[Dict[int, Any], Any, str]] = {}
+_compiled_graphs_lock = threading.Lock()
 
-def update_execution_step(execution_id: int, node_id: str, 
-                        input_data: Dict[str, Any], 
-                        output_data: Dict[str, Any]) -> None:
+
+def get_compiled_pipeline(pipeline_id: int) -> Tuple[Any, str]:
     """
-    Create or update an execution step in the database.
+    Return the compiled graph of a pipeline and its webhook URL, compiling
+    it again when the pipeline or any pipeline it includes changed since.
+    Saving an edge or a node touches the ``updated_at`` of the pipelines
+    using it.
     """
-    try:
-        execution = PipelineExecution.objects.get(id=execution_id)
-        
-        # Skip if this is the END node
-        if node_id == 'END':
-            return
-            
+    cached = _compiled_graphs.get(pipeline_id)
+    if cached is not None:
+        versions, compiled, webhook_url = cached
+        current = dict(Pipeline.objects.filter(id__in=versions).values_list('id', 'updated_at'))
+        if current == versions:
+            return compiled, webhook_url
+    
+    plan = plan_pipeline(pipeline_id)
+    compiled = build_pipeline_graph(plan).compile()
+    with _compiled_graphs_lock:
+        _compiled_graphs.pop(pipeline_id, None)
+        while len(_compiled_graphs) >= COMPILED_GRAPH_CACHE_SIZE:
+            # Evict the graph compiled longest ago
+            del _compiled_graphs[next(iter(_compiled_graphs))]
+        _compiled_graphs[pipeline_id] = (plan.versions, compiled, plan.webhook_url)
+    return compiled, plan.webhook_url
+
+
+def get_compiled_graph(pipeline_id: int):
+    """
+    Return the compiled graph of a pipeline, see get_compiled_pipeline.
+    """
+    return get_compiled_pipeline(pipeline_id)[0]
+
+
+def clear_compiled_graphs() -> None:
+    with _compiled_graphs_lock:
+        _compiled_graphs.clear()
+
+
+def graph_node_id(key: str) -> int:
+    """
+    The node id of a graph key, which may be prefixed by sub-pipeline nodes.
+    """
+    return int(key.rpartition('/')[2])
+
+
+def update_execution_state(execution_id: int, state: Dict[str, Any], node_id: Optional[str] = None,
+                          is_complete: bool = False) -> Optional[str]:
+    """
+    Update the execution state in the database with a single query. Returns
+    the serialised state stored when the execution completes.
+    """
+    fields = {}
+    
+    # Update current node if provided
+    if node_id and node_id != 'END':
         try:
-            node = Node.objects.get(id=int(node_id))
-            
-            # Create execution step
-            ExecutionStep.objects.create(
-                execution=execution,
-                node=node,
-                input_data=json.dumps(input_data),
-                output_data=json.dumps(output_data),
-                is_complete=True,
-                completed_at=datetime.datetime.now()
-            )
-            
-        except Node.DoesNotExist:
-            # Log error but don't crash
-            print(f"Error: Node with id {node_id} not found")
-            
-    except PipelineExecution.DoesNotExist:
+            fields['current_node_id'] = graph_node_id(node_id)
+        except ValueError:
+            # If node isn't a valid ID, ignore
+            pass
+    
+    # Update completion status
+    if is_complete:
+        fields['is_complete'] = True
+        fields['completed_at'] = timezone.now()
+        fields['output_data'] = dumps(state)
+    
+    if not fields:
+        return None
+    
+    if not PipelineExecution.objects.filter(id=execution_id).update(**fields):
         # Log error but don't crash
-        print(f"Error: PipelineExecution with id {execution_id} not found")
+        logger.error("Execution not found", extra={'execution_id': execution_id})
+    return fields.get('output_data')
 
 
-def execute_pipeline(pipeline_id: int, input_text: str) -> Dict[str, Any]:
+def update_execution_step(execution_id: int, node_id: str,
+                        input_data: str,
+                        output_data: str) -> None:
     """
-    Execute a pipeline with the given input text.
+    Record a completed execution step. ``input_data`` and ``output_data``
+    are the JSON-serialised states before and after the node ran.
     """
-    # Create pipeline graph
-    graph = create_pipeline_graph(pipeline_id)
+    # Skip if this is the END node
+    if node_id == 'END':
+        return
     
-    # Create pipeline execution record
-    pipeline = Pipeline.objects.get(id=pipeline_id)
-    execution = PipelineExecution.objects.create(
-        pipeline=pipeline,
-        input_data=input_text,
-        is_complete=False
+    step = ExecutionStep.objects.create(
+        execution_id=execution_id,
+        node_id=graph_node_id(node_id),
+        input_data=input_data,
+        output_data=output_data,
+        is_complete=True,
+        completed_at=timezone.now()
     )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Step recorded", extra={
+            'execution_id': execution_id, 'node_id': step.node_id, 'step_id': step.id,
+            'output_bytes': len(output_data),
+        })
+
+
+def execute_pipeline(pipeline_id: int, input_text: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Execute a pipeline with the given input text. An ``idempotency_key`` is
+    stored with the execution; creating a second execution with the same key
+    raises IntegrityError before anything runs.
+    """
+    # Compiled graphs are cached until the pipeline or its sub-pipelines change
+    compiled_graph, webhook_url = get_compiled_pipeline(pipeline_id)
+    
+    # Create pipeline execution record
+    # A savepoint keeps a duplicate key from breaking the caller's transaction
+    with transaction.atomic() if idempotency_key else nullcontext():
+        execution = PipelineExecution.objects.create(
+            pipeline_id=pipeline_id,
+            input_data=input_text,
+            is_complete=False,
+            idempotency_key=idempotency_key,
+        )
     execution_id = execution.id
     
-    # Prepare initial state with config
+    # Prepare initial state, node configs are injected as each node runs
     state = {
         "text": input_text,
         "config": {},
         "metadata": {
             "pipeline_id": pipeline_id,
             "execution_id": execution_id,
-            "started_at": str(datetime.datetime.now())
+            "started_at": timestamp()
         }
     }
     
-    # Create a custom event handler to track node execution
-    class NodeExecutionHandler:
-        """Event handler to track execution progress"""
-        
-        def on_chain_start(self, node_name: str, inputs: Dict[str, Any]) -> None:
-            """Called at node start"""
-            try:
-                # Don't update DB for END node
-                if node_name != 'END':
-                    # Add node configuration to state
-                    inputs["config"] = get_node_config(int(node_name))
-                    
-                    # Update execution record with current node
-                    update_execution_state(execution_id, inputs, node_name)
-            except Exception as e:
-                print(f"Error in on_chain_start: {str(e)}")
-        
-        def on_chain_end(self, node_name: str, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
-            """Called at node completion"""
-            try:
-                # Record step completion
-                update_execution_step(execution_id, node_name, inputs, outputs)
-            except Exception as e:
-                print(f"Error in on_chain_end: {str(e)}")
+    # Run the graph with our initial state; records logged meanwhile,
+    # by node functions too, carry the execution's ids
+    start = time.perf_counter()
+    with log_context(execution_id=execution_id, pipeline_id=pipeline_id):
+        logger.debug("Execution started")
+        EXECUTIONS_STARTED.inc(pipeline=pipeline_id)
+        EXECUTIONS_IN_FLIGHT.inc()
+        try:
+            # Stream the run so progress is recorded from this thread, even when
+            # parallel branches execute on LangGraph's worker threads. Each
+            # superstep yields the node updates followed by the merged state.
+            result = state
+            queued = set()
+            step_input = dumps(state)
+            for mode, chunk in compiled_graph.stream(state, stream_mode=["values", "updates"]):
+                if mode == "values":
+                    result = chunk
+                    step_input = dumps(chunk)
+                    continue
                 
-        def on_chain_error(self, node_name: str, inputs: Dict[str, Any], error: Exception) -> None:
-            """Called on node error"""
-            try:
-                print(f"Error executing node {node_name}: {str(error)}")
-            except Exception as e:
-                print(f"Error in on_chain_error: {str(e)}")
+                node_name = None
+                for node_name, output in chunk.items():
+                    update_execution_step(execution_id, node_name, step_input, dumps(output))
+                    # Emails queued by the node go to the outbox from this thread
+                    enqueue(queued_emails(execution_id, output, queued))
+                if node_name:
+                    update_execution_state(execution_id, result, node_name)
+                    # Wake status requests long-polling this execution
+                    notify(execution_id)
+            
+            # Mark execution as complete
+            output_data = update_execution_state(execution_id, result, is_complete=True)
+            notify(execution_id)
+            if webhook_url:
+                webhooks.enqueue([
+                    webhooks.completion_delivery(pipeline_id, webhook_url, execution_id, output_data, True)
+                ])
+            EXECUTIONS_COMPLETED.inc(pipeline=pipeline_id)
+            logger.debug("Execution completed", extra={'duration_ms': round((time.perf_counter() - start) * 1000, 3)})
+            
+            return to_dict(result)
+        except Exception as e:
+            # Record error in execution
+            EXECUTIONS_FAILED.inc(pipeline=pipeline_id)
+            state["error"] = str(e)
+            output_data = update_execution_state(execution_id, state, is_complete=True)
+            notify(execution_id)
+            if webhook_url:
+                webhooks.enqueue([
+                    webhooks.completion_delivery(pipeline_id, webhook_url, execution_id, output_data, False)
+                ])
+            
+            logger.exception("Execution failed")
+            raise
+        finally:
+            EXECUTIONS_IN_FLIGHT.dec()
+
+
+def enqueue_completion_webhooks(pipeline: Pipeline, executions: List[PipelineExecution], success: bool) -> None:
+    """
+    Queue the webhooks of finished batch executions with one query.
+    """
+    if pipeline.webhook_url:
+        webhooks.enqueue(
+            webhooks.completion_delivery(pipeline.id, pipeline.webhook_url, execution.id, execution.output_data, success)
+            for execution in executions
+        )
+
+
+def execute_pipeline_batch(pipeline_id: int, input_texts: List[str]) -> List[Dict[str, Any]]:
+    """
+    Execute a pipeline over several input texts.
+    
+    Linear pipelines run each node once over the whole batch using the batch
+    node functions, recording executions and steps with bulk queries. Other
+    pipelines, and single inputs, run through execute_pipeline one by one.
+    Results are returned in input order.
+    """
+    if len(input_texts) < 2:
+        return [execute_pipeline(pipeline_id, text) for text in input_texts]
+    
+    pipeline, edges = load_pipeline(pipeline_id)
+    chain = linear_chain(edges)
+    if chain is not None:
+        chain = expand_chain(chain, (pipeline_id,))
+    if chain is None:
+        return [execute_pipeline(pipeline_id, text) for text in input_texts]
     
-    # Create event handler instance
-    handler = NodeExecutionHandler()
+    batch_functions = []
+    for node in chain:
+        batch_function = get_batch_function(node.node_type)
+        if not batch_function:
+            raise ValueError(f"Unknown node type: {node.node_type}")
+        batch_functions.append((batch_function, get_node_type(node.node_type).writes))
     
-    # Compile the graph with event tracking
-    compiled_graph = graph.compile()
+    executions = PipelineExecution.objects.bulk_create([
+        PipelineExecution(pipeline_id=pipeline_id, input_data=text, is_complete=False)
+        for text in input_texts
+    ])
     
-    # Run the graph with our initial state
+    started_at = timestamp()
+    states = [
+        ExecutionState(
+            text=text,
+            config={},
+            metadata={
+                "pipeline_id": pipeline_id,
+                "execution_id": execution.id,
+                "started_at": started_at
+            }
+        )
+        for execution, text in zip(executions, input_texts)
+    ]
+    
+    count = len(states)
+    queued = set()
+    batch_start = time.perf_counter()
+    EXECUTIONS_STARTED.inc(count, pipeline=pipeline_id)
+    EXECUTIONS_IN_FLIGHT.inc(count)
     try:
-        # Configure the execution - note the API has likely changed
-        # Using just the callbacks parameter and removing recursion_limit
-        config = {
-            "callbacks": [handler]
-        }
-        
-        # Run the graph with the updated API
-        result = compiled_graph.invoke(state, **config)
+        for node, (batch_function, writes) in zip(chain, batch_functions):
+            step_inputs = [dumps(state) for state in states]
+            # The states before the node, which its updates are applied to
+            # as in execute_pipeline
+            previous = [ExecutionState(state) for state in states]
+            config = node.config or {}
+            for state in states:
+                state["config"] = dict(config)
+                state["metadata"] = Metadata(state.get("metadata"))
+            
+            start = time.perf_counter()
+            updates = [node_update(result, writes) for result in batch_function(states)]
+            per_item = (time.perf_counter() - start) / count
+            for _ in range(count):
+                NODE_DURATION.observe(per_item, node_type=node.node_type)
+            states = [apply_update(state, update) for state, update in zip(previous, updates)]
+            
+            completed_at = timezone.now()
+            ExecutionStep.objects.bulk_create([
+                ExecutionStep(
+                    execution_id=execution.id,
+                    node_id=node.id,
+                    input_data=step_input,
+                    output_data=dumps(update),
+                    is_complete=True,
+                    completed_at=completed_at
+                )
+                for execution, step_input, update in zip(executions, step_inputs, updates)
+            ])
+            enqueue(
+                email
+                for execution, update in zip(executions, updates)
+                for email in queued_emails(execution.id, update, queued)
+            )
+            notify(*(execution.id for execution in executions))
         
-        # Mark execution as complete
-        update_execution_state(execution_id, result, is_complete=True)
+        completed_at = timezone.now()
+        for execution, state in zip(executions, states):
+            execution.current_node_id = chain[-1].id
+            execution.is_complete = True
+            execution.completed_at = completed_at
+            execution.output_data = dumps(state)
+        PipelineExecution.objects.bulk_update(
+            executions, ['current_node', 'is_complete', 'completed_at', 'output_data']
+        )
+        notify(*(execution.id for execution in executions))
+        enqueue_completion_webhooks(pipeline, executions, success=True)
+        EXECUTIONS_COMPLETED.inc(count, pipeline=pipeline_id)
+        logger.debug("Batch execution completed", extra={
+            'pipeline_id': pipeline_id, 'execution_ids': [execution.id for execution in executions],
+            'duration_ms': round((time.perf_counter() - batch_start) * 1000, 3),
+        })
         
-        return result
+        return [to_dict(state) for state in states]
     except Exception as e:
-        # Record error in execution
-        state["error"] = str(e)
-        update_execution_state(execution_id, state, is_complete=True)
+        # Record the error on every execution of the batch
+        EXECUTIONS_FAILED.inc(count, pipeline=pipeline_id)
+        completed_at = timezone.now()
+        for execution, state in zip(executions, states):
+            state["error"] = str(e)
+            execution.is_complete = True
+            execution.completed_at = completed_at
+            execution.output_data = dumps(state)
+        PipelineExecution.objects.bulk_update(executions, ['is_complete', 'completed_at', 'output_data'])
+        notify(*(execution.id for execution in executions))
+        enqueue_completion_webhooks(pipeline, executions, success=False)
         
-        print(f"Error executing pipeline: {str(e)}")
-        raise 
\ No newline at end of file
+        logger.exception("Batch execution failed", extra={
+            'pipeline_id': pipeline_id, 'execution_ids': [execution.id for execution in executions],
+        })
+        raise
+    finally:
+        EXECUTIONS_IN_FLIGHT.dec(count)
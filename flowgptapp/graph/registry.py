@@ -0,0 +1,256 @@
+"""
+Node type registry for FlowGPT.
+
+Node types are declared with lightweight metadata and the dotted path of
+their implementation, which is imported only when a pipeline first uses
+the type. Besides the built-in types, node types are discovered from:
+
+- the ``flowgpt.node_types`` entry point group, where each entry point
+  refers to a ``NodeType`` instance (or a dict of its arguments) in a
+  lightweight module of the providing package, and
+- the ``FLOWGPT_NODE_TYPES`` setting, a list of such dicts or of dotted
+  paths to ``NodeType`` instances.
+
+Later sources override earlier ones, so settings win over entry points,
+which win over the built-in types.
+"""
+import importlib
+import threading
+import warnings
+from collections.abc import Mapping
+from importlib.metadata import entry_points
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+ENTRY_POINT_GROUP = 'flowgpt.node_types'
+
+
+def import_object(path: str) -> Any:
+    """
+    Import an object from ``package.module:attribute`` or ``package.module.attribute``.
+    """
+    if ':' in path:
+        module_path, _, attribute = path.partition(':')
+    else:
+        module_path, _, attribute = path.rpartition('.')
+    if not module_path or not attribute:
+        raise ImportError(f"Invalid import path: {path}")
+    obj = importlib.import_module(module_path)
+    for part in attribute.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+class NodeType:
+    """
+    Declaration of a node type and the metadata the executor relies on.
+
+    ``function`` and ``batch`` are callables or import paths; paths are
+    resolved on first use. ``reads`` and ``writes`` name the state fields the
+    node uses and produces. When ``writes`` is given, only those fields are
+    passed on as the node's state update. ``pure`` nodes have no side effects
+    outside the state. ``validate``, a callable or import path, checks a
+    node config and raises ValueError when the node cannot run with it.
+    """
+
+    def __init__(self, name: str, function: Union[str, Callable], label: Optional[str] = None,
+                 batch: Union[str, Callable, None] = None, reads: Iterable[str] = ('text', 'config'),
+                 writes: Optional[Iterable[str]] = None, pure: bool = True,
+                 supports_streaming: bool = False, validate: Union[str, Callable, None] = None):
+        self.name = name
+        self.label = label or name.replace('_', ' ').title()
+        self.reads = tuple(reads)
+        self.writes = tuple(writes) if writes is not None else None
+        self.pure = pure
+        self.supports_streaming = supports_streaming
+        self._function = function
+        self._batch = batch
+        self._validate = validate
+        self._lock = threading.Lock()
+
+    @property
+    def supports_batch(self) -> bool:
+        return self._batch is not None
+
+    @property
+    def function(self) -> Callable:
+        if isinstance(self._function, str):
+            with self._lock:
+                if isinstance(self._function, str):
+                    self._function = import_object(self._function)
+        return self._function
+
+    @property
+    def batch_function(self) -> Optional[Callable]:
+        if isinstance(self._batch, str):
+            with self._lock:
+                if isinstance(self._batch, str):
+                    self._batch = import_object(self._batch)
+        return self._batch
+
+    def validate(self, config: Optional[Dict[str, Any]]) -> None:
+        if isinstance(self._validate, str):
+            with self._lock:
+                if isinstance(self._validate, str):
+                    self._validate = import_object(self._validate)
+        if self._validate is not None:
+            self._validate(config)
+
+    @property
+    def is_loaded(self) -> bool:
+        return not isinstance(self._function, str)
+
+    def __repr__(self):
+        return f"<NodeType {self.name}>"
+
+
+BUILTIN_NODE_TYPES = [
+    NodeType('clean_text', 'flowgptapp.graph.node_functions:clean_text', label='Clean Text',
+             batch='flowgptapp.graph.batch_functions:clean_text_batch',
+             writes=('text', 'metadata')),
+    NodeType('uppercase', 'flowgptapp.graph.node_functions:convert_to_uppercase',
+             label='Convert to Uppercase',
+             batch='flowgptapp.graph.batch_functions:convert_to_uppercase_batch',
+             reads=('text',), writes=('text', 'metadata')),
+    NodeType('summary', 'flowgptapp.graph.node_functions:basic_summary', label='Basic Summary',
+             batch='flowgptapp.graph.batch_functions:basic_summary_batch',
+             writes=('summary', 'metadata')),
+    NodeType('translate', 'flowgptapp.graph.node_functions:translate', label='Translate',
+             batch='flowgptapp.graph.batch_functions:translate_batch',
+             validate='flowgptapp.graph.translation:validate_config',
+             writes=('translated_text', 'metadata')),
+    NodeType('regex', 'flowgptapp.graph.node_functions:regex', label='Regex',
+             validate='flowgptapp.graph.patterns:validate_config',
+             writes=('text', 'metadata')),
+    NodeType('map', 'flowgptapp.graph.node_functions:map_chunks', label='Map',
+             validate='flowgptapp.graph.mapreduce:validate_map_config',
+             writes=('chunks', 'metadata')),
+    NodeType('reduce', 'flowgptapp.graph.node_functions:reduce_chunks', label='Reduce',
+             validate='flowgptapp.graph.mapreduce:validate_reduce_config',
+             reads=('chunks', 'config'),
+             writes=('text', 'summary', 'translated_text', 'chunks', 'metadata')),
+    NodeType('subpipeline', 'flowgptapp.graph.node_functions:subpipeline', label='Sub-pipeline',
+             validate='flowgptapp.graph.subpipelines:validate_config',
+             reads=(), writes=()),
+    NodeType('email', 'flowgptapp.graph.node_functions:send_email', label='Send Email',
+             writes=('email_result', 'metadata'), pure=False),
+]
+
+
+def _coerce(name: str, value: Any) -> NodeType:
+    if isinstance(value, NodeType):
+        return value
+    if isinstance(value, dict):
+        return NodeType(**{'name': name, **value})
+    raise TypeError(f"Expected a NodeType or dict, got {type(value).__name__}")
+
+
+class NodeTypeRegistry:
+    """
+    Registry of node types, discovered on first access.
+    """
+
+    def __init__(self, builtins: Iterable[NodeType] = ()):
+        self._builtins = list(builtins)
+        self._types: Optional[Dict[str, NodeType]] = None
+        self._lock = threading.Lock()
+
+    def _discover(self) -> Dict[str, NodeType]:
+        types = {node_type.name: node_type for node_type in self._builtins}
+
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            try:
+                node_type = _coerce(entry_point.name, entry_point.load())
+            except Exception as e:
+                # A broken plugin must not take the whole application down
+                warnings.warn(f"Could not load node type {entry_point.name!r} from {entry_point.value}: {e}")
+                continue
+            types[node_type.name] = node_type
+
+        for entry in getattr(settings, 'FLOWGPT_NODE_TYPES', []):
+            try:
+                if isinstance(entry, str):
+                    node_type = _coerce(entry.rpartition('.')[2], import_object(entry))
+                else:
+                    node_type = _coerce(entry.get('name'), entry)
+            except (ImportError, AttributeError, TypeError) as e:
+                raise ImproperlyConfigured(f"Invalid FLOWGPT_NODE_TYPES entry {entry!r}: {e}")
+            types[node_type.name] = node_type
+
+        return types
+
+    @property
+    def types(self) -> Dict[str, NodeType]:
+        if self._types is None:
+            with self._lock:
+                if self._types is None:
+                    self._types = self._discover()
+        return self._types
+
+    def register(self, node_type: NodeType) -> NodeType:
+        with self._lock:
+            types = dict(self._types if self._types is not None else self._discover())
+            types[node_type.name] = node_type
+            self._types = types
+        return node_type
+
+    def reset(self) -> None:
+        """
+        Forget discovered node types so they are discovered again, e.g. after
+        the settings changed.
+        """
+        with self._lock:
+            self._types = None
+
+    def get(self, name: str) -> Optional[NodeType]:
+        return self.types.get(name)
+
+    def __getitem__(self, name: str) -> NodeType:
+        return self.types[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.types
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.types)
+
+    def choices(self) -> List[Tuple[str, str]]:
+        return [(node_type.name, node_type.label) for node_type in self.types.values()]
+
+
+class NodeFunctions(Mapping):
+    """
+    Read-only mapping of node type names to their functions, importing each
+    implementation on first lookup.
+    """
+
+    def __init__(self, registry: NodeTypeRegistry):
+        self.registry = registry
+
+    def __getitem__(self, name: str) -> Callable:
+        return self.registry[name].function
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.registry)
+
+    def __len__(self) -> int:
+        return len(self.registry.types)
+
+
+REGISTRY = NodeTypeRegistry(BUILTIN_NODE_TYPES)
+
+NODE_FUNCTIONS = NodeFunctions(REGISTRY)
+
+
+def get_node_type(name: str) -> Optional[NodeType]:
+    return REGISTRY.get(name)
+
+
+def node_type_choices() -> List[Tuple[str, str]]:
+    """
+    Choices for Node.node_type, evaluated lazily so plugin types are included.
+    """
+    return REGISTRY.choices()
@@ -0,0 +1,196 @@
+"""
+Compact execution state for FlowGPT pipelines.
+
+``ExecutionState`` stores the fields of ``FlowGPTState`` in slots while
+keeping the dict interface node functions use, and ``Metadata`` is a
+copy-on-write mapping: every node writes into its own small layer on top of
+the metadata it received, so the accumulated metadata is never copied from
+step to step. Timestamps are stored as numeric epoch seconds and both types
+serialise directly with orjson.
+"""
+import time
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+import orjson
+
+
+def timestamp() -> float:
+    """
+    Current time as epoch seconds, the format of every state timestamp.
+    """
+    return time.time()
+
+
+class Metadata(MutableMapping):
+    """
+    Copy-on-write metadata. Reads fall through to the parent layers,
+    writes and deletions only touch this layer.
+    """
+    __slots__ = ('parent', 'local')
+
+    _DELETED = object()
+
+    def __init__(self, parent: Optional[Mapping] = None, local: Optional[Dict[str, Any]] = None):
+        self.parent = parent
+        self.local = {} if local is None else local
+
+    def __getitem__(self, key):
+        layer = self
+        while isinstance(layer, Metadata):
+            if key in layer.local:
+                value = layer.local[key]
+                if value is Metadata._DELETED:
+                    break
+                return value
+            layer = layer.parent
+        else:
+            if layer is not None:
+                return layer[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.local[key] = Metadata._DELETED
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Flatten all layers into a plain dict.
+        """
+        layers = []
+        layer = self
+        while isinstance(layer, Metadata):
+            layers.append(layer.local)
+            layer = layer.parent
+        flat = dict(layer) if layer is not None else {}
+        for local in reversed(layers):
+            flat.update(local)
+        return {key: value for key, value in flat.items() if value is not Metadata._DELETED}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return f"Metadata({self.to_dict()!r})"
+
+
+def layer(metadata: Optional[Mapping], update: Optional[Mapping] = None) -> Metadata:
+    """
+    New metadata layer on top of ``metadata``, sharing ``update`` (if given)
+    as its contents without copying it.
+    """
+    if isinstance(update, Metadata):
+        update = update.local
+    return Metadata(metadata, update if update is not None else {})
+
+
+_UNSET = object()
+
+
+class ExecutionState(MutableMapping):
+    """
+    Slotted pipeline state with the fields of FlowGPTState. Fields written
+    by plugin node types that are not part of the schema go to ``extra``.
+    """
+    FIELDS = ('text', 'config', 'summary', 'translated_text', 'email_result', 'chunks', 'metadata', 'error')
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, data: Optional[Mapping] = None, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, _UNSET)
+        self.extra = None
+        if data is not None:
+            self.update(data)
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key in ExecutionState.FIELDS:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in ExecutionState.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in ExecutionState.FIELDS:
+            if getattr(self, key) is _UNSET:
+                raise KeyError(key)
+            setattr(self, key, _UNSET)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for field in ExecutionState.FIELDS:
+            if getattr(self, field) is not _UNSET:
+                yield field
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        # Faster than the Mapping default, which goes through KeyError
+        if key in ExecutionState.FIELDS:
+            value = getattr(self, key)
+            return default if value is _UNSET else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return to_dict(self)
+
+    def __repr__(self):
+        return f"ExecutionState({self.to_dict()!r})"
+
+
+def to_dict(state: Mapping) -> Dict[str, Any]:
+    """
+    Plain dict copy of a state, with metadata flattened.
+    """
+    plain = dict(state.items())
+    metadata = plain.get('metadata')
+    if isinstance(metadata, Metadata):
+        plain['metadata'] = metadata.to_dict()
+    return plain
+
+
+def _default(obj):
+    if isinstance(obj, Metadata):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return to_dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> str:
+    """
+    Serialise a state, update or any JSON value to a JSON string.
+    """
+    return dumpb(obj).decode()
+
+
+def dumpb(obj: Any) -> bytes:
+    """
+    Serialise like ``dumps`` to UTF-8 bytes, ready to be sent or written.
+    """
+    return orjson.dumps(obj, default=_default)
@@ -0,0 +1,162 @@
+"""
+Streaming summarisation engine used by the summary node.
+
+Sentences are produced lazily from the text, so the lead summary stops
+scanning as soon as it has enough sentences or characters. The extractive
+summary scores sentences by the document frequency of their terms in two
+streaming passes, keeping only the best ``k`` sentences in a heap; memory is
+bounded by ``k``, the vocabulary and one chunk of sentences rather than by
+the size of the document.
+"""
+import heapq
+import itertools
+import re
+from collections import Counter
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+
+# Same boundaries as splitting on whitespace after ".", "!" or "?"
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+WORD = re.compile(r'\w+')
+
+SEPARATOR = '\x00'
+
+# Words plus the separator between joined sentences
+TOKEN = re.compile(r'\w+|\x00')
+
+SUMMARY_MODES = ('lead', 'extractive')
+
+# Sentences scored together in one NumPy pass
+CHUNK_SENTENCES = 1024
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its of on or "
+    "she that the their them they this to was we were will with you your".split()
+)
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    """
+    Yield the sentences of ``text`` one at a time, exactly as
+    ``SENTENCE_BOUNDARY.split(text)`` would return them.
+    """
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        yield text[start:boundary.start()]
+        start = boundary.end()
+    yield text[start:]
+
+
+def truncate(summary: str, max_chars: Optional[int]) -> str:
+    if max_chars and len(summary) > max_chars:
+        return summary[:max_chars] + "..."
+    return summary
+
+
+def lead_summary(text: str, num_sentences: int, max_chars: Optional[int] = None) -> str:
+    """
+    The first ``num_sentences`` sentences, truncated to ``max_chars``.
+    """
+    if not max_chars:
+        return ' '.join(itertools.islice(iter_sentences(text), num_sentences))
+
+    sentences = []
+    length = -1  # of the sentences joined so far
+    start = 0
+    for _ in range(num_sentences):
+        # Anything past max_chars is cut off, so look for the end of the
+        # sentence no further than one character beyond the budget
+        window_end = start + max_chars - length
+        boundary = SENTENCE_BOUNDARY.search(text, start, window_end + 1)
+        if boundary is None:
+            # Either the text ends here or the sentence overflows the budget
+            sentences.append(text[start:window_end])
+            break
+        # The window may have cut the whitespace run short
+        boundary = SENTENCE_BOUNDARY.match(text, boundary.start())
+        sentences.append(text[start:boundary.start()])
+        length += boundary.start() - start + 1
+        start = boundary.end()
+        if length > max_chars:
+            break
+    return truncate(' '.join(sentences), max_chars)
+
+
+def _chunks(sentences: Iterator[str], size: int) -> Iterator[List[str]]:
+    while True:
+        chunk = list(itertools.islice(sentences, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def extractive_summary(text: str, num_sentences: int, max_chars: Optional[int] = None) -> str:
+    """
+    The ``num_sentences`` sentences with the highest mean term frequency,
+    in document order and truncated to ``max_chars``. Ties go to the
+    earlier sentence.
+    """
+    # First pass: document frequency of every term
+    counts = Counter()
+    for chunk in _chunks(iter_sentences(text), CHUNK_SENTENCES):
+        counts.update(WORD.findall(' '.join(chunk).lower()))
+    for word in STOPWORDS:
+        counts.pop(word, None)
+    if not counts:
+        return lead_summary(text, num_sentences, max_chars)
+
+    index = {word: i for i, word in enumerate(counts)}
+    frequency = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    frequency /= frequency.max()
+    # Sentences of a chunk are joined with a separator token, stopwords map to -1
+    index[SEPARATOR] = -2
+    lookup = index.get
+
+    # Second pass: score each chunk at once and keep the top k sentences
+    heap = []  # (score, -position, sentence), the weakest sentence first
+    position = 0
+    for chunk in _chunks(iter_sentences(text), CHUNK_SENTENCES):
+        joined = SEPARATOR.join(chunk)
+        if joined.count(SEPARATOR) != len(chunk) - 1:
+            joined = SEPARATOR.join(sentence.replace(SEPARATOR, ' ') for sentence in chunk)
+        ids = np.array([lookup(token, -1) for token in TOKEN.findall(joined.lower())], dtype=np.intp)
+        owners = np.cumsum(ids == -2)
+        counted = ids >= 0
+        owners, ids = owners[counted], ids[counted]
+        lengths = np.bincount(owners, minlength=len(chunk))
+        totals = np.bincount(owners, weights=frequency[ids], minlength=len(chunk))
+        scores = totals / np.maximum(lengths, 1)
+
+        if len(heap) < num_sentences:
+            candidates = range(len(chunk))
+        else:
+            # Only sentences beating the current weakest one can enter the heap
+            candidates = np.flatnonzero(scores > heap[0][0])
+        for offset in candidates:
+            entry = (float(scores[offset]), -(position + int(offset)), chunk[offset])
+            if len(heap) < num_sentences:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        position += len(chunk)
+
+    best = sorted(heap, key=lambda entry: -entry[1])
+    return truncate(' '.join(entry[2] for entry in best), max_chars)
+
+
+def summarize(text: str, num_sentences: int = 2, max_chars: Optional[int] = None,
+              mode: str = 'lead') -> str:
+    """
+    Summarise ``text`` with the given mode. A non-positive ``num_sentences``
+    keeps the whole text.
+    """
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unsupported summary mode: {mode}")
+    if not (num_sentences and num_sentences > 0):
+        return truncate(text, max_chars)
+    if mode == 'extractive':
+        return extractive_summary(text, num_sentences, max_chars)
+    return lead_summary(text, num_sentences, max_chars)
@@ -0,0 +1,146 @@
+"""
+Precompiled text cleaning engine used by the clean_text node.
+
+All removal and masking options of a config are compiled once into a single
+alternation, so cleaning makes one regex scan over the text followed by the
+whitespace normalisation. Every alternative is written so it cannot
+backtrack over more than the run it starts, keeping the scan linear even on
+adversarial input.
+"""
+import functools
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Scheme followed by everything up to whitespace, quotes or angle brackets
+URL_PATTERN = r'https?://[^\s<>"\']+'
+
+# Only start at the beginning of a local-part run, otherwise a long run
+# without an "@" would be rescanned from every position
+EMAIL_PATTERN = r'(?<![\w.+-])[\w.+-]+@[\w-]+(?:\.[\w-]+)+'
+
+# A tag cannot contain "<", so an unclosed "<" only scans to the next one
+HTML_TAG_PATTERN = r'<[^<>]*>'
+
+SPECIAL_CHARS_PATTERN = r'[^\w\s]+'
+
+DEFAULT_EMAIL_MASK = '[email]'
+
+# Joins documents in batch buffers; no removal pattern may consume it
+BATCH_SEPARATOR = '\x00'
+
+UNICODE_FORMS = ('NFC', 'NFKC', 'NFD', 'NFKD')
+
+
+class TextCleaner:
+    """
+    Cleaner compiled for one combination of clean_text options.
+    """
+
+    def __init__(self, remove_special_chars: bool = False, remove_urls: bool = False,
+                 strip_html: bool = False, email_mask: Optional[str] = None,
+                 unicode_form: Optional[str] = None):
+        self.options = (remove_special_chars, remove_urls, strip_html, email_mask, unicode_form)
+        self.unicode_form = unicode_form
+        self.email_mask = email_mask
+        self.pattern = self._compile_pattern()
+        if email_mask is None:
+            self.replacement = ''
+        else:
+            self.replacement = lambda match: email_mask if match.lastgroup == 'email' else ''
+
+    def _compile_pattern(self, exclude: str = '') -> Optional[re.Pattern]:
+        """
+        Compile the removal alternation. Characters in ``exclude`` are never
+        consumed by the character-class alternatives, which lets batches use
+        them as document separators.
+        """
+        remove_special_chars, remove_urls, strip_html, email_mask, _ = self.options
+
+        # Alternatives are tried in order, so structured tokens win over
+        # the special character class that would otherwise split them up
+        alternatives = []
+        if strip_html:
+            alternatives.append(HTML_TAG_PATTERN.replace('<>', '<>' + exclude))
+        if remove_urls:
+            alternatives.append(URL_PATTERN.replace('<>', '<>' + exclude))
+        if email_mask is not None:
+            alternatives.append(f'(?P<email>{EMAIL_PATTERN})')
+        if remove_special_chars:
+            if strip_html:
+                # Stop special character runs at "<" so tags after punctuation
+                # are still matched as a whole, then drop lone "<" separately
+                alternatives.append(rf'[^\w\s<{exclude}]+|<')
+            else:
+                alternatives.append(SPECIAL_CHARS_PATTERN.replace(r'\s', r'\s' + exclude))
+
+        return re.compile('|'.join(alternatives)) if alternatives else None
+
+    @functools.cached_property
+    def batch_pattern(self) -> Optional[re.Pattern]:
+        return self._compile_pattern(exclude=BATCH_SEPARATOR)
+
+    def clean(self, text: str) -> str:
+        if self.unicode_form:
+            text = unicodedata.normalize(self.unicode_form, text)
+        if self.pattern is not None:
+            text = self.pattern.sub(self.replacement, text)
+        # Collapse whitespace runs (including those left by removals) and strip
+        return ' '.join(text.split())
+
+    def clean_batch(self, texts: List[str]) -> List[str]:
+        """
+        Clean several texts with one scan over a joined buffer. Falls back to
+        cleaning one by one when a text contains the separator itself.
+        """
+        if any(BATCH_SEPARATOR in text for text in texts):
+            return [self.clean(text) for text in texts]
+        buffer = BATCH_SEPARATOR.join(texts)
+        if self.unicode_form:
+            buffer = unicodedata.normalize(self.unicode_form, buffer)
+        if self.batch_pattern is not None:
+            buffer = self.batch_pattern.sub(self.replacement, buffer)
+        # After collapsing, at most a single space is left on either side of
+        # a separator, which belongs to the surrounding documents
+        buffer = ' '.join(buffer.split())
+        return [text.strip(' ') for text in buffer.split(BATCH_SEPARATOR)]
+
+
+def cleaner_options(config: Dict[str, Any]) -> Tuple:
+    """
+    Normalise a clean_text config into the hashable key used for caching.
+    """
+    mask = config.get("mask_emails", False)
+    if mask is True:
+        mask = DEFAULT_EMAIL_MASK
+    elif not mask:
+        mask = None
+
+    form = config.get("normalize_unicode", False)
+    if form is True:
+        form = 'NFKC'
+    elif not form:
+        form = None
+    elif form not in UNICODE_FORMS:
+        raise ValueError(f"Unsupported unicode normalisation form: {form}")
+
+    return (
+        bool(config.get("remove_special_chars", False)),
+        bool(config.get("remove_urls", False)),
+        bool(config.get("strip_html", False)),
+        mask,
+        form,
+    )
+
+
+@functools.lru_cache(maxsize=128)
+def _compile(options: Tuple) -> TextCleaner:
+    return TextCleaner(*options)
+
+
+def get_cleaner(config: Dict[str, Any]) -> TextCleaner:
+    """
+    Return the compiled cleaner for a config, compiling it on first use.
+    """
+    return _compile(cleaner_options(config))
@@ -0,0 +1,227 @@
+"""
+Dictionary-based phrase translation engine used by the translate node.
+
+Dictionaries are loaded once per language pair from data files named
+``<source>-<target>.tsv`` (one ``phrase<TAB>translation`` per line, read
+through a memory map) or ``<source>-<target>.json`` (an object mapping
+phrases to translations). They are searched for in ``FLOWGPT_TRANSLATION_DIRS``
+followed by the bundled ``dictionaries`` directory.
+
+Phrases are stored in a word-level trie, so text is translated in a single
+pass with longest-phrase matching while case and punctuation are preserved.
+Loaded dictionaries are cached and reloaded when their file changes.
+Language names are plain lowercase words, so a node config cannot point the
+lookup outside the dictionary directories.
+"""
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+
+BUNDLED_DICTIONARY_DIR = os.path.join(os.path.dirname(__file__), 'dictionaries')
+
+# Seconds between checks of a cached dictionary's file for changes
+RELOAD_CHECK_INTERVAL = 5.0
+
+LANGUAGE_NAME = re.compile(r'[a-z_]+')
+
+# Splits text into alternating separators (even indexes) and words (odd indexes)
+WORD_SPLIT = re.compile(r'(\w+)')
+
+# Trie key holding the translation of the phrase ending at a node
+_TRANSLATION = ''
+
+
+class PhraseTranslator:
+    """
+    Longest-match phrase translator backed by a word-level trie.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        self.trie: Dict[str, dict] = {}
+        self.size = 0
+        for phrase, translation in entries:
+            words = WORD_SPLIT.findall(phrase.lower())
+            if not words:
+                continue
+            node = self.trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node[_TRANSLATION] = translation
+            self.size += 1
+
+    def translate(self, text: str) -> str:
+        parts = WORD_SPLIT.split(text)
+        trie = self.trie
+        lower = str.lower
+        # Most words start no phrase, so find the candidates in one sweep
+        # and copy everything between them through unchanged
+        candidates = [i for i in range(1, len(parts), 2) if lower(parts[i]) in trie]
+        if not candidates:
+            return text
+
+        output: List[str] = []
+        emitted = 0
+        for i in candidates:
+            if i < emitted:
+                # Already consumed by the previous phrase
+                continue
+            match_end = self._longest_match(parts, i)
+            if match_end is None:
+                continue
+            node = trie
+            for k in range(i, match_end + 1, 2):
+                node = node[lower(parts[k])]
+            output.extend(parts[emitted:i])
+            output.append(_apply_case(parts[i:match_end + 1:2], node[_TRANSLATION]))
+            emitted = match_end + 1
+        output.extend(parts[emitted:])
+        return ''.join(output)
+
+    def _longest_match(self, parts: List[str], i: int) -> Optional[int]:
+        """
+        Index of the last word of the longest phrase starting at word ``i``,
+        extending only across whitespace-only separators.
+        """
+        node = self.trie[parts[i].lower()]
+        match_end = None
+        count = len(parts)
+        j = i
+        while True:
+            if _TRANSLATION in node:
+                match_end = j
+            if j + 2 >= count or not parts[j + 1].isspace():
+                return match_end
+            node = node.get(parts[j + 2].lower())
+            if node is None:
+                return match_end
+            j += 2
+
+
+def _apply_case(source_words: List[str], translation: str) -> str:
+    """
+    Carry the capitalisation of the source phrase over to its translation.
+    """
+    if not translation:
+        return translation
+    first = source_words[0]
+    if all(word.isupper() for word in source_words) and (len(source_words) > 1 or len(first) > 1):
+        return translation.upper()
+    if first[0].isupper():
+        return translation[0].upper() + translation[1:]
+    return translation
+
+
+def _read_tsv(path: str) -> Iterable[Tuple[str, str]]:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                line = line.rstrip(b'\r\n')
+                if not line or line.startswith(b'#'):
+                    continue
+                phrase, sep, translation = line.decode('utf-8').partition('\t')
+                if sep:
+                    yield phrase, translation
+
+
+def _read_json(path: str) -> Iterable[Tuple[str, str]]:
+    with open(path, encoding='utf-8') as f:
+        return list(json.load(f).items())
+
+
+def dictionary_dirs() -> List[str]:
+    return list(getattr(settings, 'FLOWGPT_TRANSLATION_DIRS', [])) + [BUNDLED_DICTIONARY_DIR]
+
+
+def is_language_name(name: Any) -> bool:
+    return isinstance(name, str) and LANGUAGE_NAME.fullmatch(name) is not None
+
+
+def validate_config(config: Optional[Dict[str, Any]]) -> None:
+    """
+    Raise ValueError if a translate node config names an invalid language.
+    """
+    for key in ('source_language', 'target_language'):
+        name = (config or {}).get(key)
+        if name is not None and not (isinstance(name, str) and is_language_name(name.lower())):
+            raise ValueError(f"\"{key}\" must be a language name such as \"spanish\"")
+
+
+def find_dictionary(source: str, target: str) -> Optional[str]:
+    """
+    Return the path of the dictionary file for a language pair, if any.
+    """
+    if not (is_language_name(source) and is_language_name(target)):
+        return None
+    for directory in dictionary_dirs():
+        for extension in ('.tsv', '.json'):
+            path = os.path.join(directory, f"{source}-{target}{extension}")
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def load_translator(path: str) -> PhraseTranslator:
+    entries = _read_json(path) if path.endswith('.json') else _read_tsv(path)
+    return PhraseTranslator(entries)
+
+
+class _CacheEntry:
+    __slots__ = ('translator', 'path', 'mtime', 'checked_at')
+
+    def __init__(self, translator, path, mtime):
+        self.translator = translator
+        self.path = path
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+
+
+_cache: Dict[Tuple[str, str], _CacheEntry] = {}
+_cache_lock = threading.Lock()
+
+
+def get_translator(source: str, target: str) -> Optional[PhraseTranslator]:
+    """
+    Return the cached translator for a language pair, loading or reloading
+    its dictionary as needed. Returns None when the pair is not supported.
+    Unsupported pairs are cached too, and looked up again as often as a
+    dictionary is checked for changes.
+    """
+    if not (isinstance(source, str) and isinstance(target, str)):
+        return None
+    key = (source.lower(), target.lower())
+    if not (is_language_name(key[0]) and is_language_name(key[1])):
+        return None
+    entry = _cache.get(key)
+    if entry is not None and time.monotonic() - entry.checked_at < RELOAD_CHECK_INTERVAL:
+        return entry.translator
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        path = find_dictionary(*key)
+        if path is None:
+            _cache[key] = _CacheEntry(None, None, None)
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        if entry is None or entry.path != path or entry.mtime != mtime:
+            entry = _CacheEntry(load_translator(path), path, mtime)
+            _cache[key] = entry
+        else:
+            entry.checked_at = time.monotonic()
+        return entry.translator
+
+
+def reload_dictionaries() -> None:
+    """
+    Drop every cached dictionary so the next translation reloads it.
+    """
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,69 @@
+"""
+Idempotency keys for pipeline submissions.
+
+Clients retrying ``/api/execute/`` after a timeout send the same
+``Idempotency-Key`` header with every attempt. The key is stored, unique,
+with the execution the first attempt started, and a repeated submission
+within ``FLOWGPT_IDEMPOTENCY_TTL`` seconds gets that execution back, running
+or finished, instead of running the pipeline again. Attempts racing each
+other are settled by the unique constraint. Keys older than the window are
+cleared at most every ``FLOWGPT_IDEMPOTENCY_PRUNE_INTERVAL`` seconds per
+process, so the executions keep their history but release their keys.
+"""
+import datetime
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PipelineExecution
+
+
+MAX_KEY_LENGTH = PipelineExecution._meta.get_field('idempotency_key').max_length
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def validate_key(key: str) -> None:
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise ValueError(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} printable characters")
+
+
+def expiry_cutoff() -> datetime.datetime:
+    return timezone.now() - datetime.timedelta(seconds=settings.FLOWGPT_IDEMPOTENCY_TTL)
+
+
+def find_execution(key: str) -> Optional[Dict[str, Any]]:
+    """
+    The execution started with ``key`` within the retention window, or None.
+    A key found past the window is released so it can be used again.
+    """
+    execution = (
+        PipelineExecution.objects.filter(idempotency_key=key)
+        .values('id', 'pipeline_id', 'is_complete', 'started_at', 'output_data')
+        .first()
+    )
+    if execution is not None and execution['started_at'] < expiry_cutoff():
+        PipelineExecution.objects.filter(id=execution['id'], idempotency_key=key).update(idempotency_key=None)
+        return None
+    return execution
+
+
+def prune_expired_keys(force: bool = False) -> int:
+    """
+    Clear the keys of executions older than the retention window, unless
+    this process pruned less than ``FLOWGPT_IDEMPOTENCY_PRUNE_INTERVAL``
+    seconds ago. Returns the number of keys cleared.
+    """
+    global _last_prune
+    with _prune_lock:
+        now = time.monotonic()
+        if not force and now - _last_prune < settings.FLOWGPT_IDEMPOTENCY_PRUNE_INTERVAL:
+            return 0
+        _last_prune = now
+    return PipelineExecution.objects.filter(
+        idempotency_key__isnull=False, started_at__lt=expiry_cutoff()
+    ).update(idempotency_key=None)
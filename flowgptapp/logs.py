@@ -0,0 +1,185 @@
+"""
+Structured, non-blocking logging for FlowGPT.
+
+The ``flowgptapp`` loggers write through ``QueueStreamHandler``: the thread
+emitting a record only puts it on a bounded queue, and a ``QueueListener``
+thread formats it as one JSON line and writes it to the stream. When the
+queue is full, records are dropped and counted instead of blocking the
+execution.
+
+Records carry the ids of the execution and node they were emitted for.
+``log_context`` sets them for everything logged inside it, including by
+node functions, and ``ExecutionContextFilter`` copies them onto each record.
+``SamplingFilter`` rate-limits high-volume debug events per message.
+"""
+import atexit
+import contextlib
+import datetime
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Tuple, Union
+
+import orjson
+
+
+DEFAULT_QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; any other attribute came from ``extra``
+# or the context filter and is written as a field of its own
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_log_context: ContextVar[Dict[str, Any]] = ContextVar('flowgpt_log_context', default={})
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Add fields, such as ``execution_id`` and ``node_id``, to every record
+    logged in the block.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ExecutionContextFilter(logging.Filter):
+    """
+    Copies the fields of the enclosing ``log_context`` onto the record.
+    Fields passed in ``extra`` win.
+    """
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most ``rate`` records per second, with bursts of up to
+    ``burst``, of every message logged at or below ``level``; records above
+    it always pass. Messages are told apart by their format string, so
+    ``logger.debug("Step %s recorded", step)`` is one stream. The next record
+    let through counts the ones dropped before it in ``sampled_out``.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 50, level: Union[int, str] = logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = logging._checkLevel(level)
+        # Tokens left, time of the last refill and records dropped, per message
+        self._buckets: Dict[Tuple[str, Any], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            else:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single JSON line: time, level, logger and message,
+    then every structured field, then the traceback if any.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a listener thread that formats and writes them to
+    ``stream``. Emitting never blocks: when ``queue_size`` records are
+    waiting, new ones are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, stream=None, queue_size: int = DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+        # A forked worker inherits the queue but not the listener thread
+        os.register_at_fork(after_in_child=self._restart)
+
+    def _restart(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Merge the message arguments and render the traceback before the
+        record crosses threads; the JSON line is built by the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info) \
+                if self.target.formatter else logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # emit() can be called without handle() holding the lock, and
+            # += on an attribute is not atomic across threads
+            with self.lock:
+                self.dropped += 1
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None and listener._thread is not None:
+            # Writes out the records still queued
+            listener.stop()
+        super().close()
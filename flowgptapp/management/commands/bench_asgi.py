@@ -0,0 +1,136 @@
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from django.urls import path
+import asyncio
+import threading
+import time
+
+import httpx
+
+from flowgptapp.benchmarks import latency_summary, write_results
+from flowgptapp.models import Pipeline, PipelineExecution
+from flowgptapp.views import execution_summary, get_execution_status
+
+
+MODES = ('async', 'sync')
+
+
+def hold_sync(request, execution_id):
+    """
+    What a synchronous long poll costs: the request keeps its worker thread
+    for the whole wait.
+    """
+    # The same check the async view makes before and after its wait
+    execution_summary(execution_id).first()
+    time.sleep(float(request.GET['wait']))
+    execution_summary(execution_id).first()
+    return HttpResponse(status=304)
+
+
+# The benchmark serves its own URLs: the async status view and its sync counterpart
+urlpatterns = [
+    path('async/<int:execution_id>/', get_execution_status),
+    path('sync/<int:execution_id>/', hold_sync),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compares how many held connections one ASGI process serves with sync and async views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='10,100,500,1000',
+                            help='Comma-separated numbers of connections held at once')
+        parser.add_argument('--wait', type=float, default=2.0, help='Seconds every request is held')
+        parser.add_argument('--modes', default=','.join(MODES), help='Comma-separated modes: async, sync')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(c) for c in options['concurrency'].split(',') if c.strip()]
+        except ValueError as e:
+            raise CommandError(str(e))
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+        # A running execution that does not change, so every poll is held
+        pipeline = Pipeline.objects.create(name='ASGI benchmark', is_active=False)
+        execution = PipelineExecution.objects.create(pipeline=pipeline, input_data='')
+        try:
+            with override_settings(ROOT_URLCONF=__name__):
+                results = asyncio.run(self.sweep(execution.id, levels, modes, options['wait']))
+        finally:
+            pipeline.delete()
+
+        if options['output']:
+            write_results(options['output'], {'wait_s': options['wait'], 'results': results})
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    async def sweep(self, execution_id, levels, modes, wait):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Holding connections for {wait}s in one process..."))
+        transport = httpx.ASGITransport(app=get_asgi_application())
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url='http://localhost', timeout=None) as client:
+            response = await client.get(f'/async/{execution_id}/')
+            etag = response.headers['ETag']
+            for concurrency in levels:
+                for mode in modes:
+                    result = await self.run_level(client, mode, execution_id, etag, concurrency, wait)
+                    results.append(result)
+                    self.report(result)
+        return results
+
+    async def run_level(self, client, mode, execution_id, etag, concurrency, wait):
+        latencies = []
+        errors = 0
+        baseline = threading.active_count()
+        peak = baseline
+
+        async def request():
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                response = await client.get(f'/{mode}/{execution_id}/', params={'wait': wait},
+                                            headers={'If-None-Match': etag})
+            except httpx.HTTPError:
+                errors += 1
+                return
+            if response.status_code == 304:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+        async def sample():
+            nonlocal peak
+            while True:
+                peak = max(peak, threading.active_count())
+                await asyncio.sleep(0.05)
+
+        sampler = asyncio.ensure_future(sample())
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+        sampler.cancel()
+
+        return {
+            'mode': mode,
+            'concurrency': concurrency,
+            'duration_s': duration,
+            'completed': len(latencies),
+            'errors': errors,
+            # Connections the process could hold at once within one wait
+            'held_per_wait': len(latencies) * wait / duration if duration else 0.0,
+            'extra_threads': peak - baseline,
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result['mode']:>5} x {result['concurrency']:>5}: {result['duration_s']:6.2f}s | "
+            f"held per wait {result['held_per_wait']:7.1f} | +{result['extra_threads']:>5} threads | "
+            f"p99 {result['latency_ms'].get('p99', 0):8.1f} ms | errors {result['errors']}"
+        )
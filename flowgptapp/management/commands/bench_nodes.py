@@ -0,0 +1,166 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+import datetime
+import os
+import platform
+
+from flowgptapp.benchmarks import (
+    INPUT_GENERATORS, NODE_CONFIG_VARIANTS, compare_to_baseline, config_key, fit_complexity,
+    format_size, load_results, parse_size, time_node_function, write_results,
+)
+from flowgptapp.graph.registry import NODE_FUNCTIONS
+
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'node_functions.json')
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmarks every registered node function across input sizes and config variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--node-types', help='Comma-separated node types (defaults to all registered)')
+        parser.add_argument('--sizes', default='100B,1KB,10KB,100KB,1MB,10MB,100MB',
+                            help='Comma-separated input sizes')
+        parser.add_argument('--inputs', default='prose',
+                            help=f"Comma-separated input kinds: {', '.join(INPUT_GENERATORS)}")
+        parser.add_argument('--repeat', type=int, default=3, help='Measurements per case; the best is kept')
+        parser.add_argument('--fit-min-size', default='10KB',
+                            help='Smallest input size used when fitting the complexity curve')
+        parser.add_argument('--superlinear', type=float, default=1.2,
+                            help='Fitted exponent above which a function is flagged as super-linear')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+        parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                            help=f'Compare against a saved baseline (default: {DEFAULT_BASELINE})')
+        parser.add_argument('--threshold', type=float, default=25.0,
+                            help='Allowed per-case slowdown against the baseline, in percent')
+        parser.add_argument('--fail-on-superlinear', action='store_true',
+                            help='Exit with an error when any function is flagged as super-linear')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(parse_size(s) for s in options['sizes'].split(',') if s.strip())
+            fit_min_size = parse_size(options['fit_min_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        node_types = list(NODE_FUNCTIONS)
+        if options['node_types']:
+            node_types = [t.strip() for t in options['node_types'].split(',') if t.strip()]
+            for node_type in node_types:
+                if node_type not in NODE_FUNCTIONS:
+                    raise CommandError(f"Unknown node type: {node_type}")
+
+        input_kinds = [k.strip() for k in options['inputs'].split(',') if k.strip()]
+        for kind in input_kinds:
+            if kind not in INPUT_GENERATORS:
+                raise CommandError(f"Unknown input kind: {kind}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Benchmarking node functions...'))
+
+        results = []
+        curves = []
+        # Time the regex node on every size, including texts it refuses by default
+        with override_settings(FLOWGPT_REGEX_MAX_INPUT_CHARS=None):
+            for kind in input_kinds:
+                texts = {size: INPUT_GENERATORS[kind](size) for size in sizes}
+                for node_type in node_types:
+                    for config in NODE_CONFIG_VARIANTS.get(node_type, [{}]):
+                        self.bench_variant(node_type, config, kind, texts, sizes, fit_min_size,
+                                           options, results, curves)
+
+        data = {
+            'meta': {
+                'created_at': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'results': results,
+            'curves': curves,
+        }
+        if options['output']:
+            write_results(options['output'], data)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        failures = []
+        flagged = [c for c in curves if c['superlinear']]
+        if flagged:
+            self.stdout.write(self.style.WARNING('Super-linear scaling detected:'))
+            for curve in flagged:
+                self.stdout.write(f"  {curve['node_type']} {curve['config']} ({curve['input']}): "
+                                  f"O(n^{curve['exponent']:.2f})")
+            if options['fail_on_superlinear']:
+                failures.append(f"{len(flagged)} function(s) scale super-linearly")
+
+        if options['baseline']:
+            regressions = self.check_baseline(results, options['baseline'], options['threshold'])
+            if regressions:
+                failures.append(f"{regressions} case(s) regressed beyond {options['threshold']}%")
+
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def bench_variant(self, node_type, config, kind, texts, sizes, fit_min_size, options, results, curves):
+        """
+        Time one config variant over every input size and fit its complexity curve.
+        """
+        node_function = NODE_FUNCTIONS[node_type]
+        variant = config_key(config)
+        timings = []
+        for size in sizes:
+            seconds = time_node_function(node_function, texts[size], config, repeat=options['repeat'])
+            timings.append(seconds)
+            results.append({
+                'node_type': node_type,
+                'config': variant,
+                'input': kind,
+                'size': format_size(size),
+                'size_bytes': size,
+                'seconds': seconds,
+                'ns_per_byte': seconds * 1e9 / size,
+            })
+
+        fit_sizes = [s for s in sizes if s >= fit_min_size]
+        fit_timings = [t for s, t in zip(sizes, timings) if s >= fit_min_size]
+        exponent = fit_complexity(fit_sizes, fit_timings)
+        superlinear = exponent is not None and exponent > options['superlinear']
+        curves.append({
+            'node_type': node_type,
+            'config': variant,
+            'input': kind,
+            'exponent': exponent,
+            'superlinear': superlinear,
+        })
+        self.report(node_type, variant, kind, sizes, timings, exponent, superlinear)
+
+    def report(self, node_type, variant, kind, sizes, timings, exponent, superlinear):
+        fitted = f"O(n^{exponent:.2f})" if exponent is not None else 'n/a'
+        line = f"{node_type:>12} {kind:<12} {variant:<55} {fitted}"
+        self.stdout.write(self.style.WARNING(line) if superlinear else line)
+        self.stdout.write('    ' + '  '.join(
+            f"{format_size(size)}: {seconds * 1000:.3f} ms" for size, seconds in zip(sizes, timings)
+        ))
+
+    def check_baseline(self, results, path, threshold):
+        """
+        Compare every (node type, config, input, size) timing with the baseline.
+        """
+        try:
+            baseline = load_results(path)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+
+        rows = compare_to_baseline(results, baseline, ('node_type', 'config', 'input', 'size_bytes'),
+                                   'seconds', threshold)
+        regressed = [row for row in rows if row['regressed']]
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Compared {len(rows)} case(s) with baseline {path}"))
+        for row in regressed:
+            key = row['key']
+            self.stdout.write(self.style.ERROR(
+                f"  {key['node_type']} {key['config']} {key['input']} {format_size(key['size_bytes'])}: "
+                f"{row['baseline'] * 1000:.3f} -> {row['current'] * 1000:.3f} ms ({row['change_pct']:+.1f}%)"
+            ))
+        if not regressed:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+        return len(regressed)
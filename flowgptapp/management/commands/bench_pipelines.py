@@ -0,0 +1,197 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+import datetime
+import platform
+import time
+
+import django
+
+from flowgptapp.benchmarks import (
+    compare_to_baseline, format_size, generate_text, latency_summary, load_results,
+    parse_size, peak_rss_mb, traced_peak_mb, write_results,
+)
+from flowgptapp.graph.pipeline_executor import execute_pipeline
+from flowgptapp.models import Edge, Node, Pipeline
+
+
+SHAPES = ('chain', 'fanout', 'diamond')
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks end-to-end pipeline execution over synthetic pipelines and inputs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shapes', default=','.join(SHAPES),
+                            help='Comma-separated pipeline shapes: chain, fanout, diamond')
+        parser.add_argument('--length', type=int, default=4,
+                            help='Number of nodes in each synthetic pipeline')
+        parser.add_argument('--sizes', default='1KB,1MB,50MB',
+                            help='Comma-separated input sizes, e.g. 1KB,64KB,1MB,50MB')
+        parser.add_argument('--node-types', default='clean_text,uppercase,summary,translate',
+                            help='Node types cycled through when building pipelines')
+        parser.add_argument('--runs', type=int, default=5, help='Measured runs per case')
+        parser.add_argument('--warmup', type=int, default=1, help='Unmeasured runs per case')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+        parser.add_argument('--baseline', help='Compare against results saved with --output')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Allowed p50 latency regression against the baseline, in percent')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the synthetic pipelines and executions instead of rolling back')
+
+    def handle(self, *args, **options):
+        shapes = [s.strip() for s in options['shapes'].split(',') if s.strip()]
+        for shape in shapes:
+            if shape not in SHAPES:
+                raise CommandError(f"Unknown shape: {shape}")
+        min_length = 3 if 'diamond' in shapes else 2
+        if options['length'] < min_length:
+            raise CommandError(f"--length must be at least {min_length}")
+        try:
+            sizes = [parse_size(s) for s in options['sizes'].split(',') if s.strip()]
+        except ValueError as e:
+            raise CommandError(str(e))
+        node_types = [t.strip() for t in options['node_types'].split(',') if t.strip()]
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Benchmarking FlowGPT pipelines...'))
+
+        results = []
+        with transaction.atomic():
+            for shape in shapes:
+                pipeline = self.build_pipeline(shape, options['length'], node_types)
+                for size in sizes:
+                    result = self.run_case(pipeline, shape, options['length'], size,
+                                           options['runs'], options['warmup'])
+                    results.append(result)
+                    self.report(result)
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        data = {
+            'meta': {
+                'created_at': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'node_types': node_types,
+            },
+            'results': results,
+        }
+        if options['output']:
+            write_results(options['output'], data)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self.check_baseline(results, options['baseline'], options['threshold'])
+
+    def build_pipeline(self, shape, length, node_types):
+        """
+        Create a synthetic pipeline of the given shape and number of nodes.
+        """
+        pipeline = Pipeline.objects.create(
+            name=f"Benchmark {shape} x{length}",
+            description="Synthetic pipeline created by bench_pipelines.",
+            is_active=False,
+        )
+        nodes = [
+            Node.objects.create(
+                name=f"Benchmark {node_types[i % len(node_types)]} {i}",
+                node_type=node_types[i % len(node_types)],
+                config={},
+            )
+            for i in range(length)
+        ]
+
+        if shape == 'chain':
+            pairs = list(zip(nodes, nodes[1:]))
+        elif shape == 'fanout':
+            pairs = [(nodes[0], node) for node in nodes[1:]]
+        else:
+            middle = nodes[1:-1]
+            pairs = [(nodes[0], node) for node in middle] + [(node, nodes[-1]) for node in middle]
+
+        Edge.objects.bulk_create([
+            Edge(pipeline=pipeline, source=source, target=target, order=i)
+            for i, (source, target) in enumerate(pairs)
+        ])
+        return pipeline
+
+    def run_case(self, pipeline, shape, length, size, runs, warmup):
+        """
+        Execute the pipeline ``runs`` times over a generated input of ``size`` bytes.
+        """
+        text = generate_text(size)
+        for _ in range(warmup):
+            execute_pipeline(pipeline.id, text)
+
+        latencies = []
+        queries = 0
+        for _ in range(runs):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                execute_pipeline(pipeline.id, text)
+                latencies.append(time.perf_counter() - start)
+            queries += len(captured)
+        # Measured in a run of its own: tracing would skew the latencies,
+        # and the process RSS only ever grows from case to case
+        peak_memory = traced_peak_mb(lambda: execute_pipeline(pipeline.id, text))
+
+        total = sum(latencies)
+        return {
+            'shape': shape,
+            'length': length,
+            'size': format_size(size),
+            'size_bytes': size,
+            'runs': runs,
+            'throughput_runs_per_s': runs / total if total else 0.0,
+            'throughput_mb_per_s': runs * size / (1024 ** 2) / total if total else 0.0,
+            'latency_ms': latency_summary(latencies),
+            'queries_per_run': queries / runs if runs else 0,
+            'peak_memory_mb': peak_memory,
+            'process_peak_rss_mb': peak_rss_mb(),
+        }
+
+    def report(self, result):
+        latency = result['latency_ms']
+        rss = result['process_peak_rss_mb']
+        self.stdout.write(
+            f"{result['shape']:>8} x{result['length']} {result['size']:>6}: "
+            f"{result['throughput_runs_per_s']:8.2f} runs/s "
+            f"{result['throughput_mb_per_s']:8.2f} MB/s | "
+            f"p50 {latency['p50']:9.2f} ms  p95 {latency['p95']:9.2f} ms  p99 {latency['p99']:9.2f} ms | "
+            f"{result['queries_per_run']:.1f} queries/run | "
+            f"peak memory {result['peak_memory_mb']:.1f} MB, "
+            f"process peak RSS {f'{rss:.1f} MB' if rss is not None else 'n/a'}"
+        )
+
+    def check_baseline(self, results, path, threshold):
+        """
+        Compare p50 latency and query counts with a saved baseline.
+        """
+        try:
+            baseline = load_results(path)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+
+        key_fields = ('shape', 'length', 'size_bytes')
+        rows = compare_to_baseline(results, baseline, key_fields, 'latency_ms.p50', threshold)
+        query_rows = compare_to_baseline(results, baseline, key_fields, 'queries_per_run', 0.0)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Comparison with baseline {path}:'))
+        regressions = 0
+        for row, query_row in zip(rows, query_rows):
+            key = row['key']
+            line = (f"{key['shape']:>8} x{key['length']} {format_size(key['size_bytes']):>6}: "
+                    f"p50 {row['baseline']:.2f} -> {row['current']:.2f} ms ({row['change_pct']:+.1f}%), "
+                    f"queries {query_row['baseline']:.1f} -> {query_row['current']:.1f}")
+            if row['regressed'] or query_row['regressed']:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+
+        if not rows:
+            self.stdout.write(self.style.WARNING('No matching cases found in the baseline.'))
+        if regressions:
+            raise CommandError(f"{regressions} case(s) regressed beyond {threshold}%")
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse
+import json
+import time
+
+from flowgptapp.benchmarks import format_size, generate_text, latency_summary, parse_size, write_results
+from flowgptapp.graph.state import dumps
+from flowgptapp.middleware import ENCODERS
+from flowgptapp.responses import OrjsonResponse, raw_json
+
+
+# Steps in the synthetic status response; each stores part of the result
+STEPS = 4
+
+
+def execute_result(text):
+    """
+    A final state shaped like the result of /api/execute/.
+    """
+    return {
+        'text': text,
+        'summary': text[:len(text) // 10],
+        'translated_text': text,
+        'metadata': {'execution_id': 1, 'start_time': 0.0, 'end_time': 1.0, 'nodes': ['clean_text', 'translate']},
+    }
+
+
+def stored_steps(text):
+    """
+    Step outputs as the executor stores them, as JSON text.
+    """
+    chunk = len(text) // STEPS
+    return [dumps({'text': text[i * chunk:(i + 1) * chunk], 'metadata': {'step': i}}) for i in range(STEPS)]
+
+
+def status_stdlib(outputs):
+    return JsonResponse({'steps': [{'id': i, 'output': json.loads(output)} for i, output in enumerate(outputs)]})
+
+
+def status_orjson(outputs):
+    return OrjsonResponse({'steps': [{'id': i, 'output': raw_json(output)} for i, output in enumerate(outputs)]})
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks API response serialisation and compression for large results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1MB,20MB', help='Comma-separated result sizes, e.g. 1MB,20MB')
+        parser.add_argument('--runs', type=int, default=5, help='Measured runs per case')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        results = []
+        for size in sizes:
+            # Non-ASCII text, escaped by the standard library encoder but not by orjson
+            text = generate_text(size).replace('hello', 'héllo')[:size]
+            result = execute_result(text)
+            outputs = stored_steps(text)
+            cases = [
+                ('execute', 'json', lambda: JsonResponse({'success': True, 'result': result})),
+                ('execute', 'orjson', lambda: OrjsonResponse({'success': True, 'result': result})),
+                ('status', 'json', lambda: status_stdlib(outputs)),
+                ('status', 'orjson', lambda: status_orjson(outputs)),
+            ]
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{format_size(size)} results"))
+            for endpoint, serializer, build in cases:
+                row = self.measure(endpoint, serializer, size, build, options['runs'])
+                results.append(row)
+                self.report(row)
+
+        if options['output']:
+            write_results(options['output'], {'results': results})
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def measure(self, endpoint, serializer, size, build, runs):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            response = build()
+            timings.append(time.perf_counter() - start)
+        row = {
+            'endpoint': endpoint,
+            'serializer': serializer,
+            'size': format_size(size),
+            'serialize_ms': latency_summary(timings),
+            'bytes': len(response.content),
+            'encodings': {},
+        }
+        for encoding, encode in ENCODERS.items():
+            start = time.perf_counter()
+            compressed = encode(response.content)
+            row['encodings'][encoding] = {
+                'compress_ms': (time.perf_counter() - start) * 1000,
+                'bytes': len(compressed),
+            }
+        return row
+
+    def report(self, row):
+        encodings = '  '.join(
+            f"{name} {stats['bytes']:>10} in {stats['compress_ms']:7.1f} ms"
+            for name, stats in row['encodings'].items()
+        )
+        self.stdout.write(
+            f"  {row['endpoint']:>7} {row['serializer']:>6}: p50 {row['serialize_ms']['p50']:8.1f} ms | "
+            f"{row['bytes']:>10} bytes | {encodings}"
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from flowgptapp.outbox import (
+    DEFAULT_BACKOFF_BASE, DEFAULT_BACKOFF_MAX, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS,
+    EmailDispatcher,
+)
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued outbox emails in batches over persistent SMTP connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Messages claimed per batch')
+        parser.add_argument('--connections', type=int, default=1,
+                            help='Persistent SMTP connections used in parallel')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                            help='Deliveries tried before a message is marked as failed')
+        parser.add_argument('--backoff-base', type=float, default=DEFAULT_BACKOFF_BASE,
+                            help='Seconds before the first retry, doubled for every further attempt')
+        parser.add_argument('--backoff-max', type=float, default=DEFAULT_BACKOFF_MAX,
+                            help='Longest delay between retries in seconds')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait when no message is due')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver every due message and exit instead of polling')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['connections'] < 1:
+            raise CommandError('--batch-size and --connections must be at least 1')
+
+        dispatcher = EmailDispatcher(
+            batch_size=options['batch_size'],
+            connections=options['connections'],
+            max_attempts=options['max_attempts'],
+            backoff_base=options['backoff_base'],
+            backoff_max=options['backoff_max'],
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING('Dispatching outbox emails...'))
+        try:
+            while True:
+                stats = dispatcher.drain()
+                if stats.sent or stats.retried or stats.failed:
+                    self.report(stats)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
+
+    def report(self, stats):
+        self.stdout.write(
+            f"Sent {stats.sent} message(s) in {stats.seconds:.2f}s ({stats.rate:.1f} msg/s), "
+            f"{stats.retried} rescheduled, {stats.failed} failed"
+        )
+        if stats.failed:
+            self.stdout.write(self.style.WARNING(f"{stats.failed} message(s) gave up after errors"))
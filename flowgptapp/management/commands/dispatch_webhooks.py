@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from flowgptapp.outbox import DEFAULT_BACKOFF_BASE, DEFAULT_BACKOFF_MAX, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS
+from flowgptapp.webhooks import DEFAULT_CONCURRENCY, WebhookDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued execution webhooks in batches over kept-alive HTTP connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Deliveries claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                            help='Requests sent in parallel, and connections kept alive')
+        parser.add_argument('--timeout', type=float, default=None,
+                            help='Seconds to wait for a receiver (default: FLOWGPT_WEBHOOK_TIMEOUT)')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                            help='Deliveries tried before a webhook is marked as failed')
+        parser.add_argument('--backoff-base', type=float, default=DEFAULT_BACKOFF_BASE,
+                            help='Seconds before the first retry, doubled for every further attempt')
+        parser.add_argument('--backoff-max', type=float, default=DEFAULT_BACKOFF_MAX,
+                            help='Longest delay between retries in seconds')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when no webhook is due')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver every due webhook and exit instead of polling')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--batch-size and --concurrency must be at least 1')
+
+        dispatcher = WebhookDispatcher(
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            timeout=options['timeout'],
+            max_attempts=options['max_attempts'],
+            backoff_base=options['backoff_base'],
+            backoff_max=options['backoff_max'],
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING('Dispatching webhooks...'))
+        try:
+            while True:
+                stats = dispatcher.drain()
+                if stats.sent or stats.retried or stats.failed:
+                    self.report(stats)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
+
+    def report(self, stats):
+        self.stdout.write(
+            f"Delivered {stats.sent} webhook(s) in {stats.seconds:.2f}s ({stats.rate:.1f}/s), "
+            f"{stats.retried} rescheduled, {stats.failed} failed"
+        )
+        if stats.failed:
+            self.stdout.write(self.style.WARNING(f"{stats.failed} webhook(s) gave up after errors"))
@@ -0,0 +1,212 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application,
+)
+import asyncio
+import collections
+import random
+import threading
+import time
+
+import httpx
+
+from flowgptapp.benchmarks import generate_text, latency_summary, parse_size, write_results
+from flowgptapp.models import Pipeline
+
+
+LOCK_ERROR_MARKERS = ('database is locked', 'database table is locked')
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    """Request handler that does not log every request to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OperationStats:
+    """Latency and error counters for one kind of request."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock_errors = 0
+        self.status_codes = collections.Counter()
+
+    def as_dict(self, duration):
+        total = len(self.latencies) + self.errors
+        return {
+            'requests': total,
+            'rps': total / duration if duration else 0.0,
+            'errors': self.errors,
+            'error_rate': self.errors / total if total else 0.0,
+            'sqlite_lock_errors': self.lock_errors,
+            'status_codes': dict(self.status_codes),
+            'latency_ms': latency_summary(self.latencies),
+        }
+
+
+class Command(BaseCommand):
+    help = 'Drives concurrent submit and status-poll traffic against the execution APIs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Base URL of a running server. Starts the app in-process if omitted')
+        parser.add_argument('--pipeline', type=int, help='Pipeline ID to submit (defaults to the first active pipeline)')
+        parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                            help='Comma-separated numbers of concurrent clients to sweep')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each concurrency level')
+        parser.add_argument('--submit-ratio', type=float, default=0.2,
+                            help='Fraction of requests that submit executions; the rest poll status')
+        parser.add_argument('--size', default='1KB', help='Size of the submitted input text')
+        parser.add_argument('--think-time', type=float, default=0.0,
+                            help='Seconds each client waits between requests (home.html polls every 1s)')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(c) for c in options['concurrency'].split(',') if c.strip()]
+            text = generate_text(parse_size(options['size']))
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not 0.0 <= options['submit_ratio'] <= 1.0:
+            raise CommandError('--submit-ratio must be between 0 and 1')
+
+        pipeline_id = options['pipeline']
+        if pipeline_id is None:
+            pipeline = Pipeline.objects.filter(is_active=True).order_by('id').first()
+            if pipeline is None:
+                raise CommandError("No active pipelines found. Run 'python manage.py load_sample_data' first.")
+            pipeline_id = pipeline.id
+
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server = self.start_server()
+            base_url = 'http://%s:%s' % server.server_address[:2]
+            self.stdout.write(f"Started in-process server at {base_url}")
+
+        try:
+            results = asyncio.run(self.sweep(base_url, pipeline_id, text, levels, options))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.report_knee(results)
+        if options['output']:
+            write_results(options['output'], {'url': base_url, 'pipeline_id': pipeline_id, 'results': results})
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def start_server(self):
+        """
+        Serve the WSGI application from a background thread on an ephemeral port.
+        """
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+        server.set_app(get_internal_wsgi_application())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+    async def sweep(self, base_url, pipeline_id, text, levels, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Load testing pipeline {pipeline_id} with {len(text)} byte inputs..."))
+        results = []
+        async with httpx.AsyncClient(base_url=base_url, timeout=options['timeout']) as client:
+            # Seed one execution so status polls have something to fetch
+            execution_ids = collections.deque(maxlen=1000)
+            response = await client.post('/api/execute/', data={'pipeline_id': pipeline_id, 'input_text': text})
+            if response.status_code != 200:
+                raise CommandError(f"Seed submission failed with HTTP {response.status_code}: {response.text[:200]}")
+            execution_ids.append(response.json()['execution_id'])
+
+        for concurrency in levels:
+            # One keep-alive connection per virtual client
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=base_url, timeout=options['timeout'], limits=limits) as client:
+                result = await self.run_level(client, pipeline_id, text, concurrency, execution_ids, options)
+            results.append(result)
+            self.report(result)
+        return results
+
+    async def run_level(self, client, pipeline_id, text, concurrency, execution_ids, options):
+        stats = {'submit': OperationStats(), 'poll': OperationStats()}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + options['duration']
+
+        async def virtual_client(seed):
+            rng = random.Random(seed)
+            while loop.time() < deadline:
+                if rng.random() < options['submit_ratio']:
+                    op = 'submit'
+                    request = client.post('/api/execute/', data={'pipeline_id': pipeline_id, 'input_text': text})
+                else:
+                    op = 'poll'
+                    request = client.get(f'/api/execution/{rng.choice(execution_ids)}/status/')
+                start = time.perf_counter()
+                try:
+                    response = await request
+                except httpx.HTTPError as e:
+                    stats[op].errors += 1
+                    stats[op].status_codes[type(e).__name__] += 1
+                else:
+                    elapsed = time.perf_counter() - start
+                    stats[op].status_codes[str(response.status_code)] += 1
+                    if response.status_code == 200:
+                        stats[op].latencies.append(elapsed)
+                        if op == 'submit':
+                            execution_ids.append(response.json()['execution_id'])
+                    else:
+                        stats[op].errors += 1
+                        if any(marker in response.text for marker in LOCK_ERROR_MARKERS):
+                            stats[op].lock_errors += 1
+                if options['think_time']:
+                    await asyncio.sleep(options['think_time'])
+
+        started = loop.time()
+        await asyncio.gather(*(virtual_client(i) for i in range(concurrency)))
+        duration = loop.time() - started
+
+        ops = {name: op_stats.as_dict(duration) for name, op_stats in stats.items()}
+        total = sum(op['requests'] for op in ops.values())
+        errors = sum(op['errors'] for op in ops.values())
+        return {
+            'concurrency': concurrency,
+            'duration_s': duration,
+            'rps': total / duration if duration else 0.0,
+            'error_rate': errors / total if total else 0.0,
+            'sqlite_lock_errors': sum(op['sqlite_lock_errors'] for op in ops.values()),
+            'operations': ops,
+        }
+
+    def report(self, result):
+        self.stdout.write(
+            f"concurrency {result['concurrency']:>4}: {result['rps']:8.1f} req/s | "
+            f"errors {result['error_rate'] * 100:5.1f}% | "
+            f"sqlite lock errors {result['sqlite_lock_errors']}"
+        )
+        for name, op in result['operations'].items():
+            latency = op['latency_ms']
+            if not latency.get('count'):
+                continue
+            self.stdout.write(
+                f"    {name:>6}: {op['rps']:8.1f} req/s  p50 {latency['p50']:8.2f} ms  "
+                f"p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms  errors {op['errors']}"
+            )
+
+    def report_knee(self, results):
+        """
+        Report the concurrency level after which throughput stops scaling.
+        """
+        best = None
+        for previous, current in zip(results, results[1:]):
+            if current['rps'] < previous['rps'] * 1.1:
+                best = previous
+                break
+        if best is None and results:
+            best = results[-1]
+            self.stdout.write(self.style.SUCCESS(
+                f"Throughput kept scaling up to concurrency {best['concurrency']} ({best['rps']:.1f} req/s)"))
+        elif best is not None:
+            self.stdout.write(self.style.WARNING(
+                f"Throughput stops scaling beyond concurrency {best['concurrency']} ({best['rps']:.1f} req/s)"))
@@ -0,0 +1,527 @@
+"""
+Prometheus-style metrics for FlowGPT.
+
+Metrics are recorded into per-thread shards so the hot path (node execution,
+query wrappers) never contends on a lock. Shards are merged when the metrics
+are scraped. When ``FLOWGPT_METRICS_DIR`` is set, every worker process
+writes its merged snapshot to that directory when it records a value and
+``FLUSH_INTERVAL`` has passed, from a background thread otherwise, and when
+it exits. The ``/metrics`` view aggregates the snapshots of all processes.
+The counters and histograms of processes that have exited are folded into
+``archive.json``, as in prometheus_client's multiprocess mode, so totals
+never go down when a worker is recycled; their gauges are dropped.
+"""
+import atexit
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# How often (seconds) a process writes its snapshot to the shared directory
+FLUSH_INTERVAL = 5.0
+
+# Snapshot holding the counters and histograms of processes that have exited
+ARCHIVE_FILENAME = 'archive.json'
+LOCK_FILENAME = '.lock'
+
+
+def get_metrics_dir() -> Optional[str]:
+    """
+    Return the shared multi-process metrics directory, if one is configured.
+    """
+    return getattr(settings, 'FLOWGPT_METRICS_DIR', None) or None
+
+
+class MetricsRegistry:
+    """
+    Holds metric definitions and the per-thread value shards.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, 'Metric'] = {}
+        self._shards: List[Dict[Tuple, Any]] = []
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+        self._next_flush = 0.0
+        # Whether values were recorded since the last snapshot was written
+        self._dirty = False
+        self._flusher: Optional[threading.Thread] = None
+        # Tells this process's snapshot from that of an exited process
+        # whose pid was reused
+        self._token = uuid.uuid4().hex[:8]
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The flusher thread does not survive the fork
+        self._flusher = None
+        self._next_flush = 0.0
+        self._token = uuid.uuid4().hex[:8]
+
+    def register(self, metric: 'Metric') -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def shard(self) -> Dict[Tuple, Any]:
+        """
+        Return the calling thread's shard, creating it on first use.
+        """
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def maybe_flush(self) -> None:
+        """
+        Write this process's snapshot to the shared directory if it is due.
+        Values recorded in between are written by the flusher thread.
+        """
+        self._dirty = True
+        if time.monotonic() < self._next_flush:
+            return
+        metrics_dir = get_metrics_dir()
+        if not metrics_dir:
+            # Single-process mode, nothing to share
+            self._next_flush = math.inf
+            return
+        if self._flusher is None:
+            self._start_flusher()
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_flush = time.monotonic() + FLUSH_INTERVAL
+            self.write_snapshot(metrics_dir)
+        finally:
+            self._flush_lock.release()
+
+    def flush(self) -> None:
+        """
+        Write this process's snapshot now if values changed since the last one.
+        """
+        metrics_dir = get_metrics_dir()
+        if not metrics_dir or not self._dirty:
+            return
+        with self._flush_lock:
+            self._next_flush = time.monotonic() + FLUSH_INTERVAL
+            self.write_snapshot(metrics_dir)
+
+    def _start_flusher(self) -> None:
+        with self._shards_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_periodically, name='flowgpt-metrics-flush',
+                                             daemon=True)
+        self._flusher.start()
+        # Registering again after a fork is harmless, flush() writes once
+        atexit.register(self.flush)
+
+    def _flush_periodically(self) -> None:
+        # So a worker going idle still publishes its last values
+        flusher = self._flusher
+        while self._flusher is flusher:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                # The directory is unavailable; try again next time
+                pass
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Merge all thread shards of this process into a JSON-friendly snapshot.
+        """
+        with self._shards_lock:
+            # dict() copies are atomic under the GIL for tuple/str keys
+            shards = [dict(shard) for shard in self._shards]
+
+        merged: Dict[Tuple, Any] = {}
+        for shard in shards:
+            for key, value in shard.items():
+                metric = self._metrics[key[0]]
+                merged[key] = metric.merge(merged.get(key), value)
+
+        result: Dict[str, Dict[str, Any]] = {}
+        for name, metric in self._metrics.items():
+            if metric.function is not None:
+                continue
+            result[name] = {'type': metric.type, 'samples': []}
+        for (name, labels), value in merged.items():
+            if name in result:
+                result[name]['samples'].append([list(labels), value])
+        return result
+
+    def write_snapshot(self, metrics_dir: str) -> None:
+        """
+        Atomically write this process's snapshot as ``metrics-<pid>-<token>.json``.
+        """
+        os.makedirs(metrics_dir, exist_ok=True)
+        self._dirty = False
+        pid = os.getpid()
+        _write_json(metrics_dir, f'metrics-{pid}-{self._token}.json', {'pid': pid, 'metrics': self.snapshot()})
+
+    def collect(self) -> Dict[str, Dict[Tuple, Any]]:
+        """
+        Collect merged values for every metric, across processes if configured.
+        """
+        metrics_dir = get_metrics_dir()
+        if metrics_dir:
+            self.write_snapshot(metrics_dir)
+            # Archiving and reading under one lock, so a scrape never misses
+            # a snapshot another one is moving into the archive
+            with _locked(metrics_dir):
+                archive_exited(metrics_dir)
+                snapshots = list(_read_snapshots(metrics_dir))
+        else:
+            snapshots = [self.snapshot()]
+
+        values: Dict[str, Dict[Tuple, Any]] = {name: {} for name in self._metrics}
+        for snapshot in snapshots:
+            for name, data in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in data['samples']:
+                    key = tuple(labels)
+                    values[name][key] = metric.merge(values[name].get(key), value)
+
+        for name, metric in self._metrics.items():
+            if metric.function is not None:
+                values[name] = metric.function()
+        return values
+
+    def render_text(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format (0.0.4).
+        """
+        values = self.collect()
+        lines: List[str] = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(values[name].items()):
+                lines.extend(metric.exposition(labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextlib.contextmanager
+def _locked(metrics_dir: str):
+    """
+    Hold an exclusive lock on the metrics directory, across processes.
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    fd = os.open(os.path.join(metrics_dir, LOCK_FILENAME), os.O_RDWR | os.O_CREAT)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
+
+
+def _write_json(metrics_dir: str, filename: str, data: Dict[str, Any]) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=metrics_dir, prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps(data))
+    os.replace(tmp_path, os.path.join(metrics_dir, filename))
+
+
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # File vanished or is being replaced, skip it for this scrape
+        return None
+
+
+def _snapshot_paths(metrics_dir: str) -> Iterable[str]:
+    for filename in os.listdir(metrics_dir):
+        if filename.startswith('metrics-') and filename.endswith('.json'):
+            yield os.path.join(metrics_dir, filename)
+
+
+def _merge_sample(current: Any, value: Any) -> Any:
+    # Counters are numbers, histograms lists of bucket counts, sum and count
+    if current is None:
+        return value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(current, value)]
+    return current + value
+
+
+def archive_exited(metrics_dir: str) -> None:
+    """
+    Fold the counters and histograms of exited processes into the archive
+    snapshot and delete their snapshots. Call with the directory locked.
+    """
+    archive_path = os.path.join(metrics_dir, ARCHIVE_FILENAME)
+    archive = None
+    exited = []
+    for path in _snapshot_paths(metrics_dir):
+        data = _load_json(path)
+        if data is None or _pid_alive(data['pid']):
+            continue
+        if archive is None:
+            archive = (_load_json(archive_path) or {'metrics': {}})['metrics']
+        for name, metric in data['metrics'].items():
+            if metric['type'] == 'gauge':
+                # Gauges describe the state of a process that is gone
+                continue
+            samples = {tuple(labels): value for labels, value in
+                       archive.setdefault(name, {'type': metric['type'], 'samples': []})['samples']}
+            for labels, value in metric['samples']:
+                samples[tuple(labels)] = _merge_sample(samples.get(tuple(labels)), value)
+            archive[name]['samples'] = [[list(labels), value] for labels, value in samples.items()]
+        exited.append(path)
+    if exited:
+        # Written before the snapshots are removed, so nothing is lost if
+        # the scrape is interrupted in between
+        _write_json(metrics_dir, ARCHIVE_FILENAME, {'metrics': archive})
+        for path in exited:
+            os.remove(path)
+
+
+def _read_snapshots(metrics_dir: str) -> Iterable[Dict[str, Any]]:
+    """
+    The snapshots of the live processes, followed by the archive.
+    """
+    for path in _snapshot_paths(metrics_dir):
+        data = _load_json(path)
+        if data is not None:
+            yield data['metrics']
+    archive = _load_json(os.path.join(metrics_dir, ARCHIVE_FILENAME))
+    if archive is not None:
+        yield archive['metrics']
+
+
+def _format_labels(labelnames: Tuple[str, ...], labels: Tuple[str, ...],
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base class for metrics. Values are stored in the registry shards under
+    ``(name, label values)`` keys.
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: Optional[MetricsRegistry] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function: Optional[Callable[[], Dict[Tuple, Any]]] = None
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return (self.name, tuple(str(labels[name]) for name in self.labelnames))
+
+    def merge(self, current: Any, value: Any) -> Any:
+        return value if current is None else current + value
+
+    def exposition(self, labels: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing counter.
+    """
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self.registry.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+
+class Gauge(Metric):
+    """
+    Gauge updated with ``inc``/``dec``, or computed at scrape time via ``set_function``.
+    """
+    type = 'gauge'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self.registry.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Compute the (unlabelled) gauge value in the scraping process.
+        """
+        self.function = lambda: {(): function()}
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets. Each shard entry is a list holding the
+    per-bucket counts followed by the observation sum and count.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 registry: Optional[MetricsRegistry] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        shard = self.registry.shard()
+        key = self._key(labels)
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+        self.registry.maybe_flush()
+
+    def merge(self, current: Any, value: Any) -> Any:
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+    def exposition(self, labels: Tuple[str, ...], value: Any) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            lines.append(f"{self.name}_bucket"
+                         f"{_format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))}"
+                         f" {cumulative}")
+        lines.append(f"{self.name}_bucket"
+                     f"{_format_labels(self.labelnames, labels, ('le', '+Inf'))} {value[-1]}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(value[-2])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {value[-1]}")
+        return lines
+
+
+REGISTRY = MetricsRegistry()
+
+
+# Executor metrics
+EXECUTIONS_STARTED = Counter(
+    'flowgpt_executions_started_total', 'Pipeline executions started.', ['pipeline'])
+EXECUTIONS_COMPLETED = Counter(
+    'flowgpt_executions_completed_total', 'Pipeline executions completed successfully.', ['pipeline'])
+EXECUTIONS_FAILED = Counter(
+    'flowgpt_executions_failed_total', 'Pipeline executions that raised an error.', ['pipeline'])
+EXECUTIONS_IN_FLIGHT = Gauge(
+    'flowgpt_executions_in_flight', 'Pipeline executions currently running.')
+EXECUTION_QUEUE_DEPTH = Gauge(
+    'flowgpt_execution_queue_depth', 'Pipeline executions recorded as not yet complete.')
+NODE_DURATION = Histogram(
+    'flowgpt_node_duration_seconds', 'Time spent executing a node function.', ['node_type'])
+
+# Database metrics, recorded by QueryMetricsMiddleware
+VIEW_REQUESTS = Counter(
+    'flowgpt_view_requests_total', 'Requests handled per view.', ['view'])
+VIEW_DB_QUERIES = Counter(
+    'flowgpt_view_db_queries_total', 'Database queries executed per view.', ['view'])
+VIEW_DB_SECONDS = Counter(
+    'flowgpt_view_db_query_seconds_total', 'Time spent in database queries per view.', ['view'])
+
+# Email outbox metrics, recorded by the email dispatcher
+EMAILS_SENT = Counter(
+    'flowgpt_emails_sent_total', 'Outbox emails delivered.')
+EMAILS_RETRIED = Counter(
+    'flowgpt_emails_retried_total', 'Outbox email deliveries that failed and were rescheduled.')
+EMAILS_FAILED = Counter(
+    'flowgpt_emails_failed_total', 'Outbox emails given up on.')
+EMAIL_BATCH_DURATION = Histogram(
+    'flowgpt_email_batch_duration_seconds', 'Time spent delivering one batch of outbox emails.')
+
+# Webhook metrics, recorded by the webhook dispatcher
+WEBHOOKS_DELIVERED = Counter(
+    'flowgpt_webhooks_delivered_total', 'Webhook deliveries accepted by the receiver.')
+WEBHOOKS_RETRIED = Counter(
+    'flowgpt_webhooks_retried_total', 'Webhook deliveries that failed and were rescheduled.')
+WEBHOOKS_FAILED = Counter(
+    'flowgpt_webhooks_failed_total', 'Webhook deliveries given up on.')
+WEBHOOK_REQUEST_DURATION = Histogram(
+    'flowgpt_webhook_request_duration_seconds', 'Time taken by one webhook request, failed ones included.')
+WEBHOOK_DELIVERY_LATENCY = Histogram(
+    'flowgpt_webhook_delivery_latency_seconds',
+    'Time from an execution finishing to its webhook being delivered.',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 21600.0))
+
+# Compiled pattern cache of the regex node
+REGEX_CACHE_HITS = Counter(
+    'flowgpt_regex_cache_hits_total', 'Regex node patterns found in the compiled pattern cache.')
+REGEX_CACHE_MISSES = Counter(
+    'flowgpt_regex_cache_misses_total', 'Regex node patterns compiled because they were not cached.')
+REGEX_CACHE_EVICTIONS = Counter(
+    'flowgpt_regex_cache_evictions_total', 'Compiled patterns evicted from the full regex cache.')
+REGEX_CACHE_SIZE = Gauge(
+    'flowgpt_regex_cache_size', 'Compiled patterns held in the regex cache of the scraping process.')
+
+# Rendered page cache of the pipeline and execution pages
+PAGE_CACHE_HITS = Counter(
+    'flowgpt_page_cache_hits_total', 'Pages served from the page cache.', ['page'])
+PAGE_CACHE_MISSES = Counter(
+    'flowgpt_page_cache_misses_total', 'Pages rendered because they were not cached.', ['page'])
@@ -0,0 +1,242 @@
+"""
+Middleware for FlowGPT.
+"""
+import gzip
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import profiling
+from .metrics import VIEW_DB_QUERIES, VIEW_DB_SECONDS, VIEW_REQUESTS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Query count and time of the request being handled. Context variables
+# follow async views into the threads their queries run on.
+_request_stats: ContextVar[Optional[List]] = ContextVar('flowgpt_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+def install_query_recorder(db_connection) -> None:
+    if record_query not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+class QueryMetricsMiddleware:
+    """
+    Counts database queries and query time per view and records them
+    in the Prometheus metrics. Works for both sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Connections opened before this module was imported have no recorder yet
+        install_query_recorder(connection)
+        token = _request_stats.set([0, 0.0])
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = _request_stats.get()
+            _request_stats.reset(token)
+        self.record(request, stats)
+        return response
+
+    async def __acall__(self, request):
+        token = _request_stats.set([0, 0.0])
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats = _request_stats.get()
+            _request_stats.reset(token)
+        self.record(request, stats)
+        return response
+
+    def record(self, request, stats) -> None:
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unresolved'
+        VIEW_REQUESTS.inc(view=view)
+        if stats[0]:
+            VIEW_DB_QUERIES.inc(stats[0], view=view)
+            VIEW_DB_SECONDS.inc(stats[1], view=view)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests sent with the ``X-FlowGPT-Profile: 1`` header
+    when ``FLOWGPT_PROFILING`` is enabled: query count, SQL time, slowest,
+    duplicate and repeated queries and CPU time go into a ``Server-Timing``
+    header and the report shown in the admin. When the setting is off, the
+    middleware removes itself and its query wrapper is never installed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'FLOWGPT_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        profiling.REPORT.resize(getattr(settings, 'FLOWGPT_PROFILE_HISTORY', profiling.DEFAULT_HISTORY))
+        # Connections opened from now on get the query wrapper from the
+        # signal; those of this thread are already open
+        connection_created.connect(profiling.connection_opened)
+        for db_connection in connections.all(initialized_only=True):
+            profiling.install_profiler(db_connection)
+
+    @staticmethod
+    def wants_profile(request) -> bool:
+        return request.headers.get(profiling.PROFILE_HEADER, '') not in ('', '0')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.wants_profile(request):
+            return self.get_response(request)
+        profiling.install_profiler(connection)
+        profile = profiling.RequestProfile()
+        token = profiling._request_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling._request_profile.reset(token)
+        return self.record(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.wants_profile(request):
+            return await self.get_response(request)
+        profile = profiling.RequestProfile()
+        token = profiling._request_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling._request_profile.reset(token)
+        return self.record(request, response, profile)
+
+    def record(self, request, response, profile):
+        profile.finish()
+        response.headers['Server-Timing'] = profile.server_timing()
+        patch_vary_headers(response, (profiling.PROFILE_HEADER,))
+        profiling.REPORT.add(profile.entry(request, response))
+        return response
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """
+    Parse an Accept-Encoding header into the quality of every coding.
+    """
+    qualities = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities
+
+
+# Fast levels: results run to tens of megabytes, and gzip's default level 6
+# takes about five times as long as level 1 for a quarter smaller output
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 1
+
+
+def _zstd(content: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+
+
+def _gzip(content: bytes) -> bytes:
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# Supported content codings, preferred first when the client likes them equally
+ENCODERS = {'zstd': _zstd, 'gzip': _gzip} if zstandard is not None else {'gzip': _gzip}
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses JSON responses with zstd or gzip, whichever the client
+    prefers in Accept-Encoding. HTML pages are left alone: they can carry
+    CSRF tokens, which compression would expose to BREACH-style attacks.
+    Like Django's GZipMiddleware, a strong ETag is made weak, so
+    conditional requests still match it.
+    """
+    min_length = 200
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < self.min_length:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = ENCODERS[encoding](response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def choose_encoding(header: str) -> Optional[str]:
+        qualities = accepted_encodings(header)
+        wildcard = qualities.get('*', 0.0)
+        best, best_quality = None, 0.0
+        for encoding in ENCODERS:
+            quality = qualities.get(encoding, wildcard)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
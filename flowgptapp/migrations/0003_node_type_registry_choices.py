@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:06
+
+import flowgptapp.graph.registry
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowgptapp', '0002_contact'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='node',
+            name='node_type',
+            field=models.CharField(choices=flowgptapp.graph.registry.node_type_choices, max_length=50),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowgptapp', '0004_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pipelineexecution',
+            index=models.Index(fields=['started_at', 'id'], name='execution_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pipelineexecution',
+            index=models.Index(fields=['pipeline', 'started_at', 'id'], name='execution_pipeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pipelineexecution',
+            index=models.Index(fields=['is_complete', 'started_at', 'id'], name='execution_status_idx'),
+        ),
+    ]
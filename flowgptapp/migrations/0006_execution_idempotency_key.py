@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flowgptapp', '0005_execution_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelineexecution',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='pipelineexecution',
+            index=models.Index(condition=models.Q(('idempotency_key__isnull', False)), fields=['started_at'], name='execution_idempotency_idx'),
+        ),
+    ]
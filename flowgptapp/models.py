@@ -1,24 +1,48 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.db.models import Q
+from .graph.registry import get_node_type, node_type_choices
+from .graph.subpipelines import SUBPIPELINE, child_pipeline_id, creates_cycle
 
 class Node(models.Model):
     """
     Represents a node in a LangGraph pipeline.
     Each node represents a specific operation/function in the workflow.
     """
-    TYPE_CHOICES = [
-        ('clean_text', 'Clean Text'),
-        ('uppercase', 'Convert to Uppercase'),
-        ('summary', 'Basic Summary'),
-        ('translate', 'Translate'),
-        ('email', 'Send Email'),
-    ]
-
     name = models.CharField(max_length=100)
-    node_type = models.CharField(max_length=50, choices=TYPE_CHOICES)
+    # Choices come from the node type registry, including plugin node types
+    node_type = models.CharField(max_length=50, choices=node_type_choices)
     description = models.TextField(blank=True, null=True)
     config = models.JSONField(default=dict, blank=True, null=True)
     
+    def clean(self):
+        node_type = get_node_type(self.node_type)
+        if node_type is not None:
+            try:
+                node_type.validate(self.config)
+            except ValueError as e:
+                raise ValidationError({'config': str(e)})
+        self.check_includes()
+
+    def check_includes(self):
+        """
+        Reject a sub-pipeline config that would make a pipeline using this
+        node include itself. Also run on every save.
+        """
+        if self.node_type != SUBPIPELINE or not self.pk:
+            return
+        try:
+            child_id = child_pipeline_id(self.config)
+        except ValueError:
+            return
+        parents = Edge.objects.filter(Q(source=self) | Q(target=self)).values_list('pipeline_id', flat=True)
+        if creates_cycle(child_id, parents):
+            raise ValidationError({'config': "The pipeline would include itself"})
+    
     def __str__(self):
         return f"{self.name} ({self.get_node_type_display()})"
 
@@ -29,6 +53,10 @@ class Pipeline(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    webhook_url = models.URLField(max_length=500, blank=True,
+                                  help_text="Optional URL notified with the result of every finished execution")
+    webhook_secret = models.CharField(max_length=128, blank=True,
+                                      help_text="Key signing the webhook deliveries; defaults to FLOWGPT_WEBHOOK_SECRET")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -50,6 +78,26 @@ class Edge(models.Model):
         unique_together = [['pipeline', 'source', 'target']]
         ordering = ['pipeline', 'order']
 
+    def clean(self):
+        self.check_includes()
+
+    def check_includes(self):
+        """
+        Reject an edge whose sub-pipeline nodes would make its pipeline
+        include itself. Also run on every save.
+        """
+        if not self.pipeline_id:
+            return
+        for node in (self.source if self.source_id else None, self.target if self.target_id else None):
+            if node is None or node.node_type != SUBPIPELINE:
+                continue
+            try:
+                child_id = child_pipeline_id(node.config)
+            except ValueError:
+                continue
+            if creates_cycle(child_id, [self.pipeline_id]):
+                raise ValidationError(f"{node.name} would make {self.pipeline.name} include itself")
+
     def __str__(self):
         return f"{self.pipeline.name}: {self.source.name} → {self.target.name}"
 
@@ -64,6 +112,20 @@ class PipelineExecution(models.Model):
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     current_node = models.ForeignKey(Node, on_delete=models.SET_NULL, null=True, blank=True, related_name='executions')
+    # Idempotency-Key of the submission, cleared once the retention window passes
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Keyset pagination of the execution history, unfiltered and
+            # filtered by pipeline or status
+            models.Index(fields=['started_at', 'id'], name='execution_history_idx'),
+            models.Index(fields=['pipeline', 'started_at', 'id'], name='execution_pipeline_idx'),
+            models.Index(fields=['is_complete', 'started_at', 'id'], name='execution_status_idx'),
+            # Pruning finds expired keys without scanning every execution
+            models.Index(fields=['started_at'], condition=models.Q(idempotency_key__isnull=False),
+                         name='execution_idempotency_idx'),
+        ]
     
     def __str__(self):
         return f"Execution of {self.pipeline.name} ({self.started_at.strftime('%Y-%m-%d %H:%M')})"
@@ -102,3 +164,89 @@ class Contact(models.Model):
     
     def __str__(self):
         return f"Message from {self.name} ({self.created_at.strftime('%Y-%m-%d')})"
+
+class OutboundEmail(models.Model):
+    """
+    Durable outbox of emails queued by email nodes and delivered in the
+    background by the email dispatcher.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    message_id = models.CharField(max_length=255, unique=True)
+    execution = models.ForeignKey(PipelineExecution, on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='emails')
+    from_email = models.CharField(max_length=254, blank=True)
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, null=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            # The dispatcher polls for due pending messages
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
+
+
+class WebhookDelivery(models.Model):
+    """
+    Durable outbox of execution completion notifications, posted to the
+    pipeline's webhook URL in the background by the webhook dispatcher.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_DELIVERED, 'Delivered'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    event_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    pipeline = models.ForeignKey(Pipeline, on_delete=models.CASCADE, related_name='webhook_deliveries')
+    execution = models.ForeignKey(PipelineExecution, on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='webhook_deliveries')
+    url = models.URLField(max_length=500)
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, null=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        verbose_name_plural = 'webhook deliveries'
+        indexes = [
+            # The dispatcher polls for due pending deliveries
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Execution {self.execution_id} to {self.url} ({self.status})"
@@ -0,0 +1,71 @@
+"""
+In-process execution change notifications.
+
+The executor calls ``notify`` whenever it records progress for an execution,
+from whichever thread it runs on. Long-polling status requests wait on an
+asyncio event that ``notify`` sets through the waiting request's event loop,
+so a held request costs no thread and the database is only queried again
+when something changed. Notifications do not cross processes: a request
+served by another worker than the one running the execution simply waits
+until its timeout and then reports the current state.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Set, Tuple
+
+
+class ExecutionNotifier:
+    """
+    Wakes the requests waiting for changes to an execution.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, execution_id: int) -> asyncio.Event:
+        """
+        Return an event set by the next notification for the execution.
+        Must be called from the waiting coroutine's event loop.
+        """
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters[execution_id].add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, execution_id: int, event: asyncio.Event) -> None:
+        with self._lock:
+            waiters = self._waiters.get(execution_id)
+            if waiters is None:
+                return
+            waiters.difference_update({waiter for waiter in waiters if waiter[1] is event})
+            if not waiters:
+                del self._waiters[execution_id]
+
+    def notify(self, execution_ids: Iterable[int]) -> None:
+        """
+        Wake every request waiting for one of the executions. Safe to call
+        from any thread.
+        """
+        with self._lock:
+            if not self._waiters:
+                return
+            woken = [waiter for execution_id in execution_ids for waiter in self._waiters.pop(execution_id, ())]
+        for loop, event in woken:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiting request's loop has already closed
+                pass
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+
+NOTIFIER = ExecutionNotifier()
+
+
+def notify(*execution_ids: int) -> None:
+    NOTIFIER.notify(execution_ids)
@@ -0,0 +1,277 @@
+"""
+Email outbox for FlowGPT.
+
+Email nodes only put a queued message into their state update. The executor
+stores it in the ``OutboundEmail`` table from the thread that records the
+execution steps, and the ``EmailDispatcher`` (run by the ``dispatch_emails``
+management command) delivers due messages in batches. It keeps a small pool
+of persistent SMTP connections open between batches and retries transient
+failures with exponential backoff.
+"""
+import datetime
+import random
+import smtplib
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import make_msgid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import EMAIL_BATCH_DURATION, EMAILS_FAILED, EMAILS_RETRIED, EMAILS_SENT
+from .models import OutboundEmail
+
+
+QUEUED = 'queued'
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 30.0
+DEFAULT_BACKOFF_MAX = 3600.0
+
+# Messages claimed longer ago than this are assumed to belong to a
+# dispatcher that died and are claimed again
+DEFAULT_CLAIM_TIMEOUT = 300.0
+
+
+def new_message_id() -> str:
+    # An explicit domain avoids a DNS lookup of the local host name per message
+    return make_msgid(domain=getattr(settings, 'FLOWGPT_EMAIL_DOMAIN', 'flowgpt.local'))
+
+
+def queued_emails(execution_id: int, update: Dict[str, Any], seen: Set[str]) -> List[OutboundEmail]:
+    """
+    Outbox rows for a queued email in a node's state update that has not
+    been stored yet. ``seen`` collects the message ids already handled.
+    """
+    result = update.get("email_result") if update else None
+    if not result or result.get("status") != QUEUED or result.get("message_id") in seen:
+        return []
+    seen.add(result["message_id"])
+    return [OutboundEmail(
+        message_id=result["message_id"],
+        execution_id=execution_id,
+        from_email=result.get("from_email") or '',
+        recipient=result["recipient"],
+        subject=result["subject"],
+        body=result["body"],
+    )]
+
+
+def enqueue(emails: Iterable[OutboundEmail]) -> None:
+    """
+    Store queued emails; messages that are already in the outbox are skipped.
+    """
+    emails = list(emails)
+    if emails:
+        OutboundEmail.objects.bulk_create(emails, ignore_conflicts=True)
+
+
+def backoff_delay(attempts: int, base: float = DEFAULT_BACKOFF_BASE, cap: float = DEFAULT_BACKOFF_MAX,
+                  jitter: float = 0.1) -> float:
+    """
+    Seconds to wait before retrying after ``attempts`` failed deliveries:
+    ``base * 2 ** (attempts - 1)`` capped at ``cap``, spread by ``jitter``.
+    """
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * (1 + random.uniform(-jitter, jitter))
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Whether retrying a failed delivery cannot help, e.g. a refused recipient
+    or a message that cannot be built, such as a subject with a newline.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    # Other SMTP and network errors are worth retrying; anything else was
+    # raised building the message and would be raised again
+    return not isinstance(error, (smtplib.SMTPException, OSError))
+
+
+class DispatchStats:
+    """Counters for the deliveries of one or more batches."""
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.seconds if self.seconds else 0.0
+
+    def add(self, other: 'DispatchStats') -> None:
+        self.sent += other.sent
+        self.retried += other.retried
+        self.failed += other.failed
+        self.seconds += other.seconds
+
+
+class EmailDispatcher:
+    """
+    Delivers due outbox messages over a pool of persistent email connections.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, connections: int = 1,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 backend: Optional[str] = None):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.claim_timeout = claim_timeout
+        self.backend = backend
+        self.pool = [None] * max(connections, 1)
+        self.executor = ThreadPoolExecutor(len(self.pool)) if len(self.pool) > 1 else None
+
+    def claim(self) -> List[OutboundEmail]:
+        """
+        Claim a batch of due messages, so concurrent dispatchers never send
+        the same message twice.
+        """
+        now = timezone.now()
+        due = (
+            Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            | Q(status=OutboundEmail.STATUS_SENDING,
+                claimed_at__lt=now - datetime.timedelta(seconds=self.claim_timeout))
+        )
+        ids = list(OutboundEmail.objects.filter(due).values_list('id', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        OutboundEmail.objects.filter(due, id__in=ids).update(
+            status=OutboundEmail.STATUS_SENDING, claim_token=token, claimed_at=now
+        )
+        return list(OutboundEmail.objects.filter(claim_token=token))
+
+    def connection(self, slot: int):
+        connection = self.pool[slot]
+        if connection is None:
+            connection = get_connection(self.backend, fail_silently=False)
+            connection.open()
+            self.pool[slot] = connection
+        return connection
+
+    def reset(self, slot: int) -> None:
+        connection, self.pool[slot] = self.pool[slot], None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def send_chunk(self, slot: int, emails: List[OutboundEmail]) -> List[Tuple[OutboundEmail, Optional[Exception]]]:
+        """
+        Send messages one by one over the connection in ``slot``, reconnecting
+        after a connection failure. Returns each message with its error.
+        """
+        results = []
+        for email in emails:
+            try:
+                message = EmailMessage(
+                    email.subject, email.body, email.from_email or settings.DEFAULT_FROM_EMAIL,
+                    [email.recipient], headers={'Message-ID': email.message_id},
+                )
+                self.connection(slot).send_messages([message])
+                results.append((email, None))
+            except Exception as e:
+                # Reconnect after a connection failure; a message the server
+                # rejected, or that could not be built, leaves it usable
+                if isinstance(e, (smtplib.SMTPException, OSError)) and not isinstance(
+                        e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    self.reset(slot)
+                # Recorded against the message instead of failing the whole batch
+                results.append((email, e))
+        return results
+
+    def send(self, emails: List[OutboundEmail]) -> List[Tuple[OutboundEmail, Optional[Exception]]]:
+        if self.executor is None:
+            return self.send_chunk(0, emails)
+        slots = len(self.pool)
+        chunks = [emails[i::slots] for i in range(slots)]
+        results = []
+        for chunk_results in self.executor.map(self.send_chunk, range(slots), chunks):
+            results.extend(chunk_results)
+        return results
+
+    def record(self, results: List[Tuple[OutboundEmail, Optional[Exception]]]) -> DispatchStats:
+        """
+        Store the outcome of a batch: sent messages in one query, retries and
+        failures with one bulk update.
+        """
+        stats = DispatchStats()
+        now = timezone.now()
+        sent_ids = []
+        changed = []
+        for email, error in results:
+            email.attempts += 1
+            email.claim_token = None
+            if error is None:
+                sent_ids.append(email.id)
+                continue
+            email.last_error = f"{type(error).__name__}: {error}"
+            if is_permanent(error) or email.attempts >= self.max_attempts:
+                email.status = OutboundEmail.STATUS_FAILED
+                stats.failed += 1
+            else:
+                email.status = OutboundEmail.STATUS_PENDING
+                email.next_attempt_at = now + datetime.timedelta(
+                    seconds=backoff_delay(email.attempts, self.backoff_base, self.backoff_max))
+                stats.retried += 1
+            changed.append(email)
+
+        if sent_ids:
+            OutboundEmail.objects.filter(id__in=sent_ids).update(
+                status=OutboundEmail.STATUS_SENT, sent_at=now, claim_token=None, last_error='',
+                attempts=F('attempts') + 1,
+            )
+        if changed:
+            OutboundEmail.objects.bulk_update(
+                changed, ['status', 'attempts', 'next_attempt_at', 'claim_token', 'last_error']
+            )
+        stats.sent = len(sent_ids)
+        EMAILS_SENT.inc(stats.sent)
+        EMAILS_RETRIED.inc(stats.retried)
+        EMAILS_FAILED.inc(stats.failed)
+        return stats
+
+    def dispatch_once(self) -> DispatchStats:
+        """
+        Claim and deliver one batch of due messages.
+        """
+        emails = self.claim()
+        if not emails:
+            return DispatchStats()
+        start = time.perf_counter()
+        results = self.send(emails)
+        elapsed = time.perf_counter() - start
+        EMAIL_BATCH_DURATION.observe(elapsed)
+        stats = self.record(results)
+        stats.seconds = elapsed
+        return stats
+
+    def drain(self) -> DispatchStats:
+        """
+        Deliver batches until no message is due.
+        """
+        total = DispatchStats()
+        while True:
+            stats = self.dispatch_once()
+            if not (stats.sent or stats.retried or stats.failed):
+                return total
+            total.add(stats)
+
+    def close(self) -> None:
+        for slot in range(len(self.pool)):
+            self.reset(slot)
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,140 @@
+"""
+Cache of rendered pages.
+
+The home page, pipeline pages and the pages of completed executions are
+stored rendered in the ``FLOWGPT_PAGE_CACHE`` cache together with a strong
+ETag of their content, so a repeated request costs no query and no template
+rendering, and a revalidation with ``If-None-Match`` gets a 304.
+
+Pages are stored under a version token of the pipelines they show. The
+signal handlers in ``signals.py`` replace the token when a pipeline, one of
+its edges or one of its nodes changes, so pages rendered before the change
+are never served again, even if they were stored after it. Completed
+executions never change and are kept until their pipeline changes or they
+are deleted; pages of running executions are not cached.
+
+The cache must be shared by every process serving requests for the
+invalidation to reach them: the local-memory backend suits a single
+process, the file-based backend (``FLOWGPT_CACHE_DIR``) several.
+"""
+import hashlib
+import uuid
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .metrics import PAGE_CACHE_HITS, PAGE_CACHE_MISSES
+
+
+KEY_PREFIX = 'flowgpt:page:'
+
+# Version scope of the home page, which lists every pipeline
+ALL_PIPELINES = 'pipelines'
+
+
+def get_cache():
+    return caches[getattr(settings, 'FLOWGPT_PAGE_CACHE', 'default')]
+
+
+def pipeline_scope(pipeline_id: int) -> str:
+    return f'pipeline:{pipeline_id}'
+
+
+def scope_version(scope: str) -> str:
+    """
+    The current version token of a scope, created on first use.
+    """
+    cache = get_cache()
+    key = f'{KEY_PREFIX}version:{scope}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_pipelines(pipeline_ids: Iterable[int]) -> None:
+    """
+    Stop serving the cached pages showing any of the pipelines.
+    """
+    versions = {f'{KEY_PREFIX}version:{pipeline_scope(pipeline_id)}': uuid.uuid4().hex
+                for pipeline_id in pipeline_ids}
+    versions[f'{KEY_PREFIX}version:{ALL_PIPELINES}'] = uuid.uuid4().hex
+    get_cache().set_many(versions, None)
+
+
+def execution_key(execution_id: int) -> str:
+    return f'{KEY_PREFIX}execution:{execution_id}'
+
+
+def invalidate_execution(execution_id: int) -> None:
+    get_cache().delete(execution_key(execution_id))
+
+
+def make_entry(response: HttpResponse, **extra) -> Dict[str, Any]:
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+        **extra,
+    }
+
+
+def entry_response(request, entry: Dict[str, Any]) -> HttpResponse:
+    """
+    Respond with a cached page, or with a 304 if the client already has it.
+    """
+    response = get_conditional_response(request, etag=entry['etag'])
+    if response is None:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    # Clients may keep the page but must revalidate it
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def cached_page(request, page: str, scope: str, render: Callable[[], HttpResponse],
+                timeout: Optional[float] = None) -> HttpResponse:
+    """
+    Serve ``page`` from the cache, rendering and storing it on a miss.
+    ``render`` is only called on a miss; errors it raises, such as Http404,
+    are not cached.
+    """
+    cache = get_cache()
+    key = f'{KEY_PREFIX}{page}:{scope_version(scope)}'
+    entry = cache.get(key)
+    if entry is None:
+        PAGE_CACHE_MISSES.inc(page=page.split(':')[0])
+        entry = make_entry(render())
+        if timeout is None:
+            timeout = getattr(settings, 'FLOWGPT_PAGE_CACHE_TIMEOUT', 600)
+        cache.set(key, entry, timeout)
+    else:
+        PAGE_CACHE_HITS.inc(page=page.split(':')[0])
+    return entry_response(request, entry)
+
+
+def cached_execution_page(request, execution_id: int, render: Callable) -> HttpResponse:
+    """
+    Serve the page of an execution, caching it once the execution is
+    complete. ``render`` returns the response and the execution it shows.
+    """
+    cache = get_cache()
+    key = execution_key(execution_id)
+    entry = cache.get(key)
+    if entry is not None and entry['version'] == scope_version(pipeline_scope(entry['pipeline_id'])):
+        PAGE_CACHE_HITS.inc(page='execution')
+        return entry_response(request, entry)
+
+    response, execution = render()
+    if not execution.is_complete:
+        return response
+    PAGE_CACHE_MISSES.inc(page='execution')
+    entry = make_entry(response, pipeline_id=execution.pipeline_id,
+                       version=scope_version(pipeline_scope(execution.pipeline_id)))
+    cache.set(key, entry, None)
+    return entry_response(request, entry)
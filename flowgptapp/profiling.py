@@ -0,0 +1,198 @@
+"""
+Opt-in request profiling for FlowGPT.
+
+With ``FLOWGPT_PROFILING`` enabled, a request sent with the
+``X-FlowGPT-Profile: 1`` header is profiled by ``ProfilingMiddleware``: every
+query it runs is timed, and the response gets a ``Server-Timing`` header
+splitting the request's time into SQL, other work and CPU. The profile is
+also kept in a rolling in-memory report, shown to staff at
+``/admin/profiling/``, with the slowest queries and the statements the
+request ran more than once.
+
+CPU time is that of the thread serving the request. For async views it
+covers the event loop thread only, not work handed to ``sync_to_async``.
+"""
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+
+PROFILE_HEADER = 'X-FlowGPT-Profile'
+
+DEFAULT_HISTORY = 100
+DEFAULT_SLOW_QUERIES = 5
+
+# Longest SQL text kept in the report
+MAX_SQL_LENGTH = 1000
+
+
+_request_profile: ContextVar[Optional['RequestProfile']] = ContextVar('flowgpt_request_profile', default=None)
+
+
+def profile_query(execute, sql, params, many, context):
+    profile = _request_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, params, many, time.perf_counter() - start)
+
+
+def install_profiler(db_connection) -> None:
+    if profile_query not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(profile_query)
+
+
+def connection_opened(sender, connection, **kwargs):
+    install_profiler(connection)
+
+
+def params_key(params: Any) -> Any:
+    try:
+        key = tuple(params) if isinstance(params, list) else params
+        hash(key)
+        return key
+    except TypeError:
+        return repr(params)
+
+
+class RequestProfile:
+    """
+    The queries and timings of one profiled request.
+    """
+
+    def __init__(self):
+        self.queries: List[tuple] = []
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.total = 0.0
+        self.cpu = 0.0
+
+    def add_query(self, sql: str, params: Any, many: bool, seconds: float) -> None:
+        # Batched statements are never counted as duplicates
+        self.queries.append((seconds, sql, None if many else params_key(params), many))
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self.started
+        self.cpu = time.thread_time() - self.cpu_started
+
+    @property
+    def sql_time(self) -> float:
+        return sum(query[0] for query in self.queries)
+
+    def duplicates(self) -> List[Dict[str, Any]]:
+        """
+        Queries run more than once with the same parameters.
+        """
+        counts = Counter((sql, key) for _, sql, key, many in self.queries if not many)
+        return [{'sql': sql[:MAX_SQL_LENGTH], 'count': count}
+                for (sql, _), count in counts.most_common() if count > 1]
+
+    def repeated(self) -> List[Dict[str, Any]]:
+        """
+        Statements run more than once with different parameters, typically
+        a query per row of an earlier result.
+        """
+        keys: Dict[str, set] = {}
+        for _, sql, key, many in self.queries:
+            if not many:
+                keys.setdefault(sql, set()).add(key)
+        counts = Counter(sql for _, sql, _, many in self.queries if not many and len(keys[sql]) > 1)
+        return [{'sql': sql[:MAX_SQL_LENGTH], 'count': count} for sql, count in counts.most_common()]
+
+    def slowest(self, count: int) -> List[Dict[str, Any]]:
+        slowest = sorted(self.queries, key=lambda query: query[0], reverse=True)[:count]
+        return [{'sql': sql[:MAX_SQL_LENGTH], 'ms': seconds * 1000} for seconds, sql, _, _ in slowest]
+
+    def server_timing(self) -> str:
+        sql_time = self.sql_time
+        duplicates = sum(entry['count'] - 1 for entry in self.duplicates())
+        return ', '.join([
+            f'db;dur={sql_time * 1000:.2f};desc="{len(self.queries)} queries, {duplicates} duplicate"',
+            f'app;dur={max(self.total - sql_time, 0.0) * 1000:.2f}',
+            f'cpu;dur={self.cpu * 1000:.2f}',
+            f'total;dur={self.total * 1000:.2f}',
+        ])
+
+    def entry(self, request, response) -> Dict[str, Any]:
+        """
+        The report entry of the request.
+        """
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'at': timezone.now(),
+            'method': request.method,
+            'path': request.get_full_path()[:500],
+            'view': (match.view_name or match._func_path) if match else 'unresolved',
+            'status': response.status_code,
+            'total_ms': self.total * 1000,
+            'cpu_ms': self.cpu * 1000,
+            'sql_ms': self.sql_time * 1000,
+            'queries': len(self.queries),
+            'duplicates': self.duplicates(),
+            'repeated': self.repeated(),
+            'slowest': self.slowest(getattr(settings, 'FLOWGPT_PROFILE_SLOW_QUERIES', DEFAULT_SLOW_QUERIES)),
+        }
+
+
+class ProfileReport:
+    """
+    The latest profiled requests of this process, oldest dropped first.
+    """
+
+    def __init__(self, size: int = DEFAULT_HISTORY):
+        self._entries: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def resize(self, size: int) -> None:
+        with self._lock:
+            if size != self._entries.maxlen:
+                self._entries = deque(self._entries, maxlen=size)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        The recorded requests, newest first.
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def by_view(self) -> List[Dict[str, Any]]:
+        """
+        Averages per view, the views taking the most time in total first.
+        """
+        views: Dict[str, Dict[str, Any]] = {}
+        for entry in self.entries():
+            view = views.setdefault(entry['view'], {
+                'view': entry['view'], 'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'sql_ms': 0.0, 'cpu_ms': 0.0, 'queries': 0, 'duplicates': 0,
+            })
+            view['requests'] += 1
+            view['total_ms'] += entry['total_ms']
+            view['max_ms'] = max(view['max_ms'], entry['total_ms'])
+            view['sql_ms'] += entry['sql_ms']
+            view['cpu_ms'] += entry['cpu_ms']
+            view['queries'] += entry['queries']
+            view['duplicates'] += sum(duplicate['count'] - 1 for duplicate in entry['duplicates'])
+        summary = sorted(views.values(), key=lambda view: view['total_ms'], reverse=True)
+        for view in summary:
+            for key in ('total_ms', 'sql_ms', 'cpu_ms', 'queries', 'duplicates'):
+                view[f'avg_{key}'] = view[key] / view['requests']
+        return summary
+
+
+REPORT = ProfileReport()
@@ -0,0 +1,32 @@
+"""
+JSON responses serialised with orjson.
+
+``OrjsonResponse`` replaces ``JsonResponse`` in the API views: orjson
+serialises multi-megabyte results several times faster than the standard
+library and writes bytes directly. Values wrapped in ``raw_json`` are JSON
+already, such as the step outputs the executor stores, and are embedded in
+the response without being parsed and serialised again.
+"""
+from typing import Any
+
+import orjson
+from django.http import HttpResponse
+
+from .graph.state import dumpb
+
+
+def raw_json(text: str) -> orjson.Fragment:
+    """
+    Embed a string that already holds valid JSON as is.
+    """
+    return orjson.Fragment(text)
+
+
+class OrjsonResponse(HttpResponse):
+    """
+    An HTTP response with a JSON body serialised by orjson.
+    """
+
+    def __init__(self, data: Any, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumpb(data), **kwargs)
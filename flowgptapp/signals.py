@@ -0,0 +1,62 @@
+"""
+Signal handlers keeping compiled pipeline graphs and cached pages up to date.
+
+Compiled graphs are cached until the ``updated_at`` of their pipeline, or of
+a pipeline they include, changes. Edges and nodes are stored separately from
+their pipelines, so saving or deleting them touches the pipelines using them.
+Touching a pipeline also invalidates its cached pages.
+Bulk operations send no signals and need ``touch_pipelines`` called explicitly.
+
+Saving an edge or node also runs its sub-pipeline cycle check, so code
+creating them without ``full_clean`` cannot make a pipeline include itself.
+"""
+from typing import Iterable
+
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Edge, Node, Pipeline, PipelineExecution
+from .page_cache import invalidate_execution, invalidate_pipelines
+
+
+def touch_pipelines(pipeline_ids: Iterable[int]) -> None:
+    """
+    Mark pipelines as changed so their compiled graphs and pages are rebuilt.
+    """
+    pipeline_ids = list(pipeline_ids)
+    Pipeline.objects.filter(id__in=pipeline_ids).update(updated_at=timezone.now())
+    invalidate_pipelines(pipeline_ids)
+
+
+@receiver(pre_save, sender=Edge)
+@receiver(pre_save, sender=Node)
+def check_includes(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.check_includes()
+
+
+@receiver([post_save, post_delete], sender=Edge)
+def edge_changed(sender, instance, **kwargs):
+    touch_pipelines([instance.pipeline_id])
+
+
+@receiver(post_save, sender=Node)
+def node_changed(sender, instance, created, **kwargs):
+    if created:
+        # A new node is not part of any pipeline yet
+        return
+    touch_pipelines(
+        Edge.objects.filter(Q(source=instance) | Q(target=instance)).values_list('pipeline_id', flat=True).distinct()
+    )
+
+
+@receiver([post_save, post_delete], sender=Pipeline)
+def pipeline_changed(sender, instance, **kwargs):
+    invalidate_pipelines([instance.id])
+
+
+@receiver(post_delete, sender=PipelineExecution)
+def execution_deleted(sender, instance, **kwargs):
+    invalidate_execution(instance.id)
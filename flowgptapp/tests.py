@@ -1,3 +1,1589 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import datetime
+import gzip
+import http.server
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed, ValidationError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .benchmarks import NODE_CONFIG_VARIANTS
+from .graph.batch_functions import get_batch_function
+from .graph import mapreduce, patterns
+from .graph.node_functions import basic_summary, clean_text, map_chunks, reduce_chunks, regex, translate
+from .graph.pipeline_executor import (
+    clear_compiled_graphs, create_pipeline_graph, execute_pipeline, execute_pipeline_batch, merge_metadata,
+)
+from .graph.registry import NODE_FUNCTIONS, REGISTRY, get_node_type
+from .graph.state import ExecutionState, Metadata, dumps
+from .graph.summarizer import CHUNK_SENTENCES, iter_sentences
+from .graph.text_cleaner import get_cleaner
+from .graph import translation
+from .graph.translation import find_dictionary, get_translator, reload_dictionaries
+from .models import (
+    Contact, Edge, ExecutionStep, Node, OutboundEmail, Pipeline, PipelineExecution, WebhookDelivery,
+)
+from .notifier import NOTIFIER, notify
+from . import idempotency, logs, metrics, middleware, page_cache, profiling, webhooks
+from .outbox import EmailDispatcher
+from .webhooks import WebhookDispatcher
+
+try:
+    import aiosmtpd
+    from aiosmtpd.controller import Controller
+except ImportError:
+    aiosmtpd = None
+
+
+class QueryBudgetMixin:
+    """
+    Assertions that fail with the captured SQL when a query budget is exceeded.
+    """
+
+    @contextlib.contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        if len(captured) > budget:
+            queries = '\n'.join(
+                f"{i}. {query['sql']}" for i, query in enumerate(captured.captured_queries, start=1)
+            )
+            self.fail(f"{len(captured)} queries executed, budget is {budget}:\n{queries}")
+
+
+class FlowGPTFixtureMixin:
+    """
+    Realistic data volumes: every view and admin page below must stay within
+    its budget regardless of how many rows these fixtures create.
+    """
+    NODE_TYPES = ['clean_text', 'uppercase', 'summary', 'translate', 'regex', 'map', 'reduce', 'subpipeline', 'email']
+    PIPELINE_COUNT = 10
+    PIPELINE_LENGTH = 4
+    EXECUTIONS_PER_PIPELINE = 20
+
+    def setUp(self):
+        super().setUp()
+        # Start every test with cold compiled graph and page caches
+        clear_compiled_graphs()
+        page_cache.get_cache().clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+        cls.nodes = Node.objects.bulk_create([
+            Node(name=f"{node_type} {i}", node_type=node_type, config={})
+            for i in range(4) for node_type in cls.NODE_TYPES
+        ])
+        chain_types = ['clean_text', 'summary', 'translate', 'uppercase']
+        nodes_by_type = {}
+        for node in cls.nodes:
+            nodes_by_type.setdefault(node.node_type, []).append(node)
+
+        cls.pipelines = Pipeline.objects.bulk_create([
+            Pipeline(name=f"Pipeline {i}", description="Fixture pipeline", is_active=True)
+            for i in range(cls.PIPELINE_COUNT)
+        ])
+        edges = []
+        for i, pipeline in enumerate(cls.pipelines):
+            chain = [nodes_by_type[t][i % 4] for t in chain_types[:cls.PIPELINE_LENGTH]]
+            edges.extend(
+                Edge(pipeline=pipeline, source=source, target=target, order=order)
+                for order, (source, target) in enumerate(zip(chain, chain[1:]))
+            )
+        Edge.objects.bulk_create(edges)
+
+        now = timezone.now()
+        executions = PipelineExecution.objects.bulk_create([
+            PipelineExecution(
+                pipeline=pipeline,
+                input_data="Hello world. Thank you.",
+                output_data=json.dumps({"text": "Hello world. Thank you.", "metadata": {}}),
+                is_complete=True,
+                completed_at=now,
+                current_node=cls.nodes[0],
+            )
+            for pipeline in cls.pipelines for _ in range(cls.EXECUTIONS_PER_PIPELINE)
+        ])
+        ExecutionStep.objects.bulk_create([
+            ExecutionStep(
+                execution=execution,
+                node=cls.nodes[n],
+                input_data=json.dumps({"text": "Hello world."}),
+                output_data=json.dumps({"text": "Hello world."}),
+                is_complete=True,
+                completed_at=now,
+            )
+            for execution in executions for n in range(cls.PIPELINE_LENGTH)
+        ])
+        cls.execution = executions[0]
+
+        Contact.objects.bulk_create([
+            Contact(name=f"Contact {i}", email=f"contact{i}@example.com", message="Hello")
+            for i in range(50)
+        ])
+
+
+class ViewQueryBudgetTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def test_home(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_pipeline_detail(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('pipeline_detail', args=[self.pipelines[0].id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_execution_history(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('execution_history'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_execution_detail(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('execution_detail', args=[self.execution.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_execution_status(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('execution_status', args=[self.execution.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['steps']), self.PIPELINE_LENGTH)
+
+    def test_contact(self):
+        with self.assertMaxQueries(0):
+            response = self.client.get(reverse('contact'))
+        self.assertEqual(response.status_code, 200)
+        with self.assertMaxQueries(1):
+            response = self.client.post(reverse('contact'), {
+                'name': 'Jane', 'email': 'jane@example.com', 'message': 'Hi'
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_execute_pipeline_view(self):
+        budget = 4 + 2 * self.PIPELINE_LENGTH
+        with self.assertMaxQueries(budget):
+            response = self.client.post(reverse('execute_pipeline'), {
+                'pipeline_id': self.pipelines[0].id, 'input_text': 'Hello world. Thank you.'
+            })
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+
+
+class AdminQueryBudgetTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def assertChangelistBudget(self, model, budget):
+        url = reverse(f'admin:flowgptapp_{model}_changelist')
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_node_changelist(self):
+        self.assertChangelistBudget('node', 6)
+
+    def test_pipeline_changelist(self):
+        self.assertChangelistBudget('pipeline', 5)
+
+    def test_edge_changelist(self):
+        self.assertChangelistBudget('edge', 8)
+
+    def test_execution_changelist(self):
+        self.assertChangelistBudget('pipelineexecution', 6)
+
+    def test_execution_step_changelist(self):
+        self.assertChangelistBudget('executionstep', 7)
+
+    def test_contact_changelist(self):
+        self.assertChangelistBudget('contact', 5)
+
+    def test_outbound_email_changelist(self):
+        self.assertChangelistBudget('outboundemail', 5)
+
+    def test_webhook_delivery_changelist(self):
+        WebhookDelivery.objects.bulk_create([
+            WebhookDelivery(pipeline=execution.pipeline, execution=execution, url='http://example.com/hook', payload='{}')
+            for execution in PipelineExecution.objects.select_related('pipeline')[:20]
+        ])
+        # Filtering by pipeline lists the pipelines (1)
+        self.assertChangelistBudget('webhookdelivery', 6)
+
+
+class ExecutorQueryBudgetTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def test_create_pipeline_graph(self):
+        with self.assertMaxQueries(2):
+            create_pipeline_graph(self.pipelines[0].id)
+
+    def test_execute_pipeline(self):
+        # Graph (2) + execution insert and completion (2) + step and progress per node (2)
+        with self.assertMaxQueries(4 + 2 * self.PIPELINE_LENGTH):
+            result = execute_pipeline(self.pipelines[0].id, 'Hello world. Thank you.')
+        execution = PipelineExecution.objects.get(id=result['metadata']['execution_id'])
+        self.assertTrue(execution.is_complete)
+        self.assertEqual(execution.steps.count(), self.PIPELINE_LENGTH)
+
+    def test_execute_pipeline_reuses_compiled_graph(self):
+        execute_pipeline(self.pipelines[0].id, 'Warm up.')
+        # Version check (1) instead of loading the graph (2)
+        with self.assertMaxQueries(3 + 2 * self.PIPELINE_LENGTH):
+            execute_pipeline(self.pipelines[0].id, 'Hello world. Thank you.')
+
+
+class ExecutionStatusTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def status(self, **params):
+        return self.client.get(reverse('execution_status', args=[self.execution.id]), params)
+
+    def test_unchanged_poll_is_not_modified(self):
+        response = self.status()
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertMaxQueries(1):
+            cached = self.client.get(reverse('execution_status', args=[self.execution.id]),
+                                     HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        ExecutionStep.objects.create(execution=self.execution, node=self.nodes[0], input_data='{}',
+                                     output_data='{"text": "new"}', is_complete=True)
+        changed = self.client.get(reverse('execution_status', args=[self.execution.id]),
+                                  HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_since_step_returns_only_new_steps(self):
+        data = self.status().json()
+        self.assertEqual(data['step_count'], self.PIPELINE_LENGTH)
+        cursor = data['next_since_step']
+        self.assertEqual(self.status(since_step=cursor).json()['steps'], [])
+        step = ExecutionStep.objects.create(execution=self.execution, node=self.nodes[1], input_data='{}',
+                                            output_data='{}', is_complete=True)
+        data = self.status(since_step=cursor).json()
+        self.assertEqual([s['id'] for s in data['steps']], [step.id])
+        self.assertEqual(data['next_since_step'], step.id)
+
+    def test_fields_projection_and_truncation(self):
+        steps = self.status(fields='id,output.text', max_output=5).json()['steps']
+        self.assertEqual(steps[0], {'id': steps[0]['id'], 'output': {'text': 'Hello...'}})
+        with self.assertMaxQueries(2):
+            steps = self.status(fields='node_name').json()['steps']
+        self.assertEqual(set(steps[0]), {'node_name'})
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.status(fields='secret').status_code, 400)
+        self.assertEqual(self.status(since_step='x').status_code, 400)
+        response = self.client.get(reverse('execution_status', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.status(wait='-1').status_code, 400)
+
+    def test_long_poll_returns_changes_immediately(self):
+        started = time.monotonic()
+        response = self.status(wait=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_long_poll_without_a_cursor_waits_for_progress(self):
+        running = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data="Hello")
+        url = reverse('execution_status', args=[running.id])
+        started = time.monotonic()
+        response = self.client.get(url, {'wait': '0.2'})
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(response.json()['steps'], [])
+
+        def progress():
+            deadline = time.monotonic() + 5
+            while not NOTIFIER.waiting() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            notify(running.id)
+
+        worker = threading.Thread(target=progress)
+        worker.start()
+        started = time.monotonic()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, {'wait': '5'})
+        worker.join()
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(response.status_code, 200)
+        # Checked on arrival, then answered when notified
+        self.assertEqual(len([q for q in captured if 'pipelineexecution' in q['sql']]), 2)
+        self.assertEqual(NOTIFIER.waiting(), 0)
+
+    def test_long_poll_times_out_unchanged(self):
+        etag = self.status()['ETag']
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('execution_status', args=[self.execution.id]),
+                                       {'wait': '0.2'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        cursor = self.status().json()['next_since_step']
+        self.assertEqual(self.status(since_step=cursor, wait='0.2').json()['steps'], [])
+        self.assertEqual(NOTIFIER.waiting(), 0)
+
+    def test_long_poll_rechecks_when_notified(self):
+        etag = self.status()['ETag']
+
+        def wake():
+            deadline = time.monotonic() + 5
+            while not NOTIFIER.waiting() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            notify(self.execution.id)
+
+        waker = threading.Thread(target=wake)
+        waker.start()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('execution_status', args=[self.execution.id]),
+                                       {'wait': '1'}, HTTP_IF_NONE_MATCH=etag)
+        waker.join()
+        self.assertEqual(response.status_code, 304)
+        # Checked on arrival, when notified and when the wait ran out
+        self.assertEqual(len(captured), 3)
+
+
+class ExecutionHistoryTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def page(self, **params):
+        return self.client.get(reverse('execution_history_api'), params)
+
+    def test_cursor_walks_every_execution_once(self):
+        expected = list(PipelineExecution.objects.order_by('-started_at', '-id').values_list('id', flat=True))
+        seen = []
+        cursor = ''
+        while True:
+            with self.assertMaxQueries(1):
+                data = self.page(limit=30, cursor=cursor).json()
+            seen.extend(execution['id'] for execution in data['executions'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_filters(self):
+        pipeline = self.pipelines[1]
+        data = self.page(pipeline=pipeline.id, status='complete', limit=200).json()
+        self.assertEqual(
+            {execution['id'] for execution in data['executions']},
+            set(pipeline.executions.filter(is_complete=True).values_list('id', flat=True)),
+        )
+        running = PipelineExecution.objects.create(pipeline=pipeline, input_data='Still going')
+        data = self.page(status='running').json()
+        self.assertEqual([execution['id'] for execution in data['executions']], [running.id])
+
+    def test_page_is_an_index_range_scan(self):
+        cursor = self.page(limit=10).json()['next_cursor']
+        for params in ({}, {'pipeline': self.pipelines[0].id}, {'status': 'complete'}):
+            with CaptureQueriesContext(connection) as captured:
+                self.page(cursor=cursor, **params)
+            with connection.cursor() as db:
+                db.execute(f"EXPLAIN QUERY PLAN {captured.captured_queries[0]['sql']}")
+                plan = ' '.join(row[-1] for row in db.fetchall())
+            # A range search starting at the cursor, not a scan from the newest row
+            self.assertRegex(plan, r'SEARCH .* USING INDEX execution_\w+ \(.*started_at<\?\)')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_history_page_links_to_the_next_page(self):
+        response = self.client.get(reverse('execution_history'), {'limit': 5})
+        self.assertEqual(len(response.context['executions']), 5)
+        self.assertContains(response, f"cursor={response.context['next_cursor']}")
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.page(cursor='garbage').status_code, 400)
+        self.assertEqual(self.page(status='lost').status_code, 400)
+        self.assertEqual(self.page(limit=0).status_code, 400)
+        self.assertEqual(self.client.get(reverse('execution_history'), {'pipeline': 'x'}).status_code, 400)
+
+
+class IdempotencyTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def submit(self, key, pipeline=None, text='Hello world. Thank you.'):
+        return self.client.post(reverse('execute_pipeline'), {
+            'pipeline_id': (pipeline or self.pipelines[0]).id, 'input_text': text,
+        }, headers={'idempotency_key': key})
+
+    def test_retry_returns_the_original_execution(self):
+        first = self.submit('retry-1')
+        count = PipelineExecution.objects.count()
+        with self.assertMaxQueries(2):
+            retry = self.submit('retry-1', text='Ignored')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['execution_id'], first.json()['execution_id'])
+        self.assertEqual(retry.json()['result']['text'], first.json()['result']['text'])
+        self.assertEqual(PipelineExecution.objects.count(), count)
+
+    def test_running_and_failed_executions_are_replayed(self):
+        running = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='', idempotency_key='run')
+        response = self.submit('run')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'success': True, 'execution_id': running.id, 'is_complete': False})
+
+        PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='', is_complete=True,
+                                         output_data='{"error": "boom"}', idempotency_key='failed')
+        self.assertEqual(self.submit('failed').status_code, 500)
+        self.assertEqual(self.submit('run', pipeline=self.pipelines[1]).status_code, 422)
+
+    def test_concurrent_attempt_loses_to_the_first(self):
+        winner = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='', idempotency_key='race')
+        # The loser checked before the winner's execution existed
+        with mock.patch('flowgptapp.idempotency.find_execution',
+                        side_effect=[None, idempotency.find_execution('race')]):
+            response = self.submit('race')
+        self.assertEqual(response.json()['execution_id'], winner.id)
+        self.assertEqual(PipelineExecution.objects.filter(idempotency_key='race').count(), 1)
+
+    def test_expired_keys_are_released(self):
+        old = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='', idempotency_key='old')
+        stale = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='', idempotency_key='stale')
+        PipelineExecution.objects.filter(id__in=[old.id, stale.id]).update(
+            started_at=timezone.now() - datetime.timedelta(days=2))
+
+        response = self.submit('old')
+        self.assertNotEqual(response.json()['execution_id'], old.id)
+        self.assertEqual(idempotency.prune_expired_keys(force=True), 1)
+        self.assertIsNone(PipelineExecution.objects.get(id=stale.id).idempotency_key)
+        self.assertEqual(idempotency.prune_expired_keys(), 0)
+
+    def test_invalid_keys(self):
+        self.assertEqual(self.submit('x' * 300).status_code, 400)
+        response = self.client.post(reverse('execute_pipeline'), {
+            'pipeline_id': self.pipelines[0].id, 'input_text': ['a', 'b'],
+        }, headers={'idempotency_key': 'batch'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseEncodingTests(FlowGPTFixtureMixin, TestCase):
+
+    def status(self, **headers):
+        return self.client.get(reverse('execution_status', args=[self.execution.id]), headers=headers)
+
+    def test_stored_outputs_are_sent_as_is(self):
+        step = self.execution.steps.order_by('id').first()
+        step.output_data = '{"text":"Hello","nested":{"n":1}}'
+        step.save()
+        steps = self.status().json()['steps']
+        self.assertEqual(steps[0]['output'], {'text': 'Hello', 'nested': {'n': 1}})
+        self.assertIn(b'"output":{"text":"Hello","nested":{"n":1}}', self.status().content)
+
+    def test_compression_follows_accept_encoding(self):
+        plain = self.status()
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        gzipped = self.status(accept_encoding='gzip')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        self.assertEqual(gzipped['ETag'], 'W/' + plain['ETag'])
+        cached = self.status(accept_encoding='gzip', if_none_match=gzipped['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        self.assertEqual(self.status(accept_encoding='gzip;q=0, identity').content, plain.content)
+        if middleware.zstandard is not None:
+            compressed = self.status(accept_encoding='gzip, zstd')
+            self.assertEqual(compressed['Content-Encoding'], 'zstd')
+            self.assertEqual(middleware.zstandard.ZstdDecompressor().decompress(compressed.content), plain.content)
+            self.assertEqual(self.status(accept_encoding='zstd;q=0.5, gzip')['Content-Encoding'], 'gzip')
+
+    def test_html_is_not_compressed(self):
+        response = self.client.get(reverse('execution_history'), headers={'accept_encoding': 'gzip'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ProfilingTests(FlowGPTFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        profiling.REPORT.clear()
+        self.addCleanup(profiling.REPORT.clear)
+
+    @staticmethod
+    def view(request):
+        for pipeline_id in (1, 1, 2):
+            list(Pipeline.objects.filter(id=pipeline_id))
+        return HttpResponse('ok')
+
+    def test_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.ProfilingMiddleware(self.view)
+        response = self.client.get(reverse('execution_history'), headers={'x_flowgpt_profile': '1'})
+        self.assertNotIn('Server-Timing', response)
+
+    def test_profiles_requests_with_the_header(self):
+        with self.settings(FLOWGPT_PROFILING=True):
+            profiler = middleware.ProfilingMiddleware(self.view)
+            response = profiler(RequestFactory().get('/profiled/', headers={'x_flowgpt_profile': '1'}))
+            plain = profiler(RequestFactory().get('/plain/'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="3 queries, 1 duplicate", app;dur=[\d.]+, cpu;dur=[\d.]+, total;dur=')
+        self.assertNotIn('Server-Timing', plain)
+
+        [entry] = profiling.REPORT.entries()
+        self.assertEqual((entry['path'], entry['queries'], entry['status']), ('/profiled/', 3, 200))
+        self.assertEqual([duplicate['count'] for duplicate in entry['duplicates']], [2])
+        self.assertEqual([repeated['count'] for repeated in entry['repeated']], [3])
+        self.assertEqual(len(entry['slowest']), 3)
+        self.assertGreaterEqual(entry['total_ms'], entry['sql_ms'])
+
+    def test_async_views(self):
+        async def view(request):
+            return await sync_to_async(self.view)(request)
+
+        with self.settings(FLOWGPT_PROFILING=True):
+            profiler = middleware.ProfilingMiddleware(view)
+        request = AsyncRequestFactory().get('/async/', headers={'x_flowgpt_profile': '1'})
+        response = async_to_sync(profiler)(request)
+        self.assertIn('desc="3 queries', response['Server-Timing'])
+
+    def test_report_in_the_admin(self):
+        with self.settings(FLOWGPT_PROFILING=True):
+            self.client.get(reverse('execution_history'), headers={'x_flowgpt_profile': '1'})
+            self.client.get(reverse('execution_history'), headers={'x_flowgpt_profile': '1'})
+        self.assertEqual(profiling.REPORT.by_view()[0]['requests'], 2)
+
+        url = reverse('admin_profiling')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.admin_user)
+        response = self.client.get(url)
+        self.assertContains(response, 'execution_history')
+        self.client.post(url)
+        self.assertEqual(profiling.REPORT.entries(), [])
+
+
+class AsyncViewTests(FlowGPTFixtureMixin, TestCase):
+
+    async def test_history_api_under_async_client(self):
+        response = await self.async_client.get(reverse('execution_history_api'), {'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['executions']), 3)
+
+    async def test_execution_does_not_block_the_event_loop(self):
+        def slow_execute(pipeline_id, input_text, idempotency_key=None):
+            time.sleep(0.3)
+            return {'metadata': {'execution_id': self.execution.id}}
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        with mock.patch('flowgptapp.views.execute_pipeline', slow_execute):
+            response = await self.async_client.post(reverse('execute_pipeline'), {
+                'pipeline_id': self.pipelines[0].id, 'input_text': 'Hello'
+            })
+        ticker.cancel()
+        self.assertEqual(response.json()['execution_id'], self.execution.id)
+        self.assertGreater(ticks, 10)
+
+
+class PageCacheTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def get(self, name, *args, **headers):
+        return self.client.get(reverse(name, args=args), headers=headers)
+
+    def test_home_is_cached_until_a_pipeline_changes(self):
+        self.get('home')
+        with self.assertMaxQueries(0):
+            self.assertEqual(self.get('home').status_code, 200)
+        Pipeline.objects.create(name='Brand new pipeline')
+        self.assertContains(self.get('home'), 'Brand new pipeline')
+
+    def test_pipeline_page_is_invalidated_by_node_changes(self):
+        pipeline = self.pipelines[0]
+        self.get('pipeline_detail', pipeline.id)
+        with self.assertMaxQueries(0):
+            self.get('pipeline_detail', pipeline.id)
+        node = pipeline.edges.first().source
+        node.name = 'Renamed node'
+        node.save()
+        self.assertContains(self.get('pipeline_detail', pipeline.id), 'Renamed node')
+        # Other pipelines keep their cached pages
+        self.get('pipeline_detail', self.pipelines[1].id)
+        pipeline.edges.first().delete()
+        with self.assertMaxQueries(0):
+            self.get('pipeline_detail', self.pipelines[1].id)
+
+    def test_completed_execution_has_a_strong_etag(self):
+        response = self.get('execution_detail', self.execution.id)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        with self.assertMaxQueries(0):
+            cached = self.get('execution_detail', self.execution.id, if_none_match=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.execution.pipeline.name = 'Renamed pipeline'
+        self.execution.pipeline.save()
+        self.assertContains(self.get('execution_detail', self.execution.id), 'Renamed pipeline')
+        execution_id = self.execution.id
+        self.execution.delete()
+        self.assertEqual(self.get('execution_detail', execution_id).status_code, 404)
+
+    def test_running_execution_is_not_cached(self):
+        execution = PipelineExecution.objects.create(pipeline=self.pipelines[0], input_data='Hello')
+        self.get('execution_detail', execution.id)
+        with self.assertMaxQueries(2):
+            response = self.get('execution_detail', execution.id)
+        self.assertNotIn('ETag', response)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_file_cache_is_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as location:
+            file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with self.settings(CACHES={'default': file_cache}):
+                self.get('pipeline_detail', self.pipelines[0].id)
+                pid = os.fork()
+                if pid == 0:
+                    # A signal in another worker invalidates this worker's page
+                    try:
+                        page_cache.invalidate_pipelines([self.pipelines[0].id])
+                    finally:
+                        os._exit(0)
+                os.waitpid(pid, 0)
+                with CaptureQueriesContext(connection) as captured:
+                    self.get('pipeline_detail', self.pipelines[0].id)
+                self.assertGreater(len(captured), 0)
+
+
+class MultiProcessMetricsTests(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+        self.counter = metrics.Counter('test_events_total', "Events", registry=self.registry)
+        self.gauge = metrics.Gauge('test_in_flight', "In flight", registry=self.registry)
+        self.histogram = metrics.Histogram('test_seconds', "Seconds", buckets=(1.0,), registry=self.registry)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def collect(self):
+        with self.settings(FLOWGPT_METRICS_DIR=self.directory):
+            values = self.registry.collect()
+        return values['test_events_total'].get(()), values['test_in_flight'].get(()), values['test_seconds'].get(())
+
+    def test_exited_workers_are_archived_without_their_gauges(self):
+        self.counter.inc(2)
+        worker = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdin.read()'], stdin=subprocess.PIPE)
+        self.addCleanup(worker.kill)
+        with open(os.path.join(self.directory, f'metrics-{worker.pid}-0.json'), 'w') as f:
+            json.dump({'pid': worker.pid, 'metrics': {
+                'test_events_total': {'type': 'counter', 'samples': [[[], 5]]},
+                'test_in_flight': {'type': 'gauge', 'samples': [[[], 3]]},
+                'test_seconds': {'type': 'histogram', 'samples': [[[], [1, 1, 2.5, 2]]]},
+            }}, f)
+        self.assertEqual(self.collect(), (7, 3, [1, 1, 2.5, 2]))
+
+        worker.communicate(b'')
+        self.assertEqual(self.collect(), (7, None, [1, 1, 2.5, 2]))
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if not name.startswith('.')),
+                         ['archive.json', f'metrics-{os.getpid()}-{self.registry._token}.json'])
+        # The archive is only counted once, however often it is read
+        self.counter.inc()
+        self.assertEqual(self.collect(), (8, None, [1, 1, 2.5, 2]))
+
+    def test_idle_workers_publish_their_last_values(self):
+        with self.settings(FLOWGPT_METRICS_DIR=self.directory), \
+                mock.patch.object(metrics, 'FLUSH_INTERVAL', 0.05):
+            self.counter.inc()
+            self.counter.inc()
+            path = os.path.join(self.directory, f'metrics-{os.getpid()}-{self.registry._token}.json')
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                with open(path) as f:
+                    if json.load(f)['metrics']['test_events_total']['samples'] == [[[], 2]]:
+                        break
+                time.sleep(0.01)
+            else:
+                self.fail("The second increment was never written")
+            # Lets the flusher thread finish
+            self.registry._flusher = None
+
+
+class CleanTextTests(TestCase):
+
+    def clean(self, text, **config):
+        return clean_text({'text': text, 'config': config})['text']
+
+    def test_collapses_whitespace(self):
+        self.assertEqual(self.clean("  Hello \t world\n\nagain  "), "Hello world again")
+
+    def test_removes_urls_before_special_chars(self):
+        self.assertEqual(
+            self.clean("Visit https://example.com/a?b=1 now! Thanks , bye", remove_urls=True, remove_special_chars=True),
+            "Visit now Thanks bye"
+        )
+
+    def test_strip_html_and_mask_emails(self):
+        self.assertEqual(
+            self.clean("<p>Mail <b>jane.doe+x@example.co.uk</b> today!</p>", strip_html=True, mask_emails=True),
+            "Mail [email] today!"
+        )
+        self.assertEqual(self.clean("a@b.io", mask_emails='<hidden>'), "<hidden>")
+
+    def test_unicode_normalisation(self):
+        self.assertEqual(self.clean("ﬁne　ｗｉｄｅ", normalize_unicode=True), "fine wide")
+
+    def test_cleaner_is_compiled_once_per_config(self):
+        self.assertIs(get_cleaner({'remove_urls': True}), get_cleaner({'remove_urls': True, 'other': 1}))
+
+
+class TranslateTests(TestCase):
+
+    def translate(self, text, **config):
+        return translate({'text': text, 'config': config})['translated_text']
+
+    def test_multi_word_phrases_use_longest_match(self):
+        self.assertEqual(self.translate("Thank you, world!"), "Gracias, mundo!")
+        self.assertEqual(self.translate("thank\nyou", target_language='german'), "danke")
+
+    def test_preserves_case_and_punctuation(self):
+        self.assertEqual(
+            self.translate("HELLO world... Goodbye; unknown words stay.", target_language='french'),
+            "BONJOUR monde... Au revoir; unknown words stay."
+        )
+
+    def test_phrases_do_not_match_across_punctuation(self):
+        self.assertEqual(self.translate("thank. you"), "thank. you")
+
+    def test_unsupported_pair_keeps_text(self):
+        self.assertEqual(self.translate("Hello", target_language='klingon'), "Hello")
+
+    def test_custom_dictionary_is_reloaded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'english-pirate.tsv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("hello\tahoy\n")
+            with self.settings(FLOWGPT_TRANSLATION_DIRS=[directory]):
+                self.assertEqual(self.translate("Hello", target_language='pirate'), "Ahoy")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write("hello\tavast\n")
+                reload_dictionaries()
+                self.assertEqual(self.translate("Hello", target_language='pirate'), "Avast")
+        reload_dictionaries()
+
+    def test_language_names_cannot_leave_the_dictionary_dirs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'english-secret.tsv'), 'w', encoding='utf-8') as f:
+                f.write("hello\tleaked\n")
+            nested = os.path.join(directory, 'dictionaries')
+            os.mkdir(nested)
+            with self.settings(FLOWGPT_TRANSLATION_DIRS=[nested]):
+                self.assertIsNone(find_dictionary('english', '../english-secret'))
+                self.assertEqual(self.translate("Hello", target_language='../english-secret'), "Hello")
+        self.assertEqual(self.translate("Hello", target_language=['spanish']), "Hello")
+        self.assertIsNone(get_translator(None, 'spanish'))
+        node = Node(name="Translate", node_type='translate', config={'target_language': '../../etc/passwd'})
+        with self.assertRaises(ValidationError):
+            node.full_clean()
+        Node(name="Translate", node_type='translate', config={'target_language': 'French'}).full_clean()
+        reload_dictionaries()
+
+    def test_unsupported_pairs_are_cached(self):
+        reload_dictionaries()
+        with mock.patch.object(translation, 'find_dictionary', wraps=translation.find_dictionary) as find:
+            self.assertIsNone(get_translator('english', 'klingon'))
+            self.assertIsNone(get_translator('english', 'klingon'))
+            self.assertEqual(find.call_count, 1)
+            with mock.patch.object(translation, 'RELOAD_CHECK_INTERVAL', 0):
+                self.assertIsNone(get_translator('english', 'klingon'))
+            self.assertEqual(find.call_count, 2)
+        reload_dictionaries()
+
+
+class BatchFunctionTests(TestCase):
+    TEXTS = [
+        "Hello world. Thank you!  Goodbye?\tWelcome to https://example.com/x?y=1 now.",
+        "",
+        "   ",
+        "<p>Mail jane@example.com</p>,, <b>HELLO</b> thank\nyou... ﬁne",
+        "trailing punctuation!!!",
+        "!!!leading punctuation",
+        "Straße ǆ ﬃ",
+    ]
+
+    def assertMatchesPerItem(self, node_type, texts, config):
+        single = [NODE_FUNCTIONS[node_type]({'text': t, 'config': dict(config)}) for t in texts]
+        batch = get_batch_function(node_type)([{'text': t, 'config': dict(config)} for t in texts])
+        for expected, actual in zip(single, batch):
+            for state in (expected, actual):
+                state['metadata'] = {k: v for k, v in state['metadata'].items() if not k.endswith('timestamp')}
+                for key in ('message_id', 'queued_at'):
+                    state.get('email_result', {}).pop(key, None)
+            self.assertEqual(expected, actual)
+
+    def test_batches_match_per_item_functions(self):
+        for node_type, configs in NODE_CONFIG_VARIANTS.items():
+            for config in configs:
+                with self.subTest(node_type=node_type, config=config):
+                    self.assertMatchesPerItem(node_type, self.TEXTS, config)
+
+    def test_texts_containing_the_separator_fall_back(self):
+        texts = self.TEXTS + ["a\x00b!", "\x00"]
+        config = {'remove_special_chars': True, 'pattern': r'\W', 'nodes': ['uppercase']}
+        for node_type in NODE_FUNCTIONS:
+            if 'text' not in get_node_type(node_type).reads:
+                continue
+            with self.subTest(node_type=node_type):
+                self.assertMatchesPerItem(node_type, texts, config)
+
+
+class ExecutePipelineBatchTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+    INPUTS = ["Hello world. Thank you.", "Goodbye!  See   you.", ""]
+
+    def text_fields(self, state):
+        return {k: state.get(k) for k in ('text', 'summary', 'translated_text', 'error')}
+
+    def test_linear_pipeline_runs_as_batch(self):
+        pipeline_id = self.pipelines[0].id
+        # Graph (2) + executions insert (1) + steps per node (1) + completion (1)
+        with self.assertMaxQueries(4 + self.PIPELINE_LENGTH):
+            results = execute_pipeline_batch(pipeline_id, self.INPUTS)
+        expected = [execute_pipeline(pipeline_id, text) for text in self.INPUTS]
+        self.assertEqual([self.text_fields(r) for r in results], [self.text_fields(r) for r in expected])
+
+        execution = PipelineExecution.objects.get(id=results[1]['metadata']['execution_id'])
+        self.assertTrue(execution.is_complete)
+        self.assertEqual(execution.input_data, self.INPUTS[1])
+        self.assertEqual(execution.steps.count(), self.PIPELINE_LENGTH)
+
+    def comparable(self, data, execution_id):
+        # Drop what legitimately differs between two runs of the same input
+        data = json.loads(data) if isinstance(data, str) else dict(data)
+        metadata = {k: v for k, v in data.get('metadata', {}).items()
+                    if not k.endswith('timestamp') and k not in ('execution_id', 'started_at')}
+        self.assertNotIn(execution_id, metadata.values())
+        return {**data, 'metadata': metadata}
+
+    def test_batch_results_and_steps_match_single_executions(self):
+        pipeline = Pipeline.objects.create(name="Configured")
+        chain = [
+            Node.objects.create(name="Clean", node_type='clean_text', config={'remove_urls': True}),
+            Node.objects.create(name="Summary", node_type='summary', config={'num_sentences': 1}),
+            Node.objects.create(name="Translate", node_type='translate', config={'target_language': 'french'}),
+        ]
+        for order, (source, target) in enumerate(zip(chain, chain[1:])):
+            Edge.objects.create(pipeline=pipeline, source=source, target=target, order=order)
+
+        batch = execute_pipeline_batch(pipeline.id, self.INPUTS)
+        single = [execute_pipeline(pipeline.id, text) for text in self.INPUTS]
+        for batch_result, single_result in zip(batch, single):
+            batch_id = batch_result['metadata']['execution_id']
+            single_id = single_result['metadata']['execution_id']
+            self.assertEqual(self.comparable(batch_result, batch_id), self.comparable(single_result, single_id))
+            self.assertEqual(
+                [self.comparable(step.output_data, batch_id)
+                 for step in ExecutionStep.objects.filter(execution_id=batch_id).order_by('id')],
+                [self.comparable(step.output_data, single_id)
+                 for step in ExecutionStep.objects.filter(execution_id=single_id).order_by('id')],
+            )
+            self.assertEqual(
+                self.comparable(PipelineExecution.objects.get(id=batch_id).output_data, batch_id),
+                self.comparable(PipelineExecution.objects.get(id=single_id).output_data, single_id),
+            )
+
+    def test_view_batches_multiple_inputs(self):
+        response = self.client.post(reverse('execute_pipeline'), {
+            'pipeline_id': self.pipelines[0].id, 'input_text': self.INPUTS
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['execution_ids']), len(self.INPUTS))
+
+
+def reverse_text(state):
+    state["text"] = state.get("text", "")[::-1]
+    state["reversed"] = True
+    state["scratch"] = "not declared"
+    return state
+
+
+class NodeTypeRegistryTests(TestCase):
+
+    def setUp(self):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+
+    def test_builtin_types_match_model_choices(self):
+        self.assertEqual(dict(Node._meta.get_field('node_type').choices)['clean_text'], 'Clean Text')
+        self.assertEqual(set(NODE_FUNCTIONS), set(FlowGPTFixtureMixin.NODE_TYPES))
+        self.assertFalse(get_node_type('email').pure)
+        self.assertTrue(get_node_type('translate').supports_batch)
+
+    def test_settings_node_type_is_imported_on_first_use(self):
+        entry = {'name': 'reverse', 'function': 'flowgptapp.tests:reverse_text', 'writes': ['text', 'reversed']}
+        with self.settings(FLOWGPT_NODE_TYPES=[entry]):
+            REGISTRY.reset()
+            node_type = get_node_type('reverse')
+            self.assertEqual(node_type.label, 'Reverse')
+            self.assertFalse(node_type.is_loaded)
+            self.assertIn(('reverse', 'Reverse'), Node._meta.get_field('node_type').choices)
+
+            pipeline = Pipeline.objects.create(name="Plugin")
+            first = Node.objects.create(name="Reverse", node_type='reverse')
+            second = Node.objects.create(name="Upper", node_type='uppercase')
+            Edge.objects.create(pipeline=pipeline, source=first, target=second)
+            result = execute_pipeline(pipeline.id, "abc")
+        self.assertTrue(node_type.is_loaded)
+        self.assertEqual(result['text'], "CBA")
+        self.assertTrue(result['reversed'])
+        # Only the declared writes are passed on as the state update
+        self.assertNotIn('scratch', result)
+
+    def test_invalid_settings_entry(self):
+        with self.settings(FLOWGPT_NODE_TYPES=['flowgptapp.tests.missing']):
+            REGISTRY.reset()
+            with self.assertRaises(ImproperlyConfigured):
+                get_node_type('clean_text')
+
+
+class SummaryTests(TestCase):
+    TEXT = "First one.  Second!\nThird?\tFourth sentence here. Fifth"
+
+    def summarize(self, text, **config):
+        return basic_summary({'text': text, 'config': config})['summary']
+
+    def test_lead_matches_splitting_the_whole_text(self):
+        for num_sentences in (1, 2, 4, 10):
+            for max_chars in (None, 5, 12, 200):
+                with self.subTest(num_sentences=num_sentences, max_chars=max_chars):
+                    summary = ' '.join(re.split(r'(?<=[.!?])\s+', self.TEXT)[:num_sentences])
+                    if max_chars and len(summary) > max_chars:
+                        summary = summary[:max_chars] + "..."
+                    self.assertEqual(
+                        self.summarize(self.TEXT, num_sentences=num_sentences, max_chars=max_chars), summary
+                    )
+
+    def test_lead_stops_after_the_sentences_it_needs(self):
+        self.assertEqual(list(itertools.islice(iter_sentences("A. B. C"), 2)), ["A.", "B."])
+        self.assertEqual(self.summarize(self.TEXT, num_sentences=0, max_chars=9), "First one...")
+
+    def test_extractive_keeps_top_sentences_in_document_order(self):
+        text = "Cats purr. Dogs bark loudly. Birds sing. Cats sleep and cats purr. Fish swim."
+        self.assertEqual(self.summarize(text, num_sentences=2, mode='extractive'),
+                         "Cats purr. Cats sleep and cats purr.")
+
+    def test_extractive_heap_spans_chunks(self):
+        sentences = [f"Filler number {i}." for i in range(CHUNK_SENTENCES * 2)]
+        sentences[CHUNK_SENTENCES + 5] = "Number number number."
+        summary = self.summarize(' '.join(sentences), num_sentences=1, mode='extractive')
+        self.assertEqual(summary, "Number number number.")
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.summarize(self.TEXT, mode='abstractive')
+
+
+class RegexNodeTests(TestCase):
+
+    def setUp(self):
+        patterns.CACHE.clear()
+        self.addCleanup(patterns.CACHE.clear)
+
+    def run_regex(self, text, **config):
+        return regex({'text': text, 'config': config})
+
+    def test_replace_and_extract(self):
+        state = self.run_regex("Call 555-1234 or 555-9876", pattern=r'\d{3}-(\d{4})', replacement=r'xxx-\1')
+        self.assertEqual(state['text'], "Call xxx-1234 or xxx-9876")
+        self.assertEqual(state['metadata']['regex_match_count'], 2)
+        state = self.run_regex("a@x.org, B@Y.ORG", pattern=r'(\w+)@([a-z.]+)', flags='i', mode='extract',
+                               group=2, separator=';')
+        self.assertEqual(state['text'], "x.org;Y.ORG")
+
+    def test_rules_apply_in_order(self):
+        rules = [{'pattern': r'\s+', 'replacement': ' '}, {'pattern': 'CAT', 'flags': 'i', 'replacement': 'dog'}]
+        self.assertEqual(self.run_regex("Cat  and\n cat", rules=rules)['text'], "dog and dog")
+
+    def test_patterns_are_cached_in_a_bounded_lru(self):
+        self.run_regex("abc", pattern='b')
+        self.run_regex("abc", pattern='b')
+        self.assertEqual((patterns.CACHE.hits, patterns.CACHE.misses), (1, 1))
+        patterns.CACHE.clear()
+        with mock.patch.object(patterns.CACHE, 'maxsize', 2):
+            for pattern in ('a', 'b', 'c', 'b', 'a', 'b'):
+                patterns.get_pattern(pattern)
+            # "a" was evicted by "c", then "c" by "a" since "b" had been used since
+            self.assertEqual((patterns.CACHE.hits, patterns.CACHE.misses), (2, 4))
+            self.assertEqual(len(patterns.CACHE), 2)
+
+    def test_catastrophic_patterns_are_rejected(self):
+        for pattern in (r'(a+)+$', r'(?:\w*\s?)*x', r'(\d+\.?)+x', r'(?:a+a)*', r'(?=(x+)*)'):
+            with self.subTest(pattern=pattern), self.assertRaises(ValueError):
+                patterns.get_pattern(pattern)
+        for pattern in (r'a+b+', r'(ab){1,5}c*', r'(?:a++)+', r'[a-z]+(?:-[a-z]+)*', r'(?:\d+,)*\d+'):
+            with self.subTest(pattern=pattern):
+                patterns.get_pattern(pattern)
+
+    def test_overlapping_repeated_alternatives_are_rejected(self):
+        for pattern in (r'(a|aa)*b', r'(?:a|a)*b', r'(\w|\d)*$x', r'(?:-(a|ab))*', r'(?:[a-c]|[c-f])+'):
+            with self.subTest(pattern=pattern), self.assertRaises(ValueError):
+                patterns.get_pattern(pattern)
+        for pattern in (r'(?:cat|dog)*', r'(?:\s|,)+', r'[\w.-]+', r'(?:x?a|b)*', r'[^"\\]*', r'\b(the|and)\b'):
+            with self.subTest(pattern=pattern):
+                patterns.get_pattern(pattern)
+
+    def test_bounded_and_adjacent_overlapping_quantifiers_are_rejected(self):
+        for pattern in (r'(.*a){12}$x', r'a*a*a*a*a*a*a*b', r'(?:\w+\s?){20}$', r'(a*)b?a*c', r'\d+\.?\d+x'):
+            with self.subTest(pattern=pattern), self.assertRaises(ValueError):
+                patterns.get_pattern(pattern)
+        for pattern in (r'(?:\d+,){3}\d+', r'\s*\w+\s*', r'(\w+)\s+(\w+)', r'a*+a*', r'\S+\s+\S+', r'ß*S*'):
+            with self.subTest(pattern=pattern):
+                patterns.get_pattern(pattern)
+
+    def test_input_size_limit(self):
+        with self.settings(FLOWGPT_REGEX_MAX_INPUT_CHARS=10), self.assertRaises(ValueError):
+            self.run_regex("x" * 11, pattern='x')
+
+    @unittest.skipIf(patterns.re2 is not None, "google-re2 is installed")
+    def test_re2_engine_requires_google_re2(self):
+        with self.assertRaises(ValueError):
+            self.run_regex("aaa", pattern=r'(a+)+$', engine='re2')
+
+    def test_node_config_is_validated_on_save(self):
+        node = Node(name="Bad", node_type='regex', config={'pattern': r'(x+)+y'})
+        with self.assertRaises(ValidationError):
+            node.full_clean()
+        node.config = {'pattern': r'x+y', 'mode': 'extract'}
+        node.full_clean()
+
+
+def join_reversed(values, separators, config):
+    return config.get("separator", " ").join(reversed(values))
+
+
+class MapReduceTests(TestCase):
+    TEXT = "First  paragraph here.\n\nSecond one,\nstill second.\n  \n\nThird!  Done."
+    NODES = [{"node_type": "clean_text"}, {"node_type": "uppercase"}]
+
+    def map_reduce(self, text, reduce_config=None, **map_config):
+        state = map_chunks({'text': text, 'config': {'nodes': self.NODES, **map_config}})
+        state['config'] = reduce_config or {}
+        return reduce_chunks(state)
+
+    def test_split_text_round_trips(self):
+        text = "alpha beta\n gamma\tdelta  epsilon" * 20 + "x" * 50
+        for split, chunk_size in (('paragraphs', 10), ('chunks', 7), ('chunks', 1000)):
+            with self.subTest(split=split, chunk_size=chunk_size):
+                pairs = list(mapreduce.split_text(text, split, chunk_size))
+                self.assertEqual(''.join(chunk + separator for chunk, separator in pairs), text)
+                if split == 'chunks':
+                    self.assertTrue(all(len(chunk) <= chunk_size for chunk, _ in pairs))
+
+    def test_paragraphs_are_mapped_and_joined(self):
+        state = self.map_reduce(self.TEXT, workers=1)
+        self.assertEqual(state['text'], "FIRST PARAGRAPH HERE.\n\nSECOND ONE, STILL SECOND.\n  \n\nTHIRD! DONE.")
+        self.assertIsNone(state['chunks'])
+        self.assertEqual(state['metadata']['map_chunk_count'], 3)
+
+    def test_pools_match_sequential_run(self):
+        expected = self.map_reduce(self.TEXT, workers=1)['text']
+        for pool in ('thread', 'process'):
+            with self.subTest(pool=pool):
+                state = self.map_reduce(self.TEXT, pool=pool, workers=2, chunk_size=8)
+                self.assertEqual(state['text'], expected)
+
+    def test_reduce_combiners(self):
+        state = self.map_reduce("a b c d", {'combiner': 'concat'}, split='chunks', chunk_size=2, workers=1)
+        self.assertEqual(state['text'], "ABCD")
+        state = self.map_reduce("a\n\nb", {'combiner': f'{__name__}.join_reversed', 'target': 'summary'},
+                                workers=1)
+        self.assertEqual(state['summary'], "B A")
+        with self.assertRaises(ValueError):
+            reduce_chunks({'text': "no map", 'config': {}})
+
+    def test_map_config_is_validated(self):
+        for config in ({}, {'nodes': ['email']}, {'nodes': ['map']}, {'nodes': ['clean_text'], 'pool': 'gpu'},
+                       {'nodes': [{'node_type': 'regex', 'config': {'pattern': '(a*)*'}}]}):
+            with self.subTest(config=config), self.assertRaises(ValidationError):
+                Node(name="Map", node_type='map', config=config).full_clean()
+
+    def test_pipeline_runs_map_then_reduce(self):
+        map_node = Node.objects.create(name="Map", node_type='map', config={'nodes': ['uppercase'], 'workers': 1})
+        reduce_node = Node.objects.create(name="Reduce", node_type='reduce', config={})
+        pipeline = Pipeline.objects.create(name="Map reduce")
+        Edge.objects.create(pipeline=pipeline, source=map_node, target=reduce_node)
+        result = execute_pipeline(pipeline.id, "one\n\ntwo")
+        self.assertEqual(result['text'], "ONE\n\nTWO")
+        self.assertIsNone(result['chunks'])
+
+
+class SubpipelineTests(TestCase):
+
+    def setUp(self):
+        clear_compiled_graphs()
+        self.clean = Node.objects.create(name="Clean", node_type='clean_text', config={})
+        self.upper = Node.objects.create(name="Upper", node_type='uppercase', config={})
+        self.summary = Node.objects.create(name="Summary", node_type='summary', config={'num_sentences': 1})
+        self.child = Pipeline.objects.create(name="Cleaning prefix")
+        Edge.objects.create(pipeline=self.child, source=self.clean, target=self.upper)
+        self.include = Node.objects.create(name="Include", node_type='subpipeline',
+                                           config={'pipeline_id': self.child.id})
+        self.parent = Pipeline.objects.create(name="Parent")
+        Edge.objects.create(pipeline=self.parent, source=self.include, target=self.summary)
+
+    def test_child_nodes_are_inlined(self):
+        graph = create_pipeline_graph(self.parent.id)
+        self.assertEqual(set(graph.nodes), {f"{self.include.id}/{self.clean.id}",
+                                            f"{self.include.id}/{self.upper.id}", str(self.summary.id)})
+        result = execute_pipeline(self.parent.id, "  hello   world.  bye. ")
+        self.assertEqual(result['text'], "HELLO WORLD. BYE.")
+        self.assertEqual(result['summary'], "HELLO WORLD.")
+        execution = PipelineExecution.objects.get(id=result['metadata']['execution_id'])
+        self.assertEqual([step.node_id for step in execution.steps.order_by('id')],
+                         [self.clean.id, self.upper.id, self.summary.id])
+
+    def test_batch_expands_sub_pipelines(self):
+        texts = ["  one.  two. ", "three!"]
+        results = execute_pipeline_batch(self.parent.id, texts)
+        self.assertEqual([(r['text'], r['summary']) for r in results], [("ONE. TWO.", "ONE."), ("THREE!", "THREE!")])
+
+    def test_changing_the_child_recompiles_the_parent(self):
+        execute_pipeline(self.parent.id, "hello.")
+        translate_node = Node.objects.create(name="Translate", node_type='translate',
+                                             config={'target_language': 'spanish'})
+        Edge.objects.create(pipeline=self.child, source=self.upper, target=translate_node, order=1)
+        self.assertEqual(execute_pipeline(self.parent.id, "hello.")['translated_text'], "HOLA.")
+        translate_node.config = {'target_language': 'french'}
+        translate_node.save()
+        self.assertEqual(execute_pipeline(self.parent.id, "hello.")['translated_text'], "BONJOUR.")
+
+    def test_cycles_are_rejected_on_save(self):
+        back = Node.objects.create(name="Back", node_type='subpipeline', config={'pipeline_id': self.parent.id})
+        with self.assertRaises(ValidationError):
+            Edge(pipeline=self.child, source=self.upper, target=back).full_clean()
+        self_include = Node.objects.create(name="Self", node_type='subpipeline',
+                                           config={'pipeline_id': self.child.id})
+        with self.assertRaises(ValidationError):
+            Edge(pipeline=self.child, source=self.upper, target=self_include).full_clean()
+        Edge(pipeline=self.parent, source=self.summary, target=self_include).full_clean()
+        # Repointing a node already used by the parent at the parent itself
+        self.include.config = {'pipeline_id': self.parent.id}
+        with self.assertRaises(ValidationError):
+            self.include.full_clean()
+        with self.assertRaises(ValidationError):
+            Node(name="Missing", node_type='subpipeline', config={'pipeline_id': 0}).full_clean()
+
+    def test_cycles_are_rejected_without_full_clean(self):
+        back = Node.objects.create(name="Back", node_type='subpipeline', config={'pipeline_id': self.parent.id})
+        with self.assertRaises(ValidationError):
+            Edge.objects.create(pipeline=self.child, source=self.upper, target=back)
+        self.assertFalse(Edge.objects.filter(target=back).exists())
+        self.include.config = {'pipeline_id': self.parent.id}
+        with self.assertRaises(ValidationError):
+            self.include.save()
+        self.include.refresh_from_db()
+        self.assertEqual(self.include.config, {'pipeline_id': self.child.id})
+        # Edges that make no pipeline include itself still save
+        other = Node.objects.create(name="Other", node_type='subpipeline', config={'pipeline_id': self.child.id})
+        Edge.objects.create(pipeline=self.parent, source=self.summary, target=other)
+
+
+class ExecutionStateTests(TestCase):
+
+    def test_metadata_is_copy_on_write(self):
+        base = {'pipeline_id': 1, 'started_at': 1.5}
+        child = Metadata(base)
+        child['clean_text_applied'] = True
+        del child['started_at']
+        self.assertEqual(base, {'pipeline_id': 1, 'started_at': 1.5})
+        self.assertEqual(child.to_dict(), {'pipeline_id': 1, 'clean_text_applied': True})
+        self.assertNotIn('started_at', child)
+
+    def test_parallel_updates_are_merged(self):
+        current = Metadata({'execution_id': 3})
+        merged = merge_metadata(merge_metadata(current, {'a': 1}), Metadata(current, {'b': 2}))
+        self.assertEqual(merged, {'execution_id': 3, 'a': 1, 'b': 2})
+
+    def test_state_behaves_like_a_dict(self):
+        state = ExecutionState(text='Hi', metadata=Metadata({'x': 1}))
+        state['plugin_field'] = [1]
+        state.setdefault('metadata', {}).update({'y': 2.5})
+        self.assertEqual(state.get('summary', 'none'), 'none')
+        self.assertEqual(list(state), ['text', 'metadata', 'plugin_field'])
+        self.assertEqual(json.loads(dumps(state)),
+                         {'text': 'Hi', 'metadata': {'x': 1, 'y': 2.5}, 'plugin_field': [1]})
+
+    def test_execution_timestamps_are_numeric(self):
+        result = clean_text({'text': 'Hi', 'config': {}})
+        self.assertIsInstance(result['metadata']['clean_text_timestamp'], float)
+
+
+class FlakyEmailBackend(BaseEmailBackend):
+    """
+    Email backend failing the first ``failures`` sends with ``error``.
+    """
+    failures = 0
+    error = smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+    sent = []
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise FlakyEmailBackend.error
+        FlakyEmailBackend.sent.extend(messages)
+        return len(messages)
+
+
+class EmailOutboxTests(TestCase):
+
+    def setUp(self):
+        FlakyEmailBackend.failures = 0
+        FlakyEmailBackend.sent = []
+
+    def queue(self, count=1, **config):
+        pipeline = Pipeline.objects.create(name="Mailer")
+        clean = Node.objects.create(name="Clean", node_type='clean_text')
+        email = Node.objects.create(name="Email", node_type='email',
+                                    config={'recipient': 'jane@example.com', **config})
+        Edge.objects.create(pipeline=pipeline, source=clean, target=email)
+        if count == 1:
+            return [execute_pipeline(pipeline.id, "Hello  world")]
+        return execute_pipeline_batch(pipeline.id, [f"Hello {i}" for i in range(count)])
+
+    def test_email_node_only_queues(self):
+        result = self.queue()[0]
+        self.assertEqual(result['email_result']['status'], 'queued')
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.message_id, result['email_result']['message_id'])
+        self.assertEqual((email.status, email.body), (OutboundEmail.STATUS_PENDING, "Hello world"))
+
+    def test_dispatcher_sends_batches(self):
+        self.queue(count=5)
+        dispatcher = EmailDispatcher(batch_size=2)
+        stats = dispatcher.drain()
+        dispatcher.close()
+        self.assertEqual(stats.sent, 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.STATUS_SENT).exists())
+        self.assertIn('@flowgpt.local>', mail.outbox[0].extra_headers['Message-ID'])
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        self.queue()
+        FlakyEmailBackend.failures = 1
+        dispatcher = EmailDispatcher(backend='flowgptapp.tests.FlakyEmailBackend', backoff_base=60)
+        stats = dispatcher.drain()
+        self.assertEqual((stats.sent, stats.retried), (0, 1))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + datetime.timedelta(seconds=50))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatcher.drain().sent, 1)
+        self.assertEqual(len(FlakyEmailBackend.sent), 1)
+        dispatcher.close()
+
+    def test_permanent_failures_are_not_retried(self):
+        self.queue()
+        FlakyEmailBackend.failures = 1
+        FlakyEmailBackend.error = smtplib.SMTPRecipientsRefused({'jane@example.com': (550, b'No such user')})
+        self.addCleanup(setattr, FlakyEmailBackend, 'error', smtplib.SMTPServerDisconnected())
+        stats = EmailDispatcher(backend='flowgptapp.tests.FlakyEmailBackend').drain()
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.STATUS_FAILED)
+
+    def test_a_message_with_a_bad_header_fails_alone(self):
+        self.queue(count=3)
+        poisoned = OutboundEmail.objects.order_by('id')[1]
+        OutboundEmail.objects.filter(id=poisoned.id).update(subject="Hello\nBcc: everyone@example.com")
+        dispatcher = EmailDispatcher()
+        stats = dispatcher.drain()
+        dispatcher.close()
+        self.assertEqual((stats.sent, stats.retried, stats.failed), (2, 0, 1))
+        self.assertEqual(len(mail.outbox), 2)
+        poisoned.refresh_from_db()
+        self.assertEqual((poisoned.status, poisoned.attempts), (OutboundEmail.STATUS_FAILED, 1))
+        self.assertIn('BadHeaderError', poisoned.last_error)
+        self.assertFalse(OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENDING).exists())
+
+    @unittest.skipUnless(aiosmtpd, 'aiosmtpd is not installed')
+    def test_delivery_over_smtp(self):
+        received = []
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                received.append(envelope)
+                return '250 OK'
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        self.queue(count=50)
+        with self.settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                           EMAIL_HOST='127.0.0.1', EMAIL_PORT=port):
+            dispatcher = EmailDispatcher(batch_size=20, connections=2)
+            stats = dispatcher.drain()
+            dispatcher.close()
+        self.assertEqual(stats.sent, 50)
+        self.assertEqual(len(received), 50)
+        self.assertGreater(stats.rate, 0)
+
+
+class WebhookReceiver(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in for a webhook receiver. Answers with the queued statuses,
+    then 200, and records every request with the connection it came on.
+    """
+    daemon_threads = True
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            self.server.received.append((self.client_address, dict(self.headers), body))
+            status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.received = []
+        self.responses = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hooks/flowgpt"
+
+
+class WebhookTests(QueryBudgetMixin, FlowGPTFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.receiver = WebhookReceiver()
+        threading.Thread(target=self.receiver.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.receiver.server_close)
+        self.addCleanup(self.receiver.shutdown)
+        self.pipeline = self.pipelines[0]
+        self.pipeline.webhook_url = self.receiver.url
+        self.pipeline.webhook_secret = 's3cret'
+        self.pipeline.save()
+
+    def dispatch(self, **options):
+        dispatcher = WebhookDispatcher(**options)
+        self.addCleanup(dispatcher.close)
+        return dispatcher.drain()
+
+    def test_finished_execution_is_delivered_signed(self):
+        # Queuing the delivery costs one insert
+        with self.assertMaxQueries(5 + 2 * self.PIPELINE_LENGTH):
+            result = execute_pipeline(self.pipeline.id, "Hello world. Thank you.")
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.status, WebhookDelivery.STATUS_PENDING)
+
+        stats = self.dispatch()
+        self.assertEqual(stats.sent, 1)
+        _, headers, body = self.receiver.received[0]
+        self.assertTrue(webhooks.verify_signature('s3cret', headers['X-FlowGPT-Signature'], body))
+        self.assertFalse(webhooks.verify_signature('other', headers['X-FlowGPT-Signature'], body))
+        self.assertEqual(headers['X-FlowGPT-Delivery'], str(delivery.event_id))
+        payload = json.loads(body)
+        self.assertEqual(payload['execution_id'], result['metadata']['execution_id'])
+        self.assertTrue(payload['success'])
+        self.assertEqual(payload['result']['text'], result['text'])
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.response_status), (WebhookDelivery.STATUS_DELIVERED, 200))
+
+    def test_pipelines_without_a_webhook_queue_nothing(self):
+        execute_pipeline(self.pipelines[1].id, "Hello world.")
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_failed_executions_and_batches(self):
+        execute_pipeline_batch(self.pipeline.id, ["One.", "Two.", "Three."])
+        failing = mock.Mock(side_effect=RuntimeError('boom'))
+        with mock.patch('flowgptapp.graph.pipeline_executor.get_batch_function', return_value=failing), \
+                self.assertRaises(RuntimeError), self.assertLogs('flowgptapp.graph.pipeline_executor', 'ERROR'):
+            execute_pipeline_batch(self.pipeline.id, ["Four.", "Five."])
+        self.assertEqual(WebhookDelivery.objects.count(), 5)
+        self.assertEqual(self.dispatch(batch_size=2).sent, 5)
+        payloads = [json.loads(body) for _, _, body in self.receiver.received]
+        self.assertEqual(sorted(payload['success'] for payload in payloads), [False, False, True, True, True])
+        self.assertIn('boom', next(p for p in payloads if not p['success'])['result']['error'])
+
+    def test_connections_are_kept_alive(self):
+        for text in ("One.", "Two.", "Three.", "Four."):
+            execute_pipeline(self.pipeline.id, text)
+        self.assertEqual(self.dispatch(concurrency=1, batch_size=2).sent, 4)
+        self.assertEqual(len({address for address, _, _ in self.receiver.received}), 1)
+
+    def test_failures_are_retried_with_backoff(self):
+        execute_pipeline(self.pipeline.id, "Hello world.")
+        self.receiver.responses = [(503, {'Retry-After': '120'})]
+        stats = self.dispatch(backoff_base=10)
+        self.assertEqual((stats.sent, stats.retried), (0, 1))
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts, delivery.response_status),
+                         (WebhookDelivery.STATUS_PENDING, 1, 503))
+        self.assertGreater(delivery.next_attempt_at, timezone.now() + datetime.timedelta(seconds=100))
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.dispatch().sent, 1)
+        # The retry is the same event
+        event_ids = {headers['X-FlowGPT-Delivery'] for _, headers, _ in self.receiver.received}
+        self.assertEqual(event_ids, {str(delivery.event_id)})
+
+    def test_rejected_and_unreachable_receivers(self):
+        execute_pipeline(self.pipeline.id, "Hello world.")
+        self.receiver.responses = [(410, {})]
+        self.assertEqual(self.dispatch().failed, 1)
+        self.assertEqual(WebhookDelivery.objects.get().status, WebhookDelivery.STATUS_FAILED)
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            closed_port = probe.getsockname()[1]
+        WebhookDelivery.objects.update(url=f"http://127.0.0.1:{closed_port}/", status=WebhookDelivery.STATUS_PENDING,
+                                       attempts=0)
+        self.assertEqual(self.dispatch(max_attempts=2).retried, 1)
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.dispatch(max_attempts=2).failed, 1)
+        self.assertIn('ConnectError', WebhookDelivery.objects.get().last_error)
+
+    def test_unusable_urls_fail_without_retrying(self):
+        execute_pipeline(self.pipeline.id, "Hello world.")
+        for url, error in (("http://[::1", 'InvalidURL'), ("ftp://example.com/hook", 'UnsupportedProtocol')):
+            WebhookDelivery.objects.update(url=url, status=WebhookDelivery.STATUS_PENDING, attempts=0)
+            stats = self.dispatch()
+            self.assertEqual((stats.failed, stats.retried), (1, 0))
+            delivery = WebhookDelivery.objects.get()
+            self.assertEqual((delivery.status, delivery.attempts), (WebhookDelivery.STATUS_FAILED, 1))
+            self.assertIn(error, delivery.last_error)
+
+
+class StructuredLoggingTests(FlowGPTFixtureMixin, TestCase):
+
+    def capture(self, level=logging.DEBUG, **sampling):
+        """
+        Route the flowgptapp loggers to a queued JSON handler writing into a
+        buffer. Returns a function that flushes the handler and parses the lines.
+        """
+        buffer = io.StringIO()
+        handler = logs.QueueStreamHandler(buffer)
+        handler.setFormatter(logs.JsonFormatter())
+        handler.addFilter(logs.ExecutionContextFilter())
+        handler.addFilter(logs.SamplingFilter(**sampling))
+        logger = logging.getLogger('flowgptapp')
+        self.addCleanup(setattr, logger, 'handlers', logger.handlers)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.handlers = [handler]
+        logger.setLevel(level)
+
+        def records():
+            handler.close()
+            return [json.loads(line) for line in buffer.getvalue().splitlines()]
+        return records
+
+    def test_records_carry_execution_and_node_ids(self):
+        records = self.capture()
+        result = execute_pipeline(self.pipelines[0].id, 'Hello world. Thank you.')
+        execution_id = result['metadata']['execution_id']
+        by_message = {}
+        for record in records():
+            by_message.setdefault(record['message'], []).append(record)
+
+        self.assertEqual(len(by_message['Step recorded']), self.PIPELINE_LENGTH)
+        # Node functions run on LangGraph's threads and still carry the execution's ids
+        for record in by_message['Node finished'] + by_message['Step recorded']:
+            self.assertEqual(record['execution_id'], execution_id)
+            self.assertIn(record['node_id'], {node.id for node in self.nodes})
+        self.assertEqual([record['node_type'] for record in by_message['Node finished']],
+                         ['clean_text', 'summary', 'translate', 'uppercase'])
+        self.assertEqual(by_message['Execution completed'][0]['pipeline_id'], self.pipelines[0].id)
+
+    def test_errors_are_logged_with_their_traceback(self):
+        records = self.capture(level=logging.INFO)
+        pipeline = Pipeline.objects.create(name="Broken")
+        clean = Node.objects.create(name="Clean", node_type='clean_text')
+        summary = Node.objects.create(name="Summary", node_type='summary', config={'mode': 'abstractive'})
+        Edge.objects.create(pipeline=pipeline, source=clean, target=summary)
+        with self.assertRaises(ValueError):
+            execute_pipeline(pipeline.id, 'Hello world.')
+
+        node_failed, execution_failed = records()
+        execution_id = PipelineExecution.objects.get(pipeline=pipeline).id
+        self.assertEqual((node_failed['level'], node_failed['node_id'], node_failed['execution_id']),
+                         ('WARNING', summary.id, execution_id))
+        self.assertEqual((execution_failed['level'], execution_failed['execution_id']), ('ERROR', execution_id))
+        self.assertIn('ValueError', execution_failed['exception'])
+
+    def test_debug_events_are_sampled(self):
+        sampling = logs.SamplingFilter(rate=1.0, burst=2)
+        logger = logging.getLogger('flowgptapp.sampled')
+
+        def passed(level=logging.DEBUG, message="Step recorded"):
+            record = logger.makeRecord(logger.name, level, __file__, 0, message, (), None)
+            return record if sampling.filter(record) else None
+
+        with mock.patch('flowgptapp.logs.time.monotonic', return_value=100.0):
+            self.assertEqual(sum(passed() is not None for _ in range(5)), 2)
+            # Other messages and records above debug are not limited
+            self.assertIsNotNone(passed(message="Node finished"))
+            self.assertIsNotNone(passed(level=logging.WARNING))
+        with mock.patch('flowgptapp.logs.time.monotonic', return_value=101.0):
+            record = passed()
+            self.assertEqual(record.sampled_out, 3)
+            self.assertIsNone(passed())
+
+    def test_a_full_queue_drops_records_instead_of_blocking(self):
+        handler = logs.QueueStreamHandler(io.StringIO(), queue_size=2)
+        handler.listener.stop()
+        logger = logging.getLogger('flowgptapp.full')
+        for _ in range(5):
+            handler.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0, "Queued", (), None))
+        self.assertEqual(handler.dropped, 3)
+        handler.close()
+
+    def test_dropped_records_are_counted_across_threads(self):
+        handler = logs.QueueStreamHandler(io.StringIO(), queue_size=1)
+        handler.listener.stop()
+        logger = logging.getLogger('flowgptapp.full')
+        record = logger.makeRecord(logger.name, logging.INFO, __file__, 0, "Queued", (), None)
+        handler.enqueue(record)
+
+        def emit():
+            for _ in range(1000):
+                handler.enqueue(record)
+
+        threads = [threading.Thread(target=emit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(handler.dropped, 8000)
+        handler.close()
@@ -1,75 +1,195 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
+from django.core.exceptions import BadRequest
+from django.db import IntegrityError
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.conf import settings
+from asgiref.sync import sync_to_async
+import asyncio
+import base64
+import datetime
+import hashlib
 import json
-import traceback
+import logging
 
+import orjson
+
+from . import idempotency
 from .models import Pipeline, PipelineExecution, ExecutionStep, Contact
-from .graph.pipeline_executor import execute_pipeline
+from .graph.pipeline_executor import execute_pipeline, execute_pipeline_batch
+from .metrics import REGISTRY, EXECUTION_QUEUE_DEPTH
+from .notifier import NOTIFIER
+from .page_cache import ALL_PIPELINES, cached_execution_page, cached_page, pipeline_scope
+from .responses import OrjsonResponse, raw_json
+
+logger = logging.getLogger(__name__)
+
+
+EXECUTION_QUEUE_DEPTH.set_function(
+    lambda: PipelineExecution.objects.filter(is_complete=False).count()
+)
 
 
 def home(request):
     """
     Home page view showing available pipelines and execution form.
+    Served from the page cache until a pipeline changes.
     """
-    pipelines = Pipeline.objects.filter(is_active=True).order_by('name')
+    def render_page():
+        pipelines = Pipeline.objects.filter(is_active=True).order_by('name')
+        return render(request, 'flowgptapp/home.html', {'pipelines': pipelines})
     
-    context = {
-        'pipelines': pipelines,
-    }
-    
-    return render(request, 'flowgptapp/home.html', context)
+    return cached_page(request, 'home', ALL_PIPELINES, render_page)
 
 
 def pipeline_detail(request, pipeline_id):
     """
     View for detailed information about a specific pipeline.
+    Served from the page cache until the pipeline, its edges or nodes change.
     """
-    pipeline = get_object_or_404(Pipeline, id=pipeline_id)
-    edges = pipeline.edges.all().order_by('order')
+    def render_page():
+        pipeline = get_object_or_404(Pipeline, id=pipeline_id)
+        edges = pipeline.edges.select_related('source', 'target').order_by('order')
+        return render(request, 'flowgptapp/pipeline_detail.html', {'pipeline': pipeline, 'edges': edges})
     
-    context = {
-        'pipeline': pipeline,
-        'edges': edges,
-    }
+    return cached_page(request, f'pipeline:{pipeline_id}', pipeline_scope(pipeline_id), render_page)
+
+
+# Executions per history page, by default and at most
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Columns of the history list; the input and output texts are never loaded
+HISTORY_FIELDS = ('id', 'pipeline_id', 'pipeline__name', 'is_complete', 'started_at', 'completed_at')
+
+HISTORY_STATUSES = {'complete': True, 'running': False}
+
+
+def encode_history_cursor(execution) -> str:
+    """
+    Opaque cursor pointing after an execution row of the history.
+    """
+    value = f"{execution['started_at'].isoformat()}|{execution['id']}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_history_cursor(cursor: str):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        started_at, execution_id = value.split('|')
+        return datetime.datetime.fromisoformat(started_at), int(execution_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+async def get_history_page(params):
+    """
+    One page of the execution history, newest first, with the cursor of the
+    next page (None on the last page). ``params`` may filter by ``pipeline``
+    and ``status`` (complete or running) and set ``cursor`` and ``limit``.
+
+    Pages are fetched by keyset on ``(started_at, id)`` rather than by
+    offset, so every page costs one indexed range scan however far back it is.
+    """
+    executions = PipelineExecution.objects.order_by('-started_at', '-id')
+    if params.get('pipeline'):
+        executions = executions.filter(pipeline_id=int(params['pipeline']))
+    if params.get('status'):
+        if params['status'] not in HISTORY_STATUSES:
+            raise ValueError(f"Unknown status: {params['status']}")
+        executions = executions.filter(is_complete=HISTORY_STATUSES[params['status']])
+    if params.get('cursor'):
+        started_at, execution_id = decode_history_cursor(params['cursor'])
+        # The bound on started_at alone lets the database start the index
+        # scan at the cursor; the OR only settles ties within it
+        executions = executions.filter(
+            Q(started_at__lt=started_at) | Q(id__lt=execution_id), started_at__lte=started_at
+        )
+    limit = int(params.get('limit') or HISTORY_PAGE_SIZE)
+    if not 0 < limit <= HISTORY_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
     
-    return render(request, 'flowgptapp/pipeline_detail.html', context)
+    # One row more than the page tells whether there is a next page
+    rows = [row async for row in executions.values(*HISTORY_FIELDS)[:limit + 1]]
+    next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
 
-def execution_history(request):
+async def execution_history(request):
     """
-    View to list execution history of pipelines.
+    View to list execution history of pipelines, a page at a time.
     """
-    executions = PipelineExecution.objects.all().order_by('-started_at')[:50]
+    try:
+        executions, next_cursor = await get_history_page(request.GET)
+    except ValueError as e:
+        raise BadRequest(str(e))
     
     context = {
         'executions': executions,
+        'next_cursor': next_cursor,
+        'pipeline_filter': request.GET.get('pipeline', ''),
+        'status_filter': request.GET.get('status', ''),
+        'is_first_page': not request.GET.get('cursor'),
     }
     
     return render(request, 'flowgptapp/execution_history.html', context)
 
 
-def execution_detail(request, execution_id):
+async def execution_history_api(request):
     """
-    View for detailed information about a specific execution.
+    API view listing executions, newest first. Takes the same ``pipeline``,
+    ``status``, ``cursor`` and ``limit`` parameters as the history page; pass
+    ``next_cursor`` back as ``cursor`` for the next page.
     """
-    execution = get_object_or_404(PipelineExecution, id=execution_id)
-    steps = execution.steps.all().order_by('started_at')
-    
     try:
-        # Parse output data if available
-        output_data = json.loads(execution.output_data) if execution.output_data else {}
-    except json.JSONDecodeError:
-        output_data = {"error": "Invalid JSON data"}
+        executions, next_cursor = await get_history_page(request.GET)
+    except ValueError as e:
+        return OrjsonResponse({'error': str(e)}, status=400)
     
-    context = {
-        'execution': execution,
-        'steps': steps,
-        'output_data': output_data,
-    }
+    return OrjsonResponse({
+        'executions': [
+            {
+                'id': execution['id'],
+                'pipeline_id': execution['pipeline_id'],
+                'pipeline_name': execution['pipeline__name'],
+                'is_complete': execution['is_complete'],
+                'started_at': execution['started_at'].isoformat(),
+                'completed_at': execution['completed_at'].isoformat() if execution['completed_at'] else None,
+            }
+            for execution in executions
+        ],
+        'next_cursor': next_cursor,
+    })
+
+
+def execution_detail(request, execution_id):
+    """
+    View for detailed information about a specific execution.
+    """
+    def render_page():
+        execution = get_object_or_404(PipelineExecution.objects.select_related('pipeline'), id=execution_id)
+        steps = execution.steps.select_related('node').order_by('started_at')
+        
+        try:
+            # Parse output data if available
+            output_data = json.loads(execution.output_data) if execution.output_data else {}
+        except json.JSONDecodeError:
+            output_data = {"error": "Invalid JSON data"}
+        
+        context = {
+            'execution': execution,
+            'steps': steps,
+            'output_data': output_data,
+        }
+        
+        return render(request, 'flowgptapp/execution_detail.html', context), execution
     
-    return render(request, 'flowgptapp/execution_detail.html', context)
+    # Completed executions never change, so their pages are cached until deleted
+    return cached_execution_page(request, execution_id, render_page)
 
 
 def contact(request):
@@ -101,29 +221,95 @@ def contact(request):
     return render(request, 'flowgptapp/contact.html')
 
 
+def replay_response(execution, pipeline_id: int):
+    """
+    The response to a submission repeating the Idempotency-Key of an
+    earlier one: the original execution, or its outcome once complete.
+    """
+    if execution['pipeline_id'] != pipeline_id:
+        return OrjsonResponse({'error': 'Idempotency-Key was already used for another pipeline'}, status=422)
+    
+    if not execution['is_complete']:
+        response = OrjsonResponse({
+            'success': True,
+            'execution_id': execution['id'],
+            'is_complete': False,
+        }, status=202)
+    else:
+        result = orjson.loads(execution['output_data'] or '{}')
+        if result.get('error'):
+            response = OrjsonResponse({'error': result['error']}, status=500)
+        else:
+            response = OrjsonResponse({
+                'success': True,
+                'execution_id': execution['id'],
+                'result': result,
+            })
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
 @csrf_exempt
-def execute_pipeline_view(request):
+async def execute_pipeline_view(request):
     """
     View to execute a pipeline with input text.
+    
+    The pipeline runs on the request's worker thread, so under ASGI the
+    event loop keeps serving other requests, status polls among them,
+    while it executes.
+    
+    A submission with an ``Idempotency-Key`` header that repeats the key of
+    a recent one gets the original execution back instead of running the
+    pipeline again: its result once complete, or a 202 while it runs.
     """
     if request.method != 'POST':
-        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+        return OrjsonResponse({'error': 'Only POST method is allowed'}, status=405)
     
     try:
         # Parse request data
         pipeline_id = request.POST.get('pipeline_id')
-        input_text = request.POST.get('input_text', '')
+        input_texts = request.POST.getlist('input_text')
+        input_text = input_texts[-1] if input_texts else ''
+        idempotency_key = request.headers.get('Idempotency-Key')
         
         if not pipeline_id:
-            return JsonResponse({'error': 'Pipeline ID is required'}, status=400)
+            return OrjsonResponse({'error': 'Pipeline ID is required'}, status=400)
+        
+        if idempotency_key is not None:
+            try:
+                idempotency.validate_key(idempotency_key)
+            except ValueError as e:
+                return OrjsonResponse({'error': str(e)}, status=400)
+            if len(input_texts) > 1:
+                return OrjsonResponse({'error': 'Idempotency-Key is not supported for batches'}, status=400)
+            await sync_to_async(idempotency.prune_expired_keys)()
+            execution = await sync_to_async(idempotency.find_execution)(idempotency_key)
+            if execution is not None:
+                return replay_response(execution, int(pipeline_id))
+        
+        # Several inputs run together as a batch
+        if len(input_texts) > 1:
+            results = await sync_to_async(execute_pipeline_batch)(int(pipeline_id), input_texts)
+            return OrjsonResponse({
+                'success': True,
+                'execution_ids': [r.get('metadata', {}).get('execution_id') for r in results],
+                'results': results
+            })
         
         # Execute the pipeline
-        result = execute_pipeline(int(pipeline_id), input_text)
+        try:
+            result = await sync_to_async(execute_pipeline)(int(pipeline_id), input_text, idempotency_key)
+        except IntegrityError:
+            # A concurrent attempt with the same key started the execution first
+            execution = idempotency_key and await sync_to_async(idempotency.find_execution)(idempotency_key)
+            if not execution:
+                raise
+            return replay_response(execution, int(pipeline_id))
         
         # Get the execution ID from metadata
         execution_id = result.get('metadata', {}).get('execution_id')
         
-        return JsonResponse({
+        return OrjsonResponse({
             'success': True,
             'execution_id': execution_id,
             'result': result
@@ -131,45 +317,212 @@ def execute_pipeline_view(request):
         
     except Exception as e:
         error_msg = str(e)
-        traceback.print_exc()
-        return JsonResponse({'error': error_msg}, status=500)
+        logger.exception("Pipeline submission failed", extra={'pipeline_id': request.POST.get('pipeline_id')})
+        return OrjsonResponse({'error': error_msg}, status=500)
+
 
+# Step fields the status API can return, selected with ?fields=
+STEP_FIELDS = ('id', 'node_name', 'node_type', 'is_complete', 'started_at', 'completed_at', 'output')
 
-def get_execution_status(request, execution_id):
+
+def parse_status_fields(value: str):
     """
-    API view to get the current status of an execution.
+    Parse ``?fields=`` into the step fields to return and the output keys
+    to keep, e.g. ``node_name,output.text`` keeps only the node name and
+    the text of each step's output. No output keys means the whole output.
+    """
+    if not value:
+        return set(STEP_FIELDS), None
+    fields = set()
+    output_keys = set()
+    for name in filter(None, (part.strip() for part in value.split(','))):
+        if name.startswith('output.'):
+            fields.add('output')
+            output_keys.add(name[len('output.'):])
+        elif name in STEP_FIELDS:
+            fields.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    whole_output = 'output' in (part.strip() for part in value.split(','))
+    return fields, None if whole_output or not output_keys else output_keys
+
+
+def truncate_output(value, max_chars: int):
+    """
+    Shorten every string in a step output to ``max_chars`` characters.
+    """
+    if isinstance(value, str):
+        return value[:max_chars] + '...' if len(value) > max_chars else value
+    if isinstance(value, dict):
+        return {key: truncate_output(item, max_chars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [truncate_output(item, max_chars) for item in value]
+    return value
+
+
+def execution_summary(execution_id):
+    """
+    One query for the execution and a summary of its steps, enough to
+    decide whether anything changed since a client's last poll.
+    """
+    return (
+        PipelineExecution.objects.filter(id=execution_id)
+        .annotate(step_count=Count('steps'), last_step_id=Max('steps__id'),
+                  last_step_completed_at=Max('steps__completed_at'))
+        .values('id', 'is_complete', 'started_at', 'completed_at', 'pipeline__name',
+                'current_node__name', 'step_count', 'last_step_id', 'last_step_completed_at')
+    )
+
+
+async def execution_status_response(request, execution_id, since_step, max_output, fields, output_keys,
+                                    baseline=False):
+    """
+    Build the status response of an execution. Also returns whether it has
+    anything new for the client: False for a 304, or for a poll with
+    ``since_step`` that has no new steps while the execution is running.
+    With ``baseline``, for a poll without any cursor, a running execution
+    has nothing new yet.
     """
     try:
-        execution = get_object_or_404(PipelineExecution, id=execution_id)
-        steps = execution.steps.all().order_by('started_at')
+        execution = await execution_summary(execution_id).afirst()
+        if execution is None:
+            return OrjsonResponse({'error': f'Execution {execution_id} not found'}, status=404), True
+        
+        # The wait a client asks for does not change what it is sent
+        params = sorted((key, values) for key, values in request.GET.lists() if key != 'wait')
+        version = repr((sorted(execution.items()), params))
+        etag = quote_etag(hashlib.md5(version.encode()).hexdigest())
+        last_modified = max(filter(None, (
+            execution['started_at'], execution['completed_at'], execution['last_step_completed_at']
+        )))
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified.timestamp())
+        if response is not None:
+            return response, False
+        
+        steps = ExecutionStep.objects.filter(execution_id=execution_id, id__gt=since_step).order_by('id')
+        if 'node_name' in fields or 'node_type' in fields:
+            steps = steps.select_related('node')
+        deferred = ['input_data'] if 'output' in fields else ['input_data', 'output_data']
+        steps = steps.defer(*deferred)
         
         steps_data = []
-        for step in steps:
-            try:
-                output = json.loads(step.output_data) if step.output_data else {}
-            except json.JSONDecodeError:
-                output = {"error": "Invalid output data"}
-                
-            steps_data.append({
-                'node_name': step.node.name,
-                'node_type': step.node.node_type,
-                'is_complete': step.is_complete,
-                'started_at': step.started_at.isoformat(),
-                'completed_at': step.completed_at.isoformat() if step.completed_at else None,
-                'output': output,
-            })
+        next_since_step = since_step
+        async for step in steps:
+            next_since_step = step.id
+            data = {}
+            if 'id' in fields:
+                data['id'] = step.id
+            if 'node_name' in fields:
+                data['node_name'] = step.node.name
+            if 'node_type' in fields:
+                data['node_type'] = step.node.node_type
+            if 'is_complete' in fields:
+                data['is_complete'] = step.is_complete
+            if 'started_at' in fields:
+                data['started_at'] = step.started_at.isoformat()
+            if 'completed_at' in fields:
+                data['completed_at'] = step.completed_at.isoformat() if step.completed_at else None
+            if 'output' in fields and output_keys is None and not max_output:
+                # The executor stores outputs as JSON, which is sent as is
+                data['output'] = raw_json(step.output_data or '{}')
+            elif 'output' in fields:
+                try:
+                    output = json.loads(step.output_data) if step.output_data else {}
+                except json.JSONDecodeError:
+                    output = {"error": "Invalid output data"}
+                if output_keys is not None:
+                    output = {key: output[key] for key in output_keys if key in output}
+                if max_output:
+                    output = truncate_output(output, max_output)
+                data['output'] = output
+            steps_data.append(data)
         
-        return JsonResponse({
-            'execution_id': execution.id,
-            'pipeline_name': execution.pipeline.name,
-            'is_complete': execution.is_complete,
-            'started_at': execution.started_at.isoformat(),
-            'completed_at': execution.completed_at.isoformat() if execution.completed_at else None,
-            'current_node': execution.current_node.name if execution.current_node else None,
+        response = OrjsonResponse({
+            'execution_id': execution['id'],
+            'pipeline_name': execution['pipeline__name'],
+            'is_complete': execution['is_complete'],
+            'started_at': execution['started_at'].isoformat(),
+            'completed_at': execution['completed_at'].isoformat() if execution['completed_at'] else None,
+            'current_node': execution['current_node__name'],
+            'step_count': execution['step_count'],
+            'next_since_step': next_since_step,
             'steps': steps_data,
         })
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        # Clients may keep the response but must revalidate it on every poll
+        response['Cache-Control'] = 'no-cache'
+        if baseline:
+            changed = execution['is_complete']
+        else:
+            changed = not since_step or bool(steps_data) or execution['is_complete']
+        return response, changed
         
     except Exception as e:
         error_msg = str(e)
-        traceback.print_exc()
-        return JsonResponse({'error': error_msg}, status=500)
+        logger.exception("Execution status failed", extra={'execution_id': execution_id})
+        return OrjsonResponse({'error': error_msg}, status=500), True
+
+
+
+async def get_execution_status(request, execution_id):
+    """
+    API view to get the current status of an execution.
+    
+    ``?since_step=<id>`` returns only the steps recorded after that step, and
+    ``next_since_step`` is the cursor for the next poll. ``?fields=`` selects
+    the step fields (``output.<key>`` keeps single output keys) and
+    ``?max_output=<chars>`` truncates long output strings. Responses carry an
+    ETag and Last-Modified, so a poll with nothing new gets a 304 after a
+    single query, without loading or deserialising any step.
+    
+    ``?wait=<seconds>`` turns the poll into a long poll: while there is
+    nothing new the request is held, without a thread, until the executor
+    reports progress for the execution or the wait (capped at
+    ``FLOWGPT_STATUS_MAX_WAIT``) runs out. Without ``since_step`` or a
+    conditional header, a running execution is reported on its next progress.
+    """
+    try:
+        since_step = int(request.GET.get('since_step') or 0)
+        max_output = int(request.GET.get('max_output') or 0)
+        fields, output_keys = parse_status_fields(request.GET.get('fields', ''))
+        wait = float(request.GET.get('wait') or 0)
+        if not 0 <= wait < float('inf'):
+            raise ValueError(f"Invalid wait: {request.GET['wait']}")
+    except ValueError as e:
+        return OrjsonResponse({'error': str(e)}, status=400)
+    
+    # With no cursor, the state when the request arrives is what the client
+    # waits to see change
+    baseline = bool(wait) and not since_step and not (
+        request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since'))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, settings.FLOWGPT_STATUS_MAX_WAIT)
+    while True:
+        # Subscribe before checking, so progress made during the check
+        # still wakes the request
+        event = NOTIFIER.subscribe(execution_id) if wait else None
+        try:
+            response, changed = await execution_status_response(
+                request, execution_id, since_step, max_output, fields, output_keys, baseline
+            )
+            remaining = deadline - loop.time()
+            if changed or event is None or remaining <= 0:
+                return response
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+                baseline = False
+            except asyncio.TimeoutError:
+                # Check once more: progress made by another process is not notified
+                pass
+        finally:
+            if event is not None:
+                NOTIFIER.unsubscribe(execution_id, event)
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint exposing executor and database metrics.
+    """
+    return HttpResponse(REGISTRY.render_text(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
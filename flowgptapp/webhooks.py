@@ -0,0 +1,287 @@
+"""
+Execution completion webhooks for FlowGPT.
+
+A pipeline with a ``webhook_url`` gets notified when each of its executions
+finishes. The executor stores the finished payload in the ``WebhookDelivery``
+table with the query that records the result, and the ``WebhookDispatcher``
+(run by the ``dispatch_webhooks`` management command) posts due deliveries
+in batches. It keeps one pooled ``httpx`` client, so requests to the same
+receiver reuse kept-alive connections, sends a batch over several of them at
+once and retries failed deliveries with exponential backoff.
+
+Every request carries the event name and the delivery's event id, which
+stays the same across retries so receivers can drop duplicates. When the
+pipeline or ``FLOWGPT_WEBHOOK_SECRET`` holds a secret, the
+``X-FlowGPT-Signature`` header signs the timestamp and body with
+HMAC-SHA256: ``t=<timestamp>,v1=<hex digest of "<timestamp>." + body>``.
+"""
+import datetime
+import hashlib
+import hmac
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import httpx
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .graph.state import dumps
+from .metrics import (
+    WEBHOOK_DELIVERY_LATENCY, WEBHOOK_REQUEST_DURATION, WEBHOOKS_DELIVERED, WEBHOOKS_FAILED, WEBHOOKS_RETRIED,
+)
+from .models import WebhookDelivery
+from .outbox import (
+    DEFAULT_BACKOFF_BASE, DEFAULT_BACKOFF_MAX, DEFAULT_BATCH_SIZE, DEFAULT_CLAIM_TIMEOUT, DEFAULT_MAX_ATTEMPTS,
+    DispatchStats, backoff_delay,
+)
+from .responses import raw_json
+
+
+COMPLETED_EVENT = 'execution.completed'
+
+EVENT_HEADER = 'X-FlowGPT-Event'
+DELIVERY_HEADER = 'X-FlowGPT-Delivery'
+SIGNATURE_HEADER = 'X-FlowGPT-Signature'
+
+USER_AGENT = 'FlowGPT-Webhooks/1.0'
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CONCURRENCY = 4
+
+# Signatures older than this are rejected by verify_signature
+DEFAULT_TOLERANCE = 300
+
+# Client errors worth retrying; any other response below 500 is final
+RETRYABLE_STATUSES = frozenset({408, 425, 429})
+
+
+class DeliveryError(Exception):
+    """
+    The receiver answered a delivery with an unsuccessful status.
+    """
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def completion_delivery(pipeline_id: int, url: str, execution_id: int, output_data: str,
+                        success: bool) -> WebhookDelivery:
+    """
+    The delivery of a finished execution. ``output_data`` is the final
+    state as the executor stored it and is embedded without being parsed.
+    """
+    payload = dumps({
+        'event': COMPLETED_EVENT,
+        'pipeline_id': pipeline_id,
+        'execution_id': execution_id,
+        'success': success,
+        'completed_at': timezone.now(),
+        'result': raw_json(output_data),
+    })
+    return WebhookDelivery(pipeline_id=pipeline_id, execution_id=execution_id, url=url, payload=payload)
+
+
+def enqueue(deliveries: Iterable[WebhookDelivery]) -> None:
+    deliveries = list(deliveries)
+    if deliveries:
+        WebhookDelivery.objects.bulk_create(deliveries)
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance: int = DEFAULT_TOLERANCE,
+                     now: Optional[float] = None) -> bool:
+    """
+    Check a signature header, as a receiver would. Rejects signatures older
+    than ``tolerance`` seconds, so a captured request cannot be replayed later.
+    """
+    fields = dict(part.partition('=')[::2] for part in header.split(','))
+    try:
+        timestamp = int(fields['t'])
+    except (KeyError, ValueError):
+        return False
+    if abs((time.time() if now is None else now) - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), f"t={timestamp},v1={fields.get('v1', '')}")
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    # Only the delay-seconds form; an HTTP date falls back to the backoff
+    try:
+        return max(float(response.headers['Retry-After']), 0.0)
+    except (KeyError, ValueError):
+        return None
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Whether retrying a failed delivery cannot help: the receiver rejected
+    it or its URL cannot be requested, rather than the receiver being
+    unreachable or overloaded.
+    """
+    if isinstance(error, DeliveryError):
+        return error.status_code < 500 and error.status_code not in RETRYABLE_STATUSES
+    # Network errors and timeouts are worth retrying; a malformed URL, an
+    # unsupported scheme or anything else raised building the request is not
+    return isinstance(error, httpx.UnsupportedProtocol) or not isinstance(error, httpx.HTTPError)
+
+
+class WebhookDispatcher:
+    """
+    Delivers due webhooks over a pool of kept-alive HTTP connections.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 timeout: Optional[float] = None, transport: Optional[httpx.BaseTransport] = None):
+        self.batch_size = batch_size
+        self.concurrency = max(concurrency, 1)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.claim_timeout = claim_timeout
+        if timeout is None:
+            timeout = getattr(settings, 'FLOWGPT_WEBHOOK_TIMEOUT', DEFAULT_TIMEOUT)
+        # One client for every delivery: its pool keeps a connection per
+        # receiver open between batches
+        self.client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            headers={'User-Agent': USER_AGENT, 'Content-Type': 'application/json'},
+            transport=transport,
+        )
+        self.executor = ThreadPoolExecutor(self.concurrency) if self.concurrency > 1 else None
+
+    def claim(self) -> List[WebhookDelivery]:
+        """
+        Claim a batch of due deliveries, so concurrent dispatchers never post
+        the same delivery twice.
+        """
+        now = timezone.now()
+        due = (
+            Q(status=WebhookDelivery.STATUS_PENDING, next_attempt_at__lte=now)
+            | Q(status=WebhookDelivery.STATUS_SENDING,
+                claimed_at__lt=now - datetime.timedelta(seconds=self.claim_timeout))
+        )
+        ids = list(WebhookDelivery.objects.filter(due).values_list('id', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        WebhookDelivery.objects.filter(due, id__in=ids).update(
+            status=WebhookDelivery.STATUS_SENDING, claim_token=token, claimed_at=now
+        )
+        # The secret is read now, so a rotated secret signs pending retries too
+        return list(
+            WebhookDelivery.objects.filter(claim_token=token)
+            .select_related('pipeline').defer('pipeline__description')
+        )
+
+    def headers(self, delivery: WebhookDelivery, body: bytes) -> dict:
+        headers = {EVENT_HEADER: COMPLETED_EVENT, DELIVERY_HEADER: str(delivery.event_id)}
+        secret = delivery.pipeline.webhook_secret or getattr(settings, 'FLOWGPT_WEBHOOK_SECRET', '')
+        if secret:
+            headers[SIGNATURE_HEADER] = sign(secret, int(time.time()), body)
+        return headers
+
+    def send_one(self, delivery: WebhookDelivery) -> Tuple[WebhookDelivery, Optional[int], Optional[Exception]]:
+        """
+        Post one delivery. Returns it with the response status, if any, and
+        the error that made it fail.
+        """
+        body = delivery.payload.encode()
+        start = time.perf_counter()
+        try:
+            response = self.client.post(delivery.url, content=body, headers=self.headers(delivery, body))
+        except Exception as e:
+            # Recorded against the delivery instead of failing the whole batch
+            return delivery, None, e
+        finally:
+            WEBHOOK_REQUEST_DURATION.observe(time.perf_counter() - start)
+        if response.is_success:
+            return delivery, response.status_code, None
+        return delivery, response.status_code, DeliveryError(response.status_code, retry_after(response))
+
+    def send(self, deliveries: List[WebhookDelivery]):
+        if self.executor is None:
+            return [self.send_one(delivery) for delivery in deliveries]
+        return list(self.executor.map(self.send_one, deliveries))
+
+    def record(self, results) -> DispatchStats:
+        """
+        Store the outcome of a batch with one bulk update.
+        """
+        stats = DispatchStats()
+        now = timezone.now()
+        for delivery, status_code, error in results:
+            delivery.attempts += 1
+            delivery.claim_token = None
+            delivery.response_status = status_code
+            if error is None:
+                delivery.status = WebhookDelivery.STATUS_DELIVERED
+                delivery.delivered_at = now
+                delivery.last_error = ''
+                WEBHOOK_DELIVERY_LATENCY.observe((now - delivery.created_at).total_seconds())
+                stats.sent += 1
+                continue
+            delivery.last_error = f"{type(error).__name__}: {error}"
+            if is_permanent(error) or delivery.attempts >= self.max_attempts:
+                delivery.status = WebhookDelivery.STATUS_FAILED
+                stats.failed += 1
+            else:
+                delay = backoff_delay(delivery.attempts, self.backoff_base, self.backoff_max)
+                if getattr(error, 'retry_after', None) is not None:
+                    # Honour the receiver's Retry-After, within the longest backoff
+                    delay = min(max(delay, error.retry_after), self.backoff_max)
+                delivery.status = WebhookDelivery.STATUS_PENDING
+                delivery.next_attempt_at = now + datetime.timedelta(seconds=delay)
+                stats.retried += 1
+
+        if results:
+            WebhookDelivery.objects.bulk_update(
+                [delivery for delivery, _, _ in results],
+                ['status', 'attempts', 'next_attempt_at', 'claim_token', 'response_status', 'last_error',
+                 'delivered_at'],
+            )
+        WEBHOOKS_DELIVERED.inc(stats.sent)
+        WEBHOOKS_RETRIED.inc(stats.retried)
+        WEBHOOKS_FAILED.inc(stats.failed)
+        return stats
+
+    def dispatch_once(self) -> DispatchStats:
+        """
+        Claim and deliver one batch of due webhooks.
+        """
+        deliveries = self.claim()
+        if not deliveries:
+            return DispatchStats()
+        start = time.perf_counter()
+        results = self.send(deliveries)
+        elapsed = time.perf_counter() - start
+        stats = self.record(results)
+        stats.seconds = elapsed
+        return stats
+
+    def drain(self) -> DispatchStats:
+        """
+        Deliver batches until no webhook is due.
+        """
+        total = DispatchStats()
+        while True:
+            stats = self.dispatch_once()
+            if not (stats.sent or stats.retried or stats.failed):
+                return total
+            total.add(stats)
+
+    def close(self) -> None:
+        self.client.close()
+        if self.executor is not None:
+            self.executor.shutdown()